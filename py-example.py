@@ -16,10 +16,10 @@ if "HDF5_PLUGIN_PATH" not in os.environ:
         print("Warning: Could not find libH5Zturbopfor.so in build/. Please run 'source setup.sh' or build the project.")
 
 import h5py
+import turbopfor
 
 # Configuration
 OUTPUT_FILE = "demo_weather_data.h5"
-FILTER_ID = 62016
 SHAPE = (100, 100, 100) # Time, Lat, Lon
 CHUNK_SHAPE = (100, 20, 20) # Optimized for Timeseries 
 
@@ -39,32 +39,6 @@ def generate_weather_data(shape):
     data += np.random.normal(0, 0.5, shape)
     return data.astype(np.float32)
 
-def quantize_fixed(data, multiplier):
-    """
-    Quantizes Float32 data using a fixed precision multiplier.
-    Formula: int_val = (float_val - offset) * multiplier
-    Returns: (int16_data, scale, offset)
-    """
-    print(f"Quantizing data (Fixed Multiplier: {multiplier}x)...")
-    
-    # We use an offset to center the data or fit it within int16
-    # If we didn't use an offset, 300K * 100 = 30000 (fits), but 330K * 100 overflows.
-    # Using min_val as offset ensures we start from 0.
-    offset = np.nanmin(data)
-    
-    # Calculate scale factor for reconstruction (value = int * scale + offset)
-    scale = 1.0 / multiplier
-    
-    # Quantize
-    scaled_data = (data - offset) * multiplier
-    
-    # Check for overflow
-    if np.nanmax(np.abs(scaled_data)) > 32767:
-        print(f"WARNING: Data range too large for multiplier {multiplier} in Int16!")
-    
-    data_int16 = np.round(scaled_data).astype(np.int16)
-    return data_int16, scale, offset
-
 def main():
     # 1. Create Data
     data_float = generate_weather_data(SHAPE)
@@ -72,20 +46,22 @@ def main():
     # 2. Prepare Datasets
     datasets = []
     
+    # The filter quantizes float32 itself: int_val = round((float_val - offset) * multiplier)
+    # Using the minimum as offset keeps the stored integers small.
+    offset = float(np.nanmin(data_float))
+
     # Case A: High Precision (0.01 K -> Multiplier 100)
-    d_100, s_100, o_100 = quantize_fixed(data_float, 100.0)
     datasets.append({
         "name": "temperature_high_res",
         "desc": "Precision 0.01 (100x)",
-        "data": d_100, "scale": s_100, "offset": o_100
+        "multiplier": 100.0, "offset": offset
     })
     
     # Case B: Low Precision (0.05 K -> Multiplier 20)
-    d_20, s_20, o_20 = quantize_fixed(data_float, 20.0)
     datasets.append({
         "name": "temperature_low_res",
         "desc": "Precision 0.05 (20x)",
-        "data": d_20, "scale": s_20, "offset": o_20
+        "multiplier": 20.0, "offset": offset
     })
     
     # 3. Write Compressed File
@@ -94,22 +70,16 @@ def main():
         os.remove(OUTPUT_FILE)
         
     with h5py.File(OUTPUT_FILE, "w", libver='latest') as f:
-        # Filter Args: [type=0(short), ignored, dim0, dim1, dim2, ...]
-        # We pass all chunk dimensions so the filter can flatten them correctly
-        cd_values = (0, 0) + CHUNK_SHAPE
-        
         for ds_info in datasets:
-            dset = f.create_dataset(
-                ds_info["name"],
-                data=ds_info["data"],
-                chunks=CHUNK_SHAPE,
-                compression=FILTER_ID,
-                compression_opts=cd_values
-            )
+            # chunks and the filter's cd_values (type, multiplier, offset, chunk dims)
+            # come from the same shape, so they cannot disagree
+            options = turbopfor.dataset_options(CHUNK_SHAPE, np.float32, mask=True,
+                                                multiplier=ds_info["multiplier"],
+                                                offset=ds_info["offset"])
+            dset = f.create_dataset(ds_info["name"], data=data_float, **options)
             
-            # Save quantization parameters
-            dset.attrs["scale_factor"] = ds_info["scale"]
-            dset.attrs["add_offset"] = ds_info["offset"]
+            # The filter dequantizes on read, so no CF scale_factor/add_offset here
+            dset.attrs["precision"] = 1.0 / ds_info["multiplier"]
             dset.attrs["units"] = "Celsius"
             dset.attrs["description"] = ds_info["desc"]
 
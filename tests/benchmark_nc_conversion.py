@@ -14,14 +14,19 @@ if "HDF5_PLUGIN_PATH" not in os.environ:
 
 import h5py
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import turbopfor
+
 INPUT_FILE = "material/norway_tasmin_2020.nc4"
 OUTPUT_RAW = "material/benchmark_raw.h5"
 OUTPUT_GZIP = "material/benchmark_gzip.h5"
 OUTPUT_LZF = "material/benchmark_lzf.h5"
 OUTPUT_SZIP = "material/benchmark_szip.h5"
 OUTPUT_TURBO = "material/benchmark_turbopfor.h5"
+OUTPUT_CONVERT = "material/benchmark_turbopfor_convert.h5"
 
-FILTER_ID = 62016
+# Fixed precision of the quantized outputs: 0.05 K
+MULTIPLIER = 20.0
 # Chunking: All time steps, small spatial block
 # Input shape is (366, 1550, 1195)
 CHUNK_SHAPE = (366, 20, 20) 
@@ -54,43 +59,25 @@ def benchmark_read_timeseries(filename, num_points=1000):
         
     return end_time - start_time
 
-def quantize_fixed(data, multiplier, fill_value_float):
+def benchmark_read_points(filename, num_points=1000):
     """
-    Quantizes Float32 data to Int16 with fixed precision.
-    Handles FillValues by mapping them to -32768.
+    Same random timeseries as benchmark_read_timeseries, fetched in one
+    turbopfor.read_points batch that decodes each touched chunk once.
     """
-    print(f"  Quantizing (Multiplier: {multiplier}x)...")
-    
-    # Create mask for valid data
-    # Check for NaN or specific FillValue
-    if fill_value_float is not None:
-        mask = (data != fill_value_float) & (~np.isnan(data))
-    else:
-        mask = ~np.isnan(data)
-        
-    valid_data = data[mask]
-    
-    if valid_data.size == 0:
-        return np.full(data.shape, -32768, dtype=np.int16), 1.0/multiplier, 0.0
+    if not os.path.exists(filename):
+        return float('nan')
 
-    # Calculate offset from valid data min
-    offset = np.min(valid_data)
-    scale = 1.0 / multiplier
-    
-    # Prepare output array filled with "No Data" (-32768)
-    out = np.full(data.shape, -32768, dtype=np.int16)
-    
-    # Quantize valid data
-    # val_int = (val_float - offset) * multiplier
-    quantized = (valid_data - offset) * multiplier
-    
-    # Check bounds
-    if np.max(np.abs(quantized)) > 32767:
-        print("  WARNING: Quantized values exceed Int16 range!")
-        
-    out[mask] = np.round(quantized).astype(np.int16)
-    
-    return out, scale, offset
+    with h5py.File(filename, "r") as f:
+        dset = f["tasmin"]
+        shape = dset.shape
+        ys = np.random.randint(0, shape[1], num_points)
+        xs = np.random.randint(0, shape[2], num_points)
+
+        start_time = time.time()
+        _ = turbopfor.read_points(dset, ys, xs)
+        end_time = time.time()
+
+    return end_time - start_time
 
 def run_benchmark():
     if not os.path.exists(INPUT_FILE):
@@ -112,14 +99,21 @@ def run_benchmark():
         print(f"  Dtype: {data.dtype}")
         print(f"  FillValue: {fill_value}")
 
-        # Convert Kelvin to Celsius
+        # Convert Kelvin to Celsius, missing cells become NaN
         print("  Converting Kelvin to Celsius...")
-        valid_mask = (data != fill_value) & (~np.isnan(data))
-        data[valid_mask] -= 273.15
+        data = data.astype(np.float32)
+        data[data == fill_value] = np.nan
+        data -= 273.15
 
     # --- 1. Quantize Data (Int16) ---
-    print(f"\nQuantizing Data (Multiplier: 20.0x)...")
-    data_int16, scale, offset = quantize_fixed(data, 20.0, fill_value)
+    # TurboPFor quantizes float32 in the filter: int_val = round((float_val - offset) * multiplier).
+    # The other codecs cannot, so they get the same integers, with -32768 for missing cells.
+    print(f"\nQuantizing Data (Multiplier: {MULTIPLIER}x)...")
+    offset = float(np.nanmin(data))
+    scale = 1.0 / MULTIPLIER
+    data_int16 = np.full(data.shape, -32768, dtype=np.int16)
+    valid = ~np.isnan(data)
+    data_int16[valid] = np.round((data[valid] - offset) * MULTIPLIER)
 
     # --- 2. Raw Int16 (Uncompressed) ---
     print(f"\nWriting {OUTPUT_RAW} (Int16, Uncompressed)...")
@@ -182,28 +176,29 @@ def run_benchmark():
         print(f"  Failed: {e}")
         if os.path.exists(OUTPUT_SZIP): os.remove(OUTPUT_SZIP)
 
-    # --- 4. TurboPFor Int16 ---
-    print(f"\nWriting {OUTPUT_TURBO} (Int16, TurboPFor)...")
+    # --- 4. TurboPFor, quantized by the filter ---
+    # Stores the same integers as the Int16 files; missing cells go to the validity bitmap
+    print(f"\nWriting {OUTPUT_TURBO} (Float32 quantized by the filter, TurboPFor)...")
     start = time.time()
     
     if os.path.exists(OUTPUT_TURBO): os.remove(OUTPUT_TURBO)
     with h5py.File(OUTPUT_TURBO, "w", libver='latest') as f:
-        # Filter Args: [type=0(short), ignored, dim0, dim1, dim2]
-        cd_values = (0, 0) + CHUNK_SHAPE
-        
-        dset = f.create_dataset(
-            "tasmin",
-            data=data_int16,
-            chunks=CHUNK_SHAPE,
-            compression=FILTER_ID,
-            compression_opts=cd_values
-        )
-        dset.attrs["scale_factor"] = scale
-        dset.attrs["add_offset"] = offset
-        dset.attrs["_FillValue"] = -32768
+        options = turbopfor.dataset_options(CHUNK_SHAPE, np.float32, mask=True,
+                                            multiplier=MULTIPLIER, offset=offset)
+        f.create_dataset("tasmin", data=data, **options)
         
     print(f"  Time: {time.time() - start:.2f}s")
 
+    # --- 5. TurboPFor Float32, streaming converter ---
+    # Not part of the Int16 comparison: the source is unpacked to float32 slab by
+    # slab in a process pool and the filter quantizes it with the same 0.05 K
+    # precision, so readers get float32.
+    print(f"\nWriting {OUTPUT_CONVERT} (Float32, TurboPFor streaming converter)...")
+    if os.path.exists(OUTPUT_CONVERT): os.remove(OUTPUT_CONVERT)
+    stats = turbopfor.convert(INPUT_FILE, OUTPUT_CONVERT, "tasmin", CHUNK_SHAPE,
+                              multiplier=MULTIPLIER, offset=273.15)
+    print(f"  Time: {stats.seconds:.2f}s ({stats.mb_per_s:.1f} MB/s, {stats.chunks} chunks)")
+
     # --- Read Benchmarks ---
     print("\nRunning Read Benchmarks (1000 random timeseries)...")
     read_times = {}
@@ -213,7 +208,8 @@ def run_benchmark():
         ("LZF Int16", OUTPUT_LZF),
         ("Shuffle+GZIP", OUTPUT_SHUFFLE_GZIP),
         ("SZIP Int16", OUTPUT_SZIP),
-        ("TurboPFor Int16", OUTPUT_TURBO)
+        ("TurboPFor Int16", OUTPUT_TURBO),
+        ("TurboPFor Float32 (convert)", OUTPUT_CONVERT)
     ]
     
     for name, path in files_to_test:
@@ -228,6 +224,9 @@ def run_benchmark():
         else:
             read_times[name] = float('nan')
 
+    t = benchmark_read_points(OUTPUT_TURBO, num_points=1000)
+    print(f"  TurboPFor read_points batch: {t:.4f}s")
+
     # --- Report ---
     print("\n=== Results (Int16 Quantized) ===")
     sizes = {
@@ -256,5 +255,16 @@ def run_benchmark():
         
         print(f"{name:<20} | {mb:<10.2f} | {ratio:<8.2f} | {r_str:<12}")
 
+    # Float32 output of the converter, kept apart from the Int16 table above
+    if os.path.exists(OUTPUT_CONVERT):
+        print("\n=== Results (Float32, streaming converter) ===")
+        size = os.path.getsize(OUTPUT_CONVERT)
+        r_time = read_times.get("TurboPFor Float32 (convert)", float('nan'))
+        r_str = f"{r_time:.4f}" if not np.isnan(r_time) else "-"
+        print(f"{'Format':<20} | {'Size (MB)':<10} | {'Ratio':<8} | {'Read 1k (s)':<12}")
+        print("-" * 60)
+        print(f"{'TurboPFor F32 (H5)':<20} | {size / (1024 * 1024):<10.2f} | "
+              f"{base_size / size:<8.2f} | {r_str:<12}")
+
 if __name__ == "__main__":
     run_benchmark()
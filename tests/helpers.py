@@ -0,0 +1,29 @@
+"""Data and file factories shared by the dataset-level tests."""
+import h5py
+import numpy as np
+
+import turbopfor
+
+
+def random_walk(shape, dtype=np.int16, seed=0):
+    """Integer series drifting along the first axis, like quantized temperatures."""
+    rng = np.random.default_rng(seed)
+    return np.cumsum(rng.integers(-3, 4, shape), axis=0).astype(dtype)
+
+
+def write_file(path, data, chunk_shape, name="tasmin", fillvalue=None, userblock_size=0,
+               **options):
+    """
+    Stores data as a TurboPFor dataset in a new file and returns it as read back
+    in a new session, which keeps h5py's chunk cache (holding float values
+    before quantization) out of comparisons. Chunks holding only fillvalue are
+    left unwritten.
+    """
+    with h5py.File(path, "w", userblock_size=userblock_size) as f:
+        dset = f.create_dataset(name, shape=data.shape, dtype=data.dtype, fillvalue=fillvalue,
+                                **turbopfor.dataset_options(chunk_shape, data.dtype, **options))
+        for sel in dset.iter_chunks():
+            if fillvalue is None or np.any(data[sel] != fillvalue):
+                dset[sel] = data[sel]
+    with h5py.File(path, "r") as f:
+        return f[name][...]
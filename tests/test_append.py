@@ -0,0 +1,210 @@
+import os
+import sys
+
+# --- Auto-configure HDF5 Plugin Path for Testing ---
+# MUST BE DONE BEFORE IMPORTING h5py
+if "HDF5_PLUGIN_PATH" not in os.environ:
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    build_dir = os.path.join(project_root, "build")
+    if os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.so")) or \
+       os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.dylib")):
+        os.environ["HDF5_PLUGIN_PATH"] = build_dir
+
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import turbopfor
+
+DATA_SHAPE = (75, 45, 50)
+CHUNK_SHAPE = (24, 20, 20)
+
+
+def series_data(dtype=np.int16, shape=DATA_SHAPE):
+    rng = np.random.default_rng(3)
+    return np.cumsum(rng.integers(-3, 4, shape), axis=0).astype(dtype)
+
+
+def create(f, dtype=np.int16, initial=None, **options):
+    shape = (0,) + DATA_SHAPE[1:] if initial is None else initial.shape
+    return f.create_dataset("tasmin", shape=shape, maxshape=(None,) + DATA_SHAPE[1:], dtype=dtype,
+                            data=initial,
+                            **turbopfor.dataset_options(CHUNK_SHAPE, dtype, **options))
+
+
+@pytest.mark.parametrize("mask", [False, True])
+def test_append_steps(tmp_path, mask):
+    data = series_data()
+    data[30:40, :5, :5] = turbopfor.fill_value(data.dtype)
+    path = tmp_path / "append.h5"
+    with h5py.File(path, "w") as f:
+        dset = create(f, mask=mask)
+        for t in range(0, len(data), 3):
+            assert turbopfor.append(dset, data[t:t + 3]) == min(t + 3, len(data))
+    with h5py.File(path, "r") as f:
+        dset = f["tasmin"]
+        assert np.array_equal(dset[:], data)
+        assert np.array_equal(turbopfor.read_parallel(dset, workers=4), data)
+        assert np.array_equal(turbopfor.read_series(dset, 44, 49), data[:, 44, 49])
+        raw = dset.id.read_direct_chunk((24, 20, 40))[1]
+        info = turbopfor.segment_info(raw)
+        assert info.rows == 24 and list(info.segment_rows) == [3] * 8
+
+
+def test_append_to_regular_chunks(tmp_path):
+    data = series_data()
+    path = tmp_path / "mixed.h5"
+    with h5py.File(path, "w") as f:
+        dset = create(f, initial=data[:30])
+        assert turbopfor.segment_info(dset.id.read_direct_chunk((24, 0, 0))[1]) is None
+        turbopfor.append(dset, data[30:31])
+        turbopfor.append(dset, data[31:])
+        raw = dset.id.read_direct_chunk((24, 0, 0))[1]
+        assert list(turbopfor.segment_info(raw).segment_rows) == [7, 17]
+        assert np.array_equal(dset[:], data)
+
+
+def test_append_after_unwritten_rows(tmp_path):
+    data = series_data()
+    with h5py.File(tmp_path / "unwritten.h5", "w") as f:
+        dset = f.create_dataset("tasmin", shape=(30,) + DATA_SHAPE[1:],
+                                maxshape=(None,) + DATA_SHAPE[1:], dtype=np.int16,
+                                **turbopfor.dataset_options(CHUNK_SHAPE, np.int16))
+        dset[:24] = data[:24]  # the chunk row from step 24 is never written
+        turbopfor.append(dset, data[30:33])
+    with h5py.File(tmp_path / "unwritten.h5", "r") as f:
+        out = f["tasmin"][:]
+    assert np.array_equal(out[:24], data[:24])
+    assert (out[24:30] == 0).all()
+    assert np.array_equal(out[30:], data[30:33])
+
+
+def test_append_blocked_masked(tmp_path):
+    data = series_data()
+    data[:, :5, :5] = turbopfor.fill_value(data.dtype)
+    with h5py.File(tmp_path / "blocked.h5", "w") as f:
+        dset = create(f, initial=data[:24], block_series=16, mask=True)
+        turbopfor.append(dset, data[24:48])
+        turbopfor.append(dset, data[48:])
+        # Segments use their own coding and read back the same
+        assert turbopfor.block_index(dset.id.read_direct_chunk((24, 0, 0))[1]) is None
+        assert np.array_equal(turbopfor.read_series(dset, 3, 3), data[:, 3, 3])
+        assert np.array_equal(turbopfor.read_parallel(dset, workers=2), data)
+
+        assert turbopfor.compact(dset, min_segments=1) == 18
+        raw = dset.id.read_direct_chunk((24, 0, 0))[1]
+        assert turbopfor.block_index(raw) is not None
+        assert turbopfor.chunk_header(raw).flags & turbopfor.codec.CHUNK_MASKED
+        assert np.array_equal(dset[:], data)
+
+
+def test_append_float(tmp_path):
+    data = series_data(np.float32) / 10
+    data[5:50, 3, 4] = np.nan
+    path = tmp_path / "float.h5"
+    with h5py.File(path, "w") as f:
+        dset = create(f, np.float32, multiplier=10, offset=0.5)
+        for t in range(0, len(data), 10):
+            turbopfor.append(dset, data[t:t + 10])
+        out = dset[:]
+    assert np.array_equal(np.isnan(out), np.isnan(data))
+    assert np.allclose(out, data, atol=0.051, equal_nan=True)
+
+
+def test_append_invalidates_cache(tmp_path):
+    data = series_data()
+    cache = turbopfor.ChunkCache()
+    with h5py.File(tmp_path / "cache.h5", "w") as f:
+        dset = create(f, initial=data[:10])
+        assert np.array_equal(turbopfor.read_parallel(dset, cache=cache), data[:10])
+        turbopfor.append(dset, data[10:20], cache=cache)
+        assert len(cache) == 0
+        assert np.array_equal(turbopfor.read_parallel(dset, cache=cache), data[:20])
+
+
+class FailingWrites:
+    """Dataset proxy whose write_direct_chunk fails once, after `allowed` calls."""
+
+    class ID:
+        def __init__(self, dsid, allowed):
+            self._dsid, self.allowed = dsid, allowed
+
+        def write_direct_chunk(self, offset, blob):
+            self.allowed -= 1
+            if self.allowed == -1:
+                raise OSError("disk full")
+            self._dsid.write_direct_chunk(offset, blob)
+
+        def __getattr__(self, name):
+            return getattr(self._dsid, name)
+
+    def __init__(self, dset, allowed):
+        self._dset = dset
+        self.id = self.ID(dset.id, allowed)
+
+    def __getattr__(self, name):
+        return getattr(self._dset, name)
+
+
+def test_append_failure_keeps_dataset(tmp_path):
+    data = series_data()
+    with h5py.File(tmp_path / "failure.h5", "w") as f:
+        dset = create(f, initial=data[:30])
+        with pytest.raises(OSError):
+            turbopfor.append(FailingWrites(dset, 4), data[30:40])
+        assert dset.shape == (30,) + DATA_SHAPE[1:]
+        assert np.array_equal(dset[:], data[:30])
+
+        # An encode error leaves the dataset untouched too
+        cd_values = turbopfor.filter_cd_values(dset)
+        rows = data[24:29, :20, :20]
+        dset.id.write_direct_chunk((24, 0, 0), turbopfor.append_rows(None, rows, 0, cd_values))
+        with pytest.raises(ValueError):
+            turbopfor.append(dset, data[30:40])
+        assert dset.shape == (30,) + DATA_SHAPE[1:]
+
+        dset.id.write_direct_chunk((24, 0, 0), turbopfor.append_rows(None, data[24:30, :20, :20],
+                                                                     0, cd_values))
+        turbopfor.append(dset, data[30:])
+        assert np.array_equal(dset[:], data)
+
+
+def test_compact(tmp_path):
+    data = series_data()
+    with h5py.File(tmp_path / "compact.h5", "w") as f:
+        dset = create(f)
+        for t in range(len(data)):
+            turbopfor.append(dset, data[t:t + 1])
+        # The last chunk row only holds 3 of 24 steps
+        assert turbopfor.compact(dset) == 27
+        assert turbopfor.segment_info(dset.id.read_direct_chunk((72, 0, 0))[1]) is not None
+        assert turbopfor.compact(dset, full_only=False) == 9
+        assert all(turbopfor.segment_info(dset.id.read_direct_chunk(o)[1]) is None
+                   for o in [(0, 0, 0), (48, 20, 40), (72, 40, 0)])
+        assert np.array_equal(dset[:], data)
+        # Compacted chunks keep taking appends
+        turbopfor.append(dset, data[:5])
+        assert np.array_equal(dset[75:], data[:5])
+
+
+def test_append_rows_checks():
+    cd_values = turbopfor.cd_values_for(CHUNK_SHAPE, np.int16)
+    rows = series_data(shape=(4,) + CHUNK_SHAPE[1:])
+    chunk = turbopfor.append_rows(None, rows, 0, cd_values)
+    with pytest.raises(ValueError):
+        turbopfor.append_rows(chunk, rows, 3, cd_values)
+    with pytest.raises(ValueError):
+        turbopfor.append_rows(chunk, rows[:, :10], 4, cd_values)
+    chunk = turbopfor.append_rows(chunk, rows, 4, cd_values)
+    out = turbopfor.decode(chunk, CHUNK_SHAPE, np.int16)
+    assert np.array_equal(out[:8], np.concatenate([rows, rows]))
+    assert (out[8:] == turbopfor.fill_value(np.int16)).all()
+
+
+def test_append_shape_mismatch(tmp_path):
+    with h5py.File(tmp_path / "bad.h5", "w") as f:
+        dset = create(f)
+        with pytest.raises(ValueError):
+            turbopfor.append(dset, np.zeros((2, 45, 49), np.int16))
@@ -0,0 +1,47 @@
+import json
+import os
+import sys
+
+# --- Auto-configure HDF5 Plugin Path for Testing ---
+# MUST BE DONE BEFORE IMPORTING h5py
+if "HDF5_PLUGIN_PATH" not in os.environ:
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    build_dir = os.path.join(project_root, "build")
+    if os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.so")) or \
+       os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.dylib")):
+        os.environ["HDF5_PLUGIN_PATH"] = build_dir
+
+import h5py
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import turbopfor
+from turbopfor import benchmark
+
+SHAPE = (40, 30, 30)
+
+
+@pytest.mark.parametrize("field", benchmark.FIELDS)
+@pytest.mark.parametrize("dtype", benchmark.DTYPES)
+def test_fields_round_trip(tmp_path, field, dtype):
+    case = benchmark.Case(field, dtype, (20, 10, 10), "turbopfor")
+    result = benchmark.run_case(case, SHAPE, repeat=1, directory=tmp_path)
+    assert result["exact"]
+    assert result["ratio"] > 1
+    assert result["encode_mb_s"] > 0 and result["decode_mb_s"] > 0
+
+
+def test_run_and_compare(tmp_path):
+    cases = benchmark.cases(["smooth"], ["int16"], [(20, 10, 10)], ["turbopfor", "gzip"])
+    results = benchmark.run(cases, SHAPE, repeat=1, isolate=False, directory=tmp_path)
+    assert [r["filter"] for r in results["results"]] == ["turbopfor", "gzip"]
+    assert results["results"][1]["encode_mb_s"] is None
+    assert json.loads(json.dumps(results)) == results
+    assert benchmark.compare(results, results) == []
+
+    worse = json.loads(json.dumps(results))
+    worse["results"][0]["ratio"] /= 2
+    worse["results"][0]["peak_rss_mb"] *= 2
+    regressions = benchmark.compare(worse, results, tolerance=0.1)
+    assert {r[1] for r in regressions} == {"ratio", "peak_rss_mb"}
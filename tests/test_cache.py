@@ -0,0 +1,120 @@
+import os
+import sys
+import threading
+
+# --- Auto-configure HDF5 Plugin Path for Testing ---
+# MUST BE DONE BEFORE IMPORTING h5py
+if "HDF5_PLUGIN_PATH" not in os.environ:
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    build_dir = os.path.join(project_root, "build")
+    if os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.so")) or \
+       os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.dylib")):
+        os.environ["HDF5_PLUGIN_PATH"] = build_dir
+
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import turbopfor
+
+DATA_SHAPE = (130, 45, 50)
+CHUNK_SHAPE = (50, 20, 20)
+
+
+def make_dataset(path, block_series=None):
+    rng = np.random.default_rng(4)
+    data = np.cumsum(rng.integers(-3, 4, DATA_SHAPE), axis=0).astype(np.int16)
+    with h5py.File(path, "w") as f:
+        f.create_dataset("tasmin", data=data, chunks=CHUNK_SHAPE,
+                         compression=turbopfor.FILTER_ID,
+                         compression_opts=turbopfor.cd_values_for(CHUNK_SHAPE, np.int16,
+                                                                  block_series))
+    return data
+
+
+def test_lru_eviction():
+    cache = turbopfor.ChunkCache(max_bytes=3 * 800)
+    for i in range(3):
+        cache.put(("f", "d", (i,)), np.zeros(100, dtype=np.int64))
+    assert cache.get(("f", "d", (0,))) is not None  # 0 becomes most recent
+    cache.put(("f", "d", (3,)), np.zeros(100, dtype=np.int64))
+    assert cache.get(("f", "d", (1,))) is None
+    assert cache.get(("f", "d", (0,))) is not None
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.evictions) == (2, 1, 1)
+    assert stats.entries == 3 and stats.nbytes == 3 * 800
+
+    # Entries larger than the budget are not kept
+    cache.put(("f", "d", (9,)), np.zeros(1000, dtype=np.int64))
+    assert cache.get(("f", "d", (9,))) is None and len(cache) == 3
+    with pytest.raises(ValueError):
+        cache.get(("f", "d", (0,)))[0] = 1
+
+
+def test_oversized_arrays_stay_writeable():
+    cache = turbopfor.ChunkCache(max_bytes=800)
+    big, small = np.zeros(200, dtype=np.int64), np.zeros(100, dtype=np.int64)
+    cache.put(("f", "d", (0,)), big)
+    cache.put(("f", "d", (1,)), small)
+    assert big.flags.writeable and len(cache) == 1
+    assert not small.flags.writeable
+
+
+def test_chunk_key_resolves_once(tmp_path, monkeypatch):
+    make_dataset(tmp_path / "key.h5")
+    calls = []
+    realpath = os.path.realpath
+    monkeypatch.setattr(turbopfor.cache.os.path, "realpath",
+                        lambda path: calls.append(path) or realpath(path))
+    with h5py.File(tmp_path / "key.h5", "r") as f:
+        dset = f["tasmin"]
+        key = turbopfor.chunk_key(dset, (0, 20, 0))
+        assert key == (realpath(tmp_path / "key.h5"), "/tasmin", (0, 20, 0))
+        assert turbopfor.chunk_key(dset, (50, 0, 0), 3) == key[:2] + ((50, 0, 0), 3)
+        assert len(calls) == 1
+        turbopfor.chunk_key(f["tasmin"], (0, 0, 0))  # another dataset object
+        assert len(calls) == 2
+
+
+def test_thread_safety():
+    cache = turbopfor.ChunkCache(max_bytes=50 * 80)
+
+    def worker(seed):
+        rng = np.random.default_rng(seed)
+        for key in rng.integers(0, 100, 2000):
+            cache.get_or_load(("f", "d", (int(key),)), lambda: np.zeros(10, dtype=np.int64))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = cache.stats()
+    assert stats.hits + stats.misses == 8 * 2000
+    assert stats.nbytes == stats.entries * 80 <= cache.max_bytes
+
+
+@pytest.mark.parametrize("block_series", [None, 16])
+def test_readers_use_cache(tmp_path, block_series):
+    path = tmp_path / "cached.h5"
+    data = make_dataset(path, block_series)
+    cache = turbopfor.ChunkCache()
+    with h5py.File(path, "r") as f:
+        dset = f["tasmin"]
+        for _ in range(2):
+            assert np.array_equal(turbopfor.read_series(dset, 23, 7, cache=cache), data[:, 23, 7])
+        nchunks = -(-DATA_SHAPE[0] // CHUNK_SHAPE[0])
+        assert cache.stats().hits >= nchunks
+
+        hits = cache.stats().hits
+        assert np.array_equal(turbopfor.read_parallel(dset, np.s_[:, :30], cache=cache),
+                              data[:, :30])
+        assert np.array_equal(turbopfor.read_parallel(dset, np.s_[:, :30], cache=cache),
+                              data[:, :30])
+        assert cache.stats().hits >= hits + nchunks * 2 * 3
+
+    cache.invalidate(path)
+    assert len(cache) == 0 and cache.stats().nbytes == 0
@@ -0,0 +1,325 @@
+import os
+import sys
+
+# --- Auto-configure HDF5 Plugin Path for Testing ---
+# MUST BE DONE BEFORE IMPORTING h5py
+if "HDF5_PLUGIN_PATH" not in os.environ:
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    build_dir = os.path.join(project_root, "build")
+    if os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.so")) or \
+       os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.dylib")):
+        os.environ["HDF5_PLUGIN_PATH"] = build_dir
+
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import turbopfor
+
+CHUNK_SHAPE = (100, 20, 20)
+DTYPES = [np.int16, np.uint16, np.int32, np.uint32]
+
+# (amplitude, offset) per dtype, chosen to use most of the value range
+FIELD_RANGES = {
+    np.dtype(np.int16): (100.0, 0.0),
+    np.dtype(np.uint16): (100.0, 60000.0),
+    np.dtype(np.int32): (2e6, -1e9),
+    np.dtype(np.uint32): (2e6, 4.2e9),
+}
+
+
+def make_field(shape, dtype=np.int16, seed=0):
+    """Smooth integer field with a little noise, like quantized temperatures."""
+    rng = np.random.default_rng(seed)
+    amplitude, offset = FIELD_RANGES[np.dtype(dtype)]
+    t, y, x = np.meshgrid(*(np.linspace(0, 10, n) for n in shape), indexing="ij")
+    data = 2.0 * np.sin(t) + 1.0 * np.cos(y) + 0.4 * np.sin(x)
+    data = data * amplitude + offset + rng.normal(0, amplitude / 20, shape)
+    info = np.iinfo(dtype)
+    return np.clip(np.round(data), info.min, info.max).astype(dtype)
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_roundtrip(dtype):
+    data = make_field(CHUNK_SHAPE, dtype)
+    encoded = turbopfor.encode(data)
+    assert len(encoded) < data.nbytes
+
+    header = turbopfor.chunk_header(encoded)
+    assert header.dtype == data.dtype
+    assert header.nelem == data.size
+    assert header.raw_size == data.nbytes
+
+    decoded = turbopfor.decode(encoded, data.shape, data.dtype)
+    assert np.array_equal(decoded, data)
+
+    out = np.empty_like(data)
+    assert turbopfor.decode_into(encoded, out) is out
+    assert np.array_equal(out, data)
+
+
+def test_encode_does_not_modify_input():
+    data = make_field(CHUNK_SHAPE)
+    original = data.copy()
+    turbopfor.encode(data)
+    assert np.array_equal(data, original)
+
+
+def test_oversized_chunks_after_scratch_release():
+    # Above the 8 MiB the plugin keeps per scratch slot, so every call reallocates
+    data = make_field((600, 100, 40), np.int32)
+    for _ in range(2):
+        encoded = turbopfor.encode(data)
+        assert np.array_equal(turbopfor.decode(encoded, data.shape, data.dtype), data)
+        turbopfor._lib.load().turbopfor_scratch_release()
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_matches_hdf5_filter(tmp_path, dtype):
+    data = make_field(CHUNK_SHAPE, dtype)
+    path = tmp_path / "codec.h5"
+    with h5py.File(path, "w") as f:
+        f.create_dataset("filtered", data=data, chunks=CHUNK_SHAPE,
+                         compression=turbopfor.FILTER_ID,
+                         compression_opts=turbopfor.cd_values_for(CHUNK_SHAPE, data.dtype))
+        direct = f.create_dataset("direct", shape=data.shape, dtype=data.dtype, chunks=CHUNK_SHAPE,
+                                  compression=turbopfor.FILTER_ID,
+                                  compression_opts=turbopfor.cd_values_for(CHUNK_SHAPE, data.dtype))
+        direct.id.write_direct_chunk((0, 0, 0), turbopfor.encode(data))
+
+    with h5py.File(path, "r") as f:
+        _, raw = f["filtered"].id.read_direct_chunk((0, 0, 0))
+        assert np.array_equal(turbopfor.decode(raw, CHUNK_SHAPE, data.dtype), data)
+        assert np.array_equal(f["direct"][:], data)
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+@pytest.mark.parametrize("predictor", [0, 1, 2, "lorenzo2d", "lorenzo3d"])
+def test_predictors(dtype, predictor):
+    data = make_field(CHUNK_SHAPE, dtype)
+    encoded = turbopfor.encode(data, predictor=predictor)
+    assert np.array_equal(turbopfor.decode(encoded, data.shape, data.dtype), data)
+
+
+def test_auto_predictor():
+    # Varies along time only, so differencing along axis 0 leaves nothing
+    data = np.repeat(make_field((100, 1, 1)), 400).reshape(CHUNK_SHAPE)
+    encoded = turbopfor.encode(data, predictor="auto")
+    assert np.array_equal(turbopfor.decode(encoded, data.shape, data.dtype), data)
+    assert turbopfor.chunk_header(encoded).predictor != turbopfor.codec.PREDICTORS["auto"]
+    assert len(encoded) <= len(turbopfor.encode(data))
+    assert len(encoded) <= len(turbopfor.encode(data, predictor=0))
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+@pytest.mark.parametrize("codec", ["p4n128v", "p4n256v", "vsimple", "bitpack", "trle"])
+@pytest.mark.parametrize("predictor", [None, 0, "lorenzo3d"])
+def test_codecs(dtype, codec, predictor):
+    data = make_field(CHUNK_SHAPE, dtype)
+    encoded = turbopfor.encode(data, predictor=predictor, codec=codec)
+    assert np.array_equal(turbopfor.decode(encoded, data.shape, data.dtype), data)
+    if codec != "p4n256v":  # may fall back to p4n128v
+        assert turbopfor.chunk_header(encoded).codec == turbopfor.codec.CODECS[codec]
+
+
+def test_auto_codec():
+    # Long runs of equal values favour run-length codecs over PFor
+    data = np.repeat(make_field((10, 1, 1)), 10 * 400).reshape(CHUNK_SHAPE)
+    data[::7, 3, 5] += 1
+    encoded = turbopfor.encode(data, predictor="auto", codec="auto")
+    assert np.array_equal(turbopfor.decode(encoded, data.shape, data.dtype), data)
+    header = turbopfor.chunk_header(encoded)
+    assert header.codec != turbopfor.codec.CODECS["auto"]
+    assert len(encoded) <= len(turbopfor.encode(data, predictor="auto"))
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        turbopfor.cd_values_for(CHUNK_SHAPE, np.int16, codec="zstd")
+
+
+@pytest.mark.parametrize("block_series", [1, 16, 64])
+def test_blocked_layout(block_series):
+    data = make_field(CHUNK_SHAPE, np.int32)
+    encoded = turbopfor.encode(data, block_series=block_series)
+    assert np.array_equal(turbopfor.decode(encoded, data.shape, data.dtype), data)
+
+    index = turbopfor.block_index(encoded)
+    assert index.nblocks == -(-400 // block_series)
+    assert index.length0 == CHUNK_SHAPE[0]
+    series = data.reshape(CHUNK_SHAPE[0], -1)
+    for column in (0, 17, 399):
+        assert np.array_equal(turbopfor.decode_series(encoded, column, index), series[:, column])
+    unblocked = turbopfor.encode(data)
+    assert turbopfor.block_index(unblocked) is None
+    for decode in (turbopfor.decode_block, turbopfor.decode_series):
+        with pytest.raises(ValueError, match="blocked layout"):
+            decode(unblocked, 0)
+
+
+def make_masked_field(dtype, seed=0):
+    """A field with a rectangular land area and scattered missing cells."""
+    data = make_field(CHUNK_SHAPE, dtype, seed)
+    fill = turbopfor.fill_value(dtype)
+    data[:, 3:11, 5:9] = fill
+    rng = np.random.default_rng(seed)
+    data[rng.random(CHUNK_SHAPE) < 0.01] = fill
+    return data
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_mask(dtype):
+    data = make_masked_field(dtype)
+    encoded = turbopfor.encode(data, mask=True)
+    assert turbopfor.chunk_header(encoded).flags & turbopfor.codec.CHUNK_MASKED
+    assert np.array_equal(turbopfor.decode(encoded, data.shape, data.dtype), data)
+
+    # A contiguous land area costs a few RLE runs instead of two jumps per row
+    land = make_field(CHUNK_SHAPE, dtype)
+    land[:, 3:11, 5:9] = turbopfor.fill_value(dtype)
+    assert len(turbopfor.encode(land, mask=True)) < len(turbopfor.encode(land))
+
+    # Chunks without fill values carry no bitmap
+    plain = make_field(CHUNK_SHAPE, dtype)
+    assert turbopfor.encode(plain, mask=True) == turbopfor.encode(plain)
+
+
+@pytest.mark.parametrize("predictor", [None, 0, "auto"])
+def test_mask_with_predictors(predictor):
+    data = make_masked_field(np.int16, seed=3)
+    encoded = turbopfor.encode(data, predictor=predictor, mask=True)
+    assert np.array_equal(turbopfor.decode(encoded, data.shape, data.dtype), data)
+
+
+def test_mask_blocked():
+    data = make_masked_field(np.int32)
+    encoded = turbopfor.encode(data, block_series=16, mask=True)
+    assert np.array_equal(turbopfor.decode(encoded, data.shape, data.dtype), data)
+    series = data.reshape(CHUNK_SHAPE[0], -1)
+    for column in (0, 65, 399):
+        assert np.array_equal(turbopfor.decode_series(encoded, column), series[:, column])
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_constant_chunks(tmp_path, dtype):
+    fill = turbopfor.fill_value(dtype)
+    for value in (fill, 0, 7):
+        data = np.full(CHUNK_SHAPE, value, dtype=dtype)
+        encoded = turbopfor.encode(data, block_series=16, mask=True)
+        assert len(encoded) == turbopfor.codec.HEADER.size + data.itemsize
+        assert turbopfor.constant_value(encoded) == value
+        assert np.array_equal(turbopfor.decode(encoded, data.shape, data.dtype), data)
+    assert turbopfor.constant_value(turbopfor.encode(make_field(CHUNK_SHAPE, dtype))) is None
+
+    # Half of the dataset lies outside the domain
+    data = make_field((2 * CHUNK_SHAPE[0],) + CHUNK_SHAPE[1:], dtype)
+    data[CHUNK_SHAPE[0]:] = fill
+    with h5py.File(tmp_path / "constant.h5", "w") as f:
+        dset = f.create_dataset("data", data=data, chunks=CHUNK_SHAPE,
+                                compression=turbopfor.FILTER_ID,
+                                compression_opts=turbopfor.cd_values_for(CHUNK_SHAPE, dtype))
+        assert np.array_equal(dset[...], data)
+        assert np.array_equal(turbopfor.read_series(dset, 4, 5), data[:, 4, 5])
+        _, raw = dset.id.read_direct_chunk((CHUNK_SHAPE[0], 0, 0))
+        assert turbopfor.constant_value(raw) == fill
+
+
+def make_float_field(shape, seed=0):
+    """A temperature-like float32 field in Kelvin with a few NaN cells."""
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0, 4 * np.pi, shape[0])[:, None, None]
+    y = np.linspace(0, np.pi, shape[1])[None, :, None]
+    field = 280.0 + 10.0 * np.sin(t) + 15.0 * np.cos(y) + rng.normal(0, 0.2, shape)
+    field[rng.random(shape) < 0.02] = np.nan
+    return field.astype(np.float32)
+
+
+@pytest.mark.parametrize("options", [{}, {"mask": True}, {"predictor": "auto", "mask": True}])
+def test_float32_quantization(options):
+    data = make_float_field(CHUNK_SHAPE)
+    multiplier, offset = 100.0, 250.0
+    encoded = turbopfor.encode(data, multiplier=multiplier, offset=offset, **options)
+    assert turbopfor.chunk_header(encoded).dtype == np.float32
+    decoded = turbopfor.decode(encoded, data.shape, np.float32, multiplier, offset)
+
+    expected = (np.round((data.astype(np.float64) - offset) * multiplier) / multiplier
+                + offset).astype(np.float32)
+    assert np.array_equal(np.isnan(decoded), np.isnan(data))
+    assert np.allclose(decoded, expected, equal_nan=True)
+    assert np.nanmax(np.abs(decoded - data)) <= 0.5 / multiplier + 1e-4
+
+    with pytest.raises(ValueError):
+        turbopfor.encode(data)
+
+
+def test_float32_dataset(tmp_path):
+    data = make_float_field((150,) + CHUNK_SHAPE[1:], seed=5)
+    cd_values = turbopfor.cd_values_for(CHUNK_SHAPE, np.float32, block_series=16, mask=True,
+                                        multiplier=20.0, offset=273.15)
+    assert turbopfor.quantization(cd_values) == pytest.approx((20.0, 273.15))
+    with h5py.File(tmp_path / "float.h5", "w") as f:
+        f.create_dataset("t2m", data=data, chunks=CHUNK_SHAPE,
+                         compression=turbopfor.FILTER_ID, compression_opts=cd_values)
+    with h5py.File(tmp_path / "float.h5", "r") as f:
+        dset = f["t2m"]
+        stored = dset[...]
+        assert np.array_equal(np.isnan(stored), np.isnan(data))
+        assert np.nanmax(np.abs(stored - data)) <= 0.5 / 20.0 + 1e-4
+        assert np.array_equal(turbopfor.read_series(dset, 7, 3), stored[:, 7, 3], equal_nan=True)
+
+
+def test_float32_constant_chunks(tmp_path):
+    # Values that only become uniform after quantization, and a uniform one that
+    # is not on the quantization grid: both must read back quantized
+    data = np.full(CHUNK_SHAPE, 0.123, dtype=np.float32)
+    data[1] = 0.08
+    expected = np.full(CHUNK_SHAPE, 0.1, dtype=np.float32)
+    for chunk in (data, np.full(CHUNK_SHAPE, 0.123, dtype=np.float32)):
+        encoded = turbopfor.encode(chunk, multiplier=10.0)
+        assert turbopfor.constant_value(encoded) == np.float32(0.1)
+        assert np.array_equal(turbopfor.decode(encoded, CHUNK_SHAPE, np.float32, 10.0), expected)
+    nan = np.full(CHUNK_SHAPE, np.nan, dtype=np.float32)
+    assert np.isnan(turbopfor.constant_value(turbopfor.encode(nan, multiplier=10.0, mask=True)))
+
+    with h5py.File(tmp_path / "constant.h5", "w") as f:
+        f.create_dataset("t2m", data=np.full(CHUNK_SHAPE, 0.123, dtype=np.float32),
+                         **turbopfor.dataset_options(CHUNK_SHAPE, np.float32, multiplier=10.0))
+    with h5py.File(tmp_path / "constant.h5", "r") as f:
+        assert np.array_equal(f["t2m"][...], expected)
+
+
+def test_numcodecs_codec():
+    numcodecs = pytest.importorskip("numcodecs")
+    data = make_field(CHUNK_SHAPE)
+    codec = numcodecs.get_codec({"id": "turbopfor", "dtype": "<i2", "chunks": list(CHUNK_SHAPE)})
+    encoded = codec.encode(data)
+    assert np.array_equal(codec.decode(encoded), data)
+
+    out = np.empty(data.size, dtype=np.int16)
+    codec.decode(encoded, out=out)
+    assert np.array_equal(out.reshape(CHUNK_SHAPE), data)
+    assert numcodecs.get_codec(codec.get_config()).chunks == CHUNK_SHAPE
+
+
+if __name__ == "__main__":
+    import tempfile
+    import pathlib
+    for dtype in DTYPES:
+        test_roundtrip(dtype)
+        with tempfile.TemporaryDirectory() as tmp:
+            test_matches_hdf5_filter(pathlib.Path(tmp), dtype)
+    test_encode_does_not_modify_input()
+    for dtype in DTYPES:
+        for predictor in (0, 1, 2, "lorenzo2d", "lorenzo3d"):
+            test_predictors(dtype, predictor)
+    test_auto_predictor()
+    for dtype in DTYPES:
+        for codec in ("p4n128v", "p4n256v", "vsimple", "bitpack", "trle"):
+            test_codecs(dtype, codec, None)
+    test_auto_codec()
+    for block_series in (1, 16, 64):
+        test_blocked_layout(block_series)
+    test_numcodecs_codec()
+    print("SUCCESS: codec round trips match the HDF5 filter.")
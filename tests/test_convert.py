@@ -0,0 +1,121 @@
+import os
+import shutil
+import subprocess
+import sys
+
+# --- Auto-configure HDF5 Plugin Path for Testing ---
+# MUST BE DONE BEFORE IMPORTING h5py
+if "HDF5_PLUGIN_PATH" not in os.environ:
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    build_dir = os.path.join(project_root, "build")
+    if os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.so")) or \
+       os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.dylib")):
+        os.environ["HDF5_PLUGIN_PATH"] = build_dir
+
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import turbopfor
+
+# Deliberately not a multiple of the chunk shape so edge chunks are exercised
+DATA_SHAPE = (70, 45, 50)
+CHUNK_SHAPE = (70, 20, 20)
+SOURCE_FILL = np.float32(1e20)
+
+
+def make_source(path):
+    """A netCDF-style float32 variable in Kelvin with _FillValue cells."""
+    rng = np.random.default_rng(2)
+    t = np.linspace(0, 2 * np.pi, DATA_SHAPE[0])[:, None, None]
+    data = (270.0 + 8.0 * np.sin(t) + rng.normal(0, 0.3, DATA_SHAPE)).astype(np.float32)
+    data[:, :10, :7] = SOURCE_FILL
+    with h5py.File(path, "w") as f:
+        var = f.create_dataset("tasmin", data=data, chunks=(1, 45, 50))
+        var.attrs["_FillValue"] = np.array([SOURCE_FILL])
+        var.attrs["units"] = "K"
+    return data
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_convert_float(tmp_path, workers):
+    data = make_source(tmp_path / "in.nc4")
+    stats = turbopfor.convert(tmp_path / "in.nc4", tmp_path / "out.h5", "tasmin", CHUNK_SHAPE,
+                              multiplier=20.0, offset=250.0, block_series=16, workers=workers)
+    assert stats.chunks == 3 * 3
+    # Edge chunks count only the cells inside the dataset
+    assert stats.raw_bytes == data.nbytes
+    assert stats.mb_per_s > 0 and stats.ratio > 1
+
+    with h5py.File(tmp_path / "out.h5", "r") as f:
+        dset = f["tasmin"]
+        assert dset.dtype == np.float32 and dset.attrs["units"] == "K"
+        assert "_FillValue" not in dset.attrs
+        out = dset[...]
+    missing = data == SOURCE_FILL
+    assert np.array_equal(np.isnan(out), missing)
+    assert np.max(np.abs(out[~missing] - data[~missing])) <= 0.5 / 20.0 + 1e-4
+
+
+def test_convert_integers(tmp_path):
+    data = np.cumsum(np.random.default_rng(3).integers(-3, 4, DATA_SHAPE), axis=0).astype(np.int16)
+    with h5py.File(tmp_path / "in.h5", "w") as f:
+        f["counts"] = data
+    turbopfor.convert(tmp_path / "in.h5", tmp_path / "out.h5", "counts", CHUNK_SHAPE,
+                      predictor=0, workers=0)
+    with h5py.File(tmp_path / "out.h5", "r") as f:
+        assert np.array_equal(f["counts"][...], data)
+
+
+def test_convert_integers_keeps_packing(tmp_path):
+    data = np.random.default_rng(4).integers(-500, 500, DATA_SHAPE).astype(np.int16)
+    data[0, 0, :3] = -32767
+    with h5py.File(tmp_path / "in.h5", "w") as f:
+        f["tasmin"] = data
+        f["tasmin"].attrs.update(scale_factor=np.float32(0.05), add_offset=np.float32(273.15),
+                                 _FillValue=np.int16(-32767), units="K")
+    turbopfor.convert(tmp_path / "in.h5", tmp_path / "out.h5", "tasmin", CHUNK_SHAPE, workers=0)
+    with h5py.File(tmp_path / "out.h5", "r") as f:
+        assert np.array_equal(f["tasmin"][...], data)
+        attrs = f["tasmin"].attrs
+        assert attrs["scale_factor"] == np.float32(0.05)
+        assert attrs["add_offset"] == np.float32(273.15)
+        assert attrs["_FillValue"] == -32767
+        assert attrs["units"] == "K"
+
+
+def _stored_chunks(path):
+    with h5py.File(path, "r") as f:
+        dset = f["tasmin"]
+        return {dset.id.get_chunk_info(i).chunk_offset: dset.id.read_direct_chunk(
+            dset.id.get_chunk_info(i).chunk_offset)[1] for i in range(dset.id.get_num_chunks())}
+
+
+def test_convert_mpi(tmp_path):
+    MPI = pytest.importorskip("mpi4py.MPI")
+    make_source(tmp_path / "in.nc4")
+    options = dict(multiplier=20.0, offset=250.0, dst_variable="tasmin")
+    chunks = (35, 20, 20)
+    stats = turbopfor.convert_mpi(tmp_path / "in.nc4", tmp_path / "mpi.h5", "tasmin", chunks,
+                                  comm=MPI.COMM_SELF, **options)
+    assert stats.chunks == 2 * 3 * 3
+    assert stats.raw_bytes == np.prod(DATA_SHAPE) * 4
+    turbopfor.convert(tmp_path / "in.nc4", tmp_path / "serial.h5", "tasmin", chunks, workers=0,
+                      **options)
+    assert _stored_chunks(tmp_path / "mpi.h5") == _stored_chunks(tmp_path / "serial.h5")
+
+
+@pytest.mark.skipif(shutil.which("mpirun") is None, reason="needs mpirun")
+def test_convert_mpirun(tmp_path):
+    pytest.importorskip("mpi4py")
+    make_source(tmp_path / "in.nc4")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run(["mpirun", "-n", "3", sys.executable, "-m", "turbopfor.convert", "--mpi",
+                    str(tmp_path / "in.nc4"), str(tmp_path / "mpi.h5"), "tasmin",
+                    "--chunks", "35,20,20", "--multiplier", "20", "--offset", "250"],
+                   check=True, cwd=root)
+    turbopfor.convert(tmp_path / "in.nc4", tmp_path / "serial.h5", "tasmin", (35, 20, 20),
+                      multiplier=20.0, offset=250.0, workers=0)
+    assert _stored_chunks(tmp_path / "mpi.h5") == _stored_chunks(tmp_path / "serial.h5")
@@ -0,0 +1,102 @@
+import os
+import sys
+
+# --- Auto-configure HDF5 Plugin Path for Testing ---
+# MUST BE DONE BEFORE IMPORTING h5py
+if "HDF5_PLUGIN_PATH" not in os.environ:
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    build_dir = os.path.join(project_root, "build")
+    if os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.so")) or \
+       os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.dylib")):
+        os.environ["HDF5_PLUGIN_PATH"] = build_dir
+
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import turbopfor
+from tests.helpers import random_walk, write_file
+
+# Deliberately not a multiple of the chunk shape so edge chunks are exercised
+DATA_SHAPE = (130, 45, 50)
+CHUNK_SHAPE = (50, 20, 20)
+
+
+def make_file(path, dtype=np.int16, userblock_size=0, **options):
+    data = random_walk(DATA_SHAPE, dtype, seed=4)
+    data[:, 40:] = -7  # the chunks past y=40 stay unwritten
+    data[:50, :20, :20] = 5  # constant chunk
+    return write_file(path, data, CHUNK_SHAPE, fillvalue=-7, userblock_size=userblock_size,
+                      **options)
+
+
+@pytest.mark.parametrize("key", [
+    np.s_[...],
+    np.s_[10:120, 5:40, 3:47],
+    np.s_[7],
+    np.s_[:, 30, :],
+    np.s_[50:100, 20:40],
+    np.s_[5:5],
+])
+def test_mapped_read(tmp_path, key):
+    path = tmp_path / "mapped.h5"
+    data = make_file(path, block_series=16)
+    with turbopfor.MappedDataset(path, "tasmin", workers=4) as dset:
+        assert dset.shape == DATA_SHAPE and dset.dtype == np.int16
+        assert np.array_equal(dset[key], data[key])
+        out = np.empty_like(data[key])
+        assert dset.read(key, out=out) is out
+        assert np.array_equal(out, data[key])
+        assert np.array_equal(dset.read_series(44, 49), data[:, 44, 49])
+        assert dset.chunk_bytes((0, 40, 0)) is None
+
+
+def test_mapped_float_and_userblock(tmp_path):
+    path = tmp_path / "float.h5"
+    data = make_file(path, np.float32, userblock_size=512, multiplier=10.0, mask=True)
+    with turbopfor.MappedDataset(path, "tasmin", workers=1) as dset:
+        assert np.array_equal(dset[...], data, equal_nan=True)
+        with pytest.raises(ValueError):
+            dset.read(np.s_[0], out=np.empty((45, 50), np.float64))
+
+
+def test_sidecar(tmp_path):
+    path = tmp_path / "sidecar.h5"
+    data = make_file(path)
+    sidecar = turbopfor.mapped.sidecar_path(path, "tasmin")
+    turbopfor.MappedDataset(path, "tasmin").close()
+    assert os.path.exists(sidecar)
+    stamp = os.stat(sidecar).st_mtime_ns
+    with turbopfor.MappedDataset(path, "tasmin") as dset:
+        assert np.array_equal(dset[...], data)
+    assert os.stat(sidecar).st_mtime_ns == stamp
+
+    # A modified file invalidates the index
+    with h5py.File(path, "a") as f:
+        f["tasmin"][:, 40:] = 1
+    data[:, 40:] = 1
+    with turbopfor.MappedDataset(path, "tasmin") as dset:
+        assert np.array_equal(dset[...], data)
+    index = turbopfor.load_index(path, "tasmin")
+    assert len(index["offsets"]) == 3 * 3 * 3
+
+
+def test_sidecar_not_writable(tmp_path):
+    path = tmp_path / "data" / "archive.h5"
+    path.parent.mkdir()
+    data = make_file(path)
+    # A sidecar below a regular file cannot be created, whoever runs the tests
+    with turbopfor.MappedDataset(path, "tasmin", sidecar=path / "index.npz") as dset:
+        assert np.array_equal(dset[...], data)
+
+    os.chmod(path.parent, 0o555)
+    try:
+        if os.access(path.parent, os.W_OK):
+            pytest.skip("permissions are not enforced for this user")
+        with turbopfor.MappedDataset(path, "tasmin") as dset:
+            assert np.array_equal(dset[...], data)
+        assert os.listdir(path.parent) == ["archive.h5"]
+    finally:
+        os.chmod(path.parent, 0o755)
@@ -0,0 +1,171 @@
+import os
+import sys
+import warnings
+
+# --- Auto-configure HDF5 Plugin Path for Testing ---
+# MUST BE DONE BEFORE IMPORTING h5py
+if "HDF5_PLUGIN_PATH" not in os.environ:
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    build_dir = os.path.join(project_root, "build")
+    if os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.so")) or \
+       os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.dylib")):
+        os.environ["HDF5_PLUGIN_PATH"] = build_dir
+
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import turbopfor
+from tests.helpers import write_file
+from turbopfor.convert import main
+
+# Deliberately not a multiple of the chunk shape or the windows
+DATA_SHAPE = (100, 45, 50)
+CHUNK_SHAPE = (50, 20, 20)
+MONTHS = [0, 31, 59, 90, 100]
+
+
+def reference(data, edges, factor, statistic):
+    """NaN-aware reduction of each window over padded factor x factor blocks."""
+    reduce = {"mean": np.nanmean, "min": np.nanmin, "max": np.nanmax}[statistic]
+    ny, nx = -(-data.shape[1] // factor), -(-data.shape[2] // factor)
+    padded = np.full((data.shape[0], ny * factor, nx * factor), np.nan)
+    padded[:, :data.shape[1], :data.shape[2]] = data
+    out = np.empty((len(edges) - 1, ny, nx))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN blocks
+        for i, (a, b) in enumerate(zip(edges[:-1], edges[1:])):
+            window = padded[a:b].reshape(b - a, ny, factor, nx, factor)
+            out[i] = reduce(window, axis=(0, 2, 4))
+    return out
+
+
+def make_file(path, dtype=np.float32, **build):
+    """Writes the primary dataset and builds its pyramid, returns the stored data."""
+    rng = np.random.default_rng(6)
+    t = np.arange(DATA_SHAPE[0])[:, None, None]
+    data = 270 + 8 * np.sin(t / 10) + rng.normal(0, 1, DATA_SHAPE)
+    if dtype == np.float32:
+        data = data.astype(np.float32)
+        data[:, :12, :9] = np.nan
+        options = dict(multiplier=20.0, offset=250.0, mask=True)
+    else:
+        data = np.round(data * 10).astype(dtype)
+        data[:, :12, :9] = turbopfor.fill_value(dtype)
+        options = {}
+    data = write_file(path, data, CHUNK_SHAPE, **options)
+    with h5py.File(path, "a") as f:
+        levels = turbopfor.build_pyramid(f["tasmin"], **build) if build else []
+    return data, levels
+
+
+def test_levels_match_reference(tmp_path):
+    data, levels = make_file(tmp_path / "pyramid.h5", time_windows=(7, ("month", MONTHS)),
+                             space_factors=(2, 4), statistics=("mean", "min", "max"))
+    with h5py.File(tmp_path / "pyramid.h5", "r") as f:
+        dset = f["tasmin"]
+        assert len(levels) == 3 * (3 * 3 - 1)
+        assert {lv.name for lv in turbopfor.pyramid_levels(dset)} == {lv.name for lv in levels}
+        for level in levels:
+            expected = reference(data, level.edges, level.space_factor, level.statistic)
+            stored = f[level.name][...]
+            assert np.array_equal(np.isnan(stored), np.isnan(expected)), level.name
+            assert np.nanmax(np.abs(stored - expected)) <= 0.5 / 20 + 1e-3, level.name
+
+        # Read straight from the stored levels
+        monthly = turbopfor.read_aggregate(dset, "max", "month", 4)
+        assert np.array_equal(monthly, f[pyramid_name(dset, "max_tmonth_s4")][...], equal_nan=True)
+        week = turbopfor.read_aggregate(dset, "mean", 7, 2, key=np.s_[3, 5:15])
+        assert np.array_equal(week, f[pyramid_name(dset, "mean_t7_s2")][3, 5:15], equal_nan=True)
+        with pytest.raises(KeyError):
+            turbopfor.read_aggregate(dset, "mean", "season")
+
+
+def pyramid_name(dset, level):
+    return f"{turbopfor.pyramid.pyramid_group(dset)}/{level}"
+
+
+@pytest.mark.parametrize("statistic", ["mean", "min", "max"])
+def test_derived_levels(tmp_path, statistic):
+    path = tmp_path / "derived.h5"
+    data, _ = make_file(path)
+    data = data[:, 12:, 12:]  # away from the missing corner, where means stay exact
+    with h5py.File(path, "a") as f:
+        inner = f.create_dataset("inner", data=data, **turbopfor.dataset_options(
+            CHUNK_SHAPE, np.float32, multiplier=20.0, offset=250.0))
+        turbopfor.build_pyramid(inner, time_windows=(7,), space_factors=(2,),
+                                statistics=(statistic,))
+    with h5py.File(path, "r") as f:
+        inner = f["inner"]
+        # 14-step windows at factor 8 derive from the 7-step level at factor 2
+        level = turbopfor.pyramid._choose_level(inner, statistic, 14, 8)
+        assert level.name.endswith(f"{statistic}_t7_s2")
+        expected = reference(data, np.append(np.arange(0, 100, 14), 100), 8, statistic)
+        out = turbopfor.read_aggregate(inner, statistic, 14, 8)
+        assert out.dtype == np.float32 and out.shape == expected.shape
+        assert np.max(np.abs(out - expected)) <= 0.5 / 20 + 1e-3
+        # Windows no level divides come from the primary data
+        assert turbopfor.pyramid._choose_level(inner, statistic, 5, 3) is None
+        expected = reference(data, np.append(np.arange(0, 100, 5), 100), 3, statistic)
+        assert np.allclose(turbopfor.read_aggregate(inner, statistic, 5, 3), expected, atol=1e-4)
+
+
+def test_integer_fill_and_stale_levels(tmp_path):
+    data, _ = make_file(tmp_path / "int.h5", np.int16, time_windows=(10,), space_factors=(4,),
+                        statistics=("min",))
+    with h5py.File(tmp_path / "int.h5", "r") as f:
+        dset = f["tasmin"]
+        values = np.where(data == turbopfor.fill_value(np.int16), np.nan, data)
+        expected = reference(values, np.arange(0, 101, 10), 4, "min")
+        assert np.array_equal(turbopfor.read_aggregate(dset, "min", 10, 4), expected,
+                              equal_nan=True)
+
+    with h5py.File(tmp_path / "int.h5", "a") as f:
+        f.create_dataset("grown", data=f["tasmin"][...], maxshape=(None, 45, 50),
+                         **turbopfor.dataset_options(CHUNK_SHAPE, np.int16))
+        grown = f["grown"]
+        turbopfor.build_pyramid(grown, time_windows=(10,), space_factors=())
+        assert len(turbopfor.pyramid_levels(grown)) == 1
+        grown.resize(120, axis=0)
+        assert turbopfor.pyramid_levels(grown) == []
+
+
+def test_convert_with_pyramid(tmp_path):
+    with h5py.File(tmp_path / "in.h5", "w") as f:
+        f["counts"] = np.arange(np.prod(DATA_SHAPE), dtype=np.int32).reshape(DATA_SHAPE) % 1000
+    turbopfor.convert(tmp_path / "in.h5", tmp_path / "out.h5", "counts", CHUNK_SHAPE, workers=0,
+                      pyramid={"time_windows": [10], "space_factors": [5]})
+    with h5py.File(tmp_path / "out.h5", "r") as f:
+        levels = turbopfor.pyramid_levels(f["counts"])
+        assert sorted((lv.time_window, lv.space_factor) for lv in levels) == [
+            ("1", 5), ("10", 1), ("10", 5)]
+        data = f["counts"][...].astype(np.float64)
+        assert np.allclose(turbopfor.read_aggregate(f["counts"], "mean", 10, 5),
+                           reference(data, np.arange(0, 101, 10), 5, "mean"), atol=0.5)
+
+
+def test_month_edges():
+    # 2019-12-30 to 2020-03-09 in half days: 2 + 31 + 29 + 8 days
+    times = np.arange(140) / 2 + 7303
+    edges = turbopfor.month_edges(times, b"days since 2000-01-01 00:00:00")
+    assert list(edges) == [0, 4, 66, 124, 140]
+    assert list(turbopfor.month_edges([0, 24, 48], "hours since 2021-01-31")) == [0, 1, 3]
+    with pytest.raises(ValueError):
+        turbopfor.month_edges(times, "days since 2000-01-01", calendar="noleap")
+    with pytest.raises(ValueError):
+        turbopfor.month_edges(times, "fortnights since 2000-01-01")
+
+
+def test_convert_main_with_months(tmp_path):
+    with h5py.File(tmp_path / "in.h5", "w") as f:
+        f["counts"] = np.arange(np.prod(DATA_SHAPE), dtype=np.int32).reshape(DATA_SHAPE) % 1000
+        f["time"] = np.arange(DATA_SHAPE[0]) + 7671.0  # from 2021-01-01
+        f["time"].attrs["units"] = "days since 2000-01-01"
+    main([str(tmp_path / "in.h5"), str(tmp_path / "out.h5"), "counts",
+                  "--chunks", "50,20,20", "--workers", "0", "--pyramid", "--pyramid-time", "10",
+                  "--pyramid-space", "", "--pyramid-months"])
+    with h5py.File(tmp_path / "out.h5", "r") as f:
+        month = [lv for lv in turbopfor.pyramid_levels(f["counts"]) if lv.time_window == "month"]
+        assert len(month) == 1 and list(month[0].edges) == MONTHS
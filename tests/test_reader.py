@@ -0,0 +1,127 @@
+import os
+import sys
+
+# --- Auto-configure HDF5 Plugin Path for Testing ---
+# MUST BE DONE BEFORE IMPORTING h5py
+if "HDF5_PLUGIN_PATH" not in os.environ:
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    build_dir = os.path.join(project_root, "build")
+    if os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.so")) or \
+       os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.dylib")):
+        os.environ["HDF5_PLUGIN_PATH"] = build_dir
+
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import turbopfor
+
+# Deliberately not a multiple of the chunk shape so edge chunks are exercised
+DATA_SHAPE = (130, 45, 50)
+CHUNK_SHAPE = (50, 20, 20)
+
+
+def make_dataset(path, block_series=None, dtype=np.int16):
+    rng = np.random.default_rng(1)
+    data = np.cumsum(rng.integers(-3, 4, DATA_SHAPE), axis=0).astype(dtype)
+    with h5py.File(path, "w") as f:
+        f.create_dataset("tasmin", data=data, chunks=CHUNK_SHAPE,
+                         compression=turbopfor.FILTER_ID,
+                         compression_opts=turbopfor.cd_values_for(CHUNK_SHAPE, dtype, block_series))
+    return data
+
+
+@pytest.mark.parametrize("block_series", [None, 1, 32])
+def test_read_series(tmp_path, block_series):
+    path = tmp_path / "series.h5"
+    data = make_dataset(path, block_series)
+    with h5py.File(path, "r") as f:
+        dset = f["tasmin"]
+        assert np.array_equal(dset[:], data)
+        for y, x in [(0, 0), (19, 21), (44, 49), (23, 7)]:
+            assert np.array_equal(turbopfor.read_series(dset, y, x), data[:, y, x])
+
+
+@pytest.mark.parametrize("key", [
+    np.s_[...],
+    np.s_[10:120, 5:40, 3:47],
+    np.s_[7],
+    np.s_[:, 30, :],
+    np.s_[60:61, :, -5:],
+    np.s_[5:5],
+])
+def test_read_parallel(tmp_path, key):
+    path = tmp_path / "parallel.h5"
+    data = make_dataset(path, dtype=np.int32)
+    with h5py.File(path, "r") as f:
+        out = turbopfor.read_parallel(f["tasmin"], key, workers=4)
+    assert out.shape == data[key].shape
+    assert np.array_equal(out, data[key])
+
+
+def test_read_parallel_fill(tmp_path):
+    path = tmp_path / "sparse.h5"
+    with h5py.File(path, "w") as f:
+        dset = f.create_dataset("tasmin", shape=DATA_SHAPE, dtype=np.int16, chunks=CHUNK_SHAPE,
+                                fillvalue=-99, compression=turbopfor.FILTER_ID,
+                                compression_opts=turbopfor.cd_values_for(CHUNK_SHAPE, np.int16))
+        dset[:50, :20, :20] = 7
+        dset[60:, 20:, 20:] = np.arange(70 * 25 * 30).reshape(70, 25, 30)
+    with h5py.File(path, "r") as f:
+        dset = f["tasmin"]
+        assert np.array_equal(turbopfor.read_parallel(dset), dset[...])
+        with pytest.raises(IndexError):
+            turbopfor.read_parallel(dset, np.s_[::2])
+
+
+def test_single_worker_runs_inline(tmp_path, monkeypatch):
+    path = tmp_path / "inline.h5"
+    data = make_dataset(path)
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError("a thread pool was started")
+
+    monkeypatch.setattr(turbopfor.reader.concurrent.futures, "ThreadPoolExecutor", no_pool)
+    with h5py.File(path, "r") as f:
+        dset = f["tasmin"]
+        assert np.array_equal(turbopfor.read_parallel(dset, workers=1), data)
+        assert np.array_equal(turbopfor.read_parallel(dset, np.s_[:50, :20, :20]),
+                              data[:50, :20, :20])
+        out = turbopfor.read_points(dset, [3, 44], [4, 49], workers=1)
+        assert np.array_equal(out, data[:, [3, 44], [4, 49]].T)
+
+
+@pytest.mark.parametrize("block_series", [None, 16])
+@pytest.mark.parametrize("t_slice", [slice(None), slice(45, 110), slice(60, 60)])
+def test_read_points(tmp_path, block_series, t_slice):
+    path = tmp_path / "points.h5"
+    data = make_dataset(path, block_series)
+    rng = np.random.default_rng(7)
+    ys = rng.integers(0, DATA_SHAPE[1], 200)
+    xs = rng.integers(0, DATA_SHAPE[2], 200)
+    ys[:3], xs[:3] = 44, 49  # duplicates and the corner edge chunk
+    cache = turbopfor.ChunkCache()
+    with h5py.File(path, "r") as f:
+        out = turbopfor.read_points(f["tasmin"], ys, xs, t_slice, cache=cache)
+    assert np.array_equal(out, data[t_slice, ys, xs].T)
+    if t_slice.start is None:
+        # One decode per distinct chunk (sub-block), however many points share it
+        cy, cx = ys // CHUNK_SHAPE[1], xs // CHUNK_SHAPE[2]
+        series = (ys % CHUNK_SHAPE[1]) * CHUNK_SHAPE[2] + xs % CHUNK_SHAPE[2]
+        parts = (cy, cx) if block_series is None else (cy, cx, series // block_series)
+        distinct = len(set(zip(*parts)))
+        assert cache.stats().entries == distinct * -(-DATA_SHAPE[0] // CHUNK_SHAPE[0])
+
+
+if __name__ == "__main__":
+    import tempfile
+    import pathlib
+    for block_series in (None, 1, 32):
+        with tempfile.TemporaryDirectory() as tmp:
+            test_read_series(pathlib.Path(tmp), block_series)
+    print("SUCCESS: series reads match h5py.")
+    with tempfile.TemporaryDirectory() as tmp:
+        test_read_parallel(pathlib.Path(tmp), np.s_[10:120, 5:40, 3:47])
+    print("SUCCESS: parallel reads match h5py.")
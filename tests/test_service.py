@@ -0,0 +1,114 @@
+import asyncio
+import os
+import sys
+
+# --- Auto-configure HDF5 Plugin Path for Testing ---
+# MUST BE DONE BEFORE IMPORTING h5py
+if "HDF5_PLUGIN_PATH" not in os.environ:
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    build_dir = os.path.join(project_root, "build")
+    if os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.so")) or \
+       os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.dylib")):
+        os.environ["HDF5_PLUGIN_PATH"] = build_dir
+
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import turbopfor
+from tests.helpers import random_walk, write_file
+
+CHUNK_SHAPE = (50, 10, 10)
+SPATIAL = (25, 30)
+
+
+def make_years(tmp_path, years=(2019, 2020, 2021), time=True):
+    parts = []
+    for i, year in enumerate(years):
+        path = tmp_path / f"tasmin_{year}.h5"
+        data = write_file(path, random_walk((60 + 10 * i,) + SPATIAL, seed=5 + i), CHUNK_SHAPE)
+        if time:
+            with h5py.File(path, "a") as f:
+                f["time"] = np.arange(len(data)) + 1000 * (year - 2000)
+                f["time"].attrs["units"] = "days since 2000-01-01"
+        parts.append(data)
+    return parts
+
+
+def test_read_across_files(tmp_path):
+    parts = make_years(tmp_path)
+    data = np.concatenate(parts)
+    # Given out of order; the time coordinate puts them back
+    paths = [tmp_path / f"tasmin_{y}.h5" for y in (2021, 2019, 2020)]
+
+    async def run():
+        async with turbopfor.TimeseriesService(paths, "tasmin", workers=3) as service:
+            assert await service.shape() == data.shape
+            assert [p.stop - p.start for p in await service.parts()] == [60, 70, 80]
+            series = await service.read_series(24, 29)
+            points = await service.read_points([0, 12, 24], [3, 29, 0], slice(40, 150))
+            empty = await service.read_points([1, 2], [3, 4], slice(5, 5))
+            times = await service.times()
+            gathered = await asyncio.gather(*(service.read_series(y, 7) for y in range(5)))
+            return series, points, empty, times, gathered, service.pool.stats()
+
+    series, points, empty, times, gathered, stats = asyncio.run(run())
+    assert np.array_equal(series, data[:, 24, 29])
+    assert np.array_equal(points, data[40:150, [0, 12, 24], [3, 29, 0]].T)
+    assert empty.shape == (2, 0)
+    assert np.all(np.diff(times) > 0) and len(times) == len(data)
+    for y, values in enumerate(gathered):
+        assert np.array_equal(values, data[:, y, 7])
+    # Each file is opened once for all those queries
+    assert stats.misses == 3 and stats.open == 3
+
+
+def test_order_by_path_without_time(tmp_path):
+    parts = make_years(tmp_path, time=False)
+    paths = [tmp_path / f"tasmin_{y}.h5" for y in (2020, 2021, 2019)]
+
+    async def run():
+        async with turbopfor.TimeseriesService(paths, "tasmin") as service:
+            return await service.read_series(3, 4), await service.times()
+
+    series, times = asyncio.run(run())
+    assert np.array_equal(series, np.concatenate(parts)[:, 3, 4])
+    assert times is None
+
+
+def test_pool_eviction(tmp_path):
+    make_years(tmp_path)
+    paths = [tmp_path / f"tasmin_{y}.h5" for y in (2019, 2020, 2021)]
+    pool = turbopfor.FileHandlePool(max_files=2)
+    with pool.dataset(paths[0], "tasmin") as held:
+        with pool.file(paths[1]), pool.file(paths[2]):
+            pass
+        # Evicted while borrowed: still readable until returned
+        assert held.shape[0] == 60
+        assert pool.stats().evictions == 1 and len(pool) == 2
+    assert not held.id.valid
+    with pool.file(paths[2]) as f:
+        assert f["tasmin"].shape[0] == 80
+    assert pool.stats().hits == 1
+    pool.close()
+    assert len(pool) == 0
+
+
+def test_mismatched_files(tmp_path):
+    make_years(tmp_path, years=(2019,))
+    with h5py.File(tmp_path / "other.h5", "w") as f:
+        f.create_dataset("tasmin", data=np.zeros((10, 5, 5), np.int16),
+                         **turbopfor.dataset_options((10, 5, 5), np.int16))
+
+    async def run():
+        service = turbopfor.TimeseriesService([tmp_path / "tasmin_2019.h5", tmp_path / "other.h5"],
+                                              "tasmin")
+        try:
+            await service.read_series(0, 0)
+        finally:
+            service.close()
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
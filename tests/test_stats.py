@@ -0,0 +1,83 @@
+import os
+import subprocess
+import sys
+
+# --- Auto-configure HDF5 Plugin Path for Testing ---
+# MUST BE DONE BEFORE IMPORTING h5py
+if "HDF5_PLUGIN_PATH" not in os.environ:
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    build_dir = os.path.join(project_root, "build")
+    if os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.so")) or \
+       os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.dylib")):
+        os.environ["HDF5_PLUGIN_PATH"] = build_dir
+
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import turbopfor
+
+CHUNK_SHAPE = (100, 20, 20)
+
+
+@pytest.fixture
+def stats_enabled():
+    previous = turbopfor.enable_filter_stats()
+    turbopfor.reset_filter_stats()
+    yield
+    turbopfor.enable_filter_stats(previous)
+
+
+def make_data():
+    rng = np.random.default_rng(0)
+    return np.cumsum(rng.integers(-3, 4, CHUNK_SHAPE), axis=0).astype(np.int16)
+
+
+def test_codec_counters(stats_enabled):
+    data = make_data()
+    encoded = turbopfor.encode(data, predictor=0)
+    turbopfor.decode(encoded, data.shape, data.dtype)
+    with pytest.raises(ValueError):
+        turbopfor.decode(encoded, (50, 20, 20), data.dtype)  # wrong chunk shape
+
+    stats = turbopfor.filter_stats()
+    assert stats.encode.calls == 1 and stats.encode.errors == 0
+    assert stats.encode.bytes_in == data.nbytes and stats.encode.bytes_out == len(encoded)
+    assert stats.decode.calls == 1 and stats.decode.errors == 1
+    assert stats.decode.bytes_in == len(encoded) and stats.decode.bytes_out == data.nbytes
+    bin_ = (data.nbytes // len(encoded)).bit_length()
+    assert stats.encode.ratio_histogram[bin_] == 1 and sum(stats.encode.ratio_histogram) == 1
+    assert stats.decode.ratio_histogram == stats.encode.ratio_histogram
+    for direction in stats:
+        assert direction.seconds >= direction.predict_seconds + direction.codec_seconds > 0
+
+    turbopfor.reset_filter_stats()
+    assert turbopfor.filter_stats().encode.calls == 0
+
+
+def test_filter_counters(tmp_path, stats_enabled):
+    data = np.concatenate([make_data()] * 3, axis=1)
+    path = tmp_path / "stats.h5"
+    with h5py.File(path, "w") as f:
+        f.create_dataset("data", data=data, chunks=CHUNK_SHAPE, compression=turbopfor.FILTER_ID,
+                         compression_opts=turbopfor.cd_values_for(CHUNK_SHAPE, data.dtype))
+    with h5py.File(path, "r") as f:
+        assert np.array_equal(f["data"][:], data)
+    stats = turbopfor.filter_stats()
+    assert stats.encode.calls == 3 and stats.decode.calls == 3
+    assert stats.encode.bytes_out == stats.decode.bytes_in
+
+
+def test_disabled_by_default_and_environment():
+    code = "import turbopfor; print(turbopfor.enable_filter_stats())"
+    env = dict(os.environ)
+    env.pop("TURBOPFOR_STATS", None)
+    for value, expected in ((None, "False"), ("0", "False"), ("1", "True")):
+        if value is not None:
+            env["TURBOPFOR_STATS"] = value
+        out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True,
+                             text=True, check=True, cwd=os.path.dirname(os.path.dirname(
+                                 os.path.abspath(__file__))))
+        assert out.stdout.strip() == expected
@@ -0,0 +1,86 @@
+import os
+import sys
+
+# --- Auto-configure HDF5 Plugin Path for Testing ---
+# MUST BE DONE BEFORE IMPORTING h5py
+if "HDF5_PLUGIN_PATH" not in os.environ:
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(current_dir)
+    build_dir = os.path.join(project_root, "build")
+    if os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.so")) or \
+       os.path.exists(os.path.join(build_dir, "libH5Zturbopfor.dylib")):
+        os.environ["HDF5_PLUGIN_PATH"] = build_dir
+
+import h5py
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import turbopfor
+from turbopfor import tune
+
+
+def make_sample(shape=(64, 32, 32)):
+    rng = np.random.default_rng(0)
+    return np.cumsum(rng.integers(-2, 3, shape), axis=0).astype(np.int16)
+
+
+def test_dataset_options_match_chunks(tmp_path):
+    data = make_sample()
+    options = turbopfor.dataset_options((64, 8, 16), data.dtype, predictor=0)
+    assert options["compression_opts"][-3:] == options["chunks"] == (64, 8, 16)
+    with h5py.File(tmp_path / "opts.h5", "w") as f:
+        dset = f.create_dataset("data", data=data, **options)
+        assert turbopfor.filter_cd_values(dset)[-3:] == dset.chunks
+        assert np.array_equal(dset[:], data)
+
+
+def test_access_patterns():
+    assert tune.parse_access("series=0.7,map=0.3") == {"series": 0.7, "map": 0.3}
+    assert tune.parse_access("30x:x10=2") == {(30, None, 10): 2.0}
+    extents = tune.access_extents({"series": 1, (1, 5, 5): 3}, 3)
+    assert extents == {(None, 1, 1): 1.0, (1, 5, 5): 3.0}
+    with pytest.raises(ValueError):
+        tune.access_extents({"diagonal": 1}, 3)
+
+
+def test_chunks_touched():
+    shape = (366, 100, 100)
+    assert tune.chunks_touched((None, 1, 1), (366, 10, 10), shape) == 1
+    assert tune.chunks_touched((1, None, None), (366, 10, 10), shape) == 100
+    assert tune.chunks_touched((None, 1, 1), (61, 10, 10), shape) == 6
+
+
+def test_candidate_chunks():
+    candidates = tune.candidate_chunks((366, 100, 100), 2, 16 * 1024, 64 * 1024)
+    assert (366, 8, 8) in candidates
+    for chunks in candidates:
+        assert 16 * 1024 <= np.prod(chunks) * 2 <= 64 * 1024
+
+
+@pytest.mark.parametrize("access, axis", [("series", 0), ("map", 1)])
+def test_tune_follows_access(access, axis):
+    sample = make_sample()
+    results = tune.tune_chunks(sample, {access: 1}, shape=(64, 256, 256), top=4, repeat=1,
+                               min_bytes=2048, max_bytes=8192)
+    assert [r.score for r in results] == sorted(r.score for r in results)
+    best = results[0]
+    # Series want whole time axes, maps a single time step per chunk row
+    if axis == 0:
+        assert best.chunks[0] == sample.shape[0]
+    else:
+        assert best.chunks[0] < sample.shape[0]
+    assert best.cd_values == turbopfor.cd_values_for(best.chunks, sample.dtype)
+    assert best.ratio > 1
+
+
+def test_tune_weights():
+    sample = make_sample()
+    kwargs = dict(shape=(64, 256, 256), top=4, repeat=1, min_bytes=2048, max_bytes=8192)
+    results = tune.tune_chunks(sample, {"map": 1}, **kwargs)
+    assert all(r.score == r.read_seconds for r in results)
+
+    results = tune.tune_chunks(sample, {"map": 1}, storage_weight=2, encode_weight=0.5, **kwargs)
+    assert [r.score for r in results] == sorted(r.score for r in results)
+    for r in results:
+        assert r.score == pytest.approx(r.read_seconds / r.ratio ** 2 / r.encode_mb_s ** 0.5)
@@ -0,0 +1,84 @@
+"""Python access to the H5TurboPFor compression pipeline."""
+from .append import append, compact
+from .cache import CacheStats, ChunkCache, chunk_key
+from .codec import (
+    FILTER_ID,
+    BlockIndex,
+    ChunkHeader,
+    SegmentInfo,
+    TurboPFor,
+    append_rows,
+    block_index,
+    cd_values_for,
+    chunk_header,
+    constant_value,
+    dataset_options,
+    decode,
+    decode_block,
+    decode_into,
+    decode_series,
+    dequantize,
+    encode,
+    fill_value,
+    quantization,
+    recode,
+    segment_info,
+)
+from .convert import ConversionStats, convert, convert_mpi
+from .mapped import MappedDataset, build_index, load_index
+from .pyramid import PyramidLevel, build_pyramid, month_edges, pyramid_levels, read_aggregate
+from .reader import filter_cd_values, read_parallel, read_points, read_series
+from .service import FileHandlePool, PoolStats, TimeseriesService
+from .stats import DirectionStats, FilterStats, enable_filter_stats, filter_stats, reset_filter_stats
+
+__all__ = [
+    "FILTER_ID",
+    "BlockIndex",
+    "CacheStats",
+    "ChunkCache",
+    "ChunkHeader",
+    "ConversionStats",
+    "DirectionStats",
+    "FileHandlePool",
+    "FilterStats",
+    "MappedDataset",
+    "PyramidLevel",
+    "PoolStats",
+    "SegmentInfo",
+    "TimeseriesService",
+    "TurboPFor",
+    "append",
+    "append_rows",
+    "block_index",
+    "build_index",
+    "build_pyramid",
+    "cd_values_for",
+    "chunk_header",
+    "chunk_key",
+    "compact",
+    "constant_value",
+    "convert",
+    "convert_mpi",
+    "dataset_options",
+    "decode",
+    "decode_block",
+    "decode_into",
+    "decode_series",
+    "dequantize",
+    "enable_filter_stats",
+    "encode",
+    "fill_value",
+    "load_index",
+    "month_edges",
+    "quantization",
+    "filter_cd_values",
+    "filter_stats",
+    "pyramid_levels",
+    "read_aggregate",
+    "read_parallel",
+    "read_points",
+    "read_series",
+    "recode",
+    "reset_filter_stats",
+    "segment_info",
+]
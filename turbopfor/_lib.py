@@ -0,0 +1,86 @@
+"""
+Locates the compiled H5Zturbopfor plugin and exposes its C entry points via ctypes.
+
+The plugin library doubles as the codec kernel for Python: the same shared
+object HDF5 loads as filter 62016 also exports turbopfor_encode/turbopfor_decode.
+ctypes releases the GIL for the duration of every foreign call.
+"""
+import ctypes
+import os
+import sys
+
+if sys.platform == "darwin":
+    LIB_NAMES = ("libH5Zturbopfor.dylib",)
+elif sys.platform == "win32":
+    LIB_NAMES = ("H5Zturbopfor.dll", "libH5Zturbopfor.dll")
+else:
+    LIB_NAMES = ("libH5Zturbopfor.so",)
+
+_lib = None
+
+
+def _candidate_dirs():
+    # Same search order as the scripts: explicit plugin path first, then build/
+    for path in os.environ.get("HDF5_PLUGIN_PATH", "").split(os.pathsep):
+        if path:
+            yield path
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    yield os.path.join(project_root, "build")
+    yield project_root
+
+
+def find_library():
+    """Returns the path of the plugin library, or None if it cannot be found."""
+    explicit = os.environ.get("TURBOPFOR_LIB")
+    if explicit:
+        return explicit
+    for directory in _candidate_dirs():
+        for name in LIB_NAMES:
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def load():
+    """Loads the plugin library once and declares the exported signatures."""
+    global _lib
+    if _lib is not None:
+        return _lib
+
+    path = find_library()
+    if path is None:
+        raise OSError(
+            "Could not find libH5Zturbopfor. Build the project and run 'source setup.sh', "
+            "or point TURBOPFOR_LIB at the library."
+        )
+    lib = ctypes.CDLL(path)
+
+    size_t = ctypes.c_size_t
+    cd_values_p = ctypes.POINTER(ctypes.c_uint)
+    for name in ("turbopfor_encode", "turbopfor_decode"):
+        func = getattr(lib, name)
+        func.argtypes = [size_t, cd_values_p, ctypes.c_void_p, size_t, ctypes.c_void_p, size_t]
+        func.restype = size_t
+    lib.turbopfor_decode_block.argtypes = [ctypes.c_void_p, size_t, size_t, ctypes.c_void_p, size_t]
+    lib.turbopfor_decode_block.restype = size_t
+    for name in ("turbopfor_encode_bound", "turbopfor_decode_bound"):
+        func = getattr(lib, name)
+        func.argtypes = [size_t]
+        func.restype = size_t
+    lib.turbopfor_append.argtypes = [size_t, cd_values_p, ctypes.c_void_p, size_t, size_t,
+                                     ctypes.c_void_p, size_t, ctypes.c_void_p, size_t]
+    lib.turbopfor_append.restype = size_t
+    lib.turbopfor_append_bound.argtypes = [size_t, size_t]
+    lib.turbopfor_append_bound.restype = size_t
+    lib.turbopfor_stats_get.argtypes = [ctypes.c_void_p]
+    lib.turbopfor_stats_get.restype = None
+    lib.turbopfor_stats_reset.argtypes = []
+    lib.turbopfor_stats_reset.restype = None
+    lib.turbopfor_stats_enable.argtypes = [ctypes.c_int]
+    lib.turbopfor_stats_enable.restype = ctypes.c_int
+    lib.turbopfor_scratch_release.argtypes = []
+    lib.turbopfor_scratch_release.restype = None
+
+    _lib = lib
+    return _lib
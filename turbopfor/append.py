@@ -0,0 +1,103 @@
+"""
+Incremental appends along the first (time) axis of a TurboPFor dataset.
+
+Writing new time steps through h5py decodes and re-encodes every chunk they
+touch, which for long time chunks costs far more than the new data. append()
+instead adds the new rows to each stored chunk as one more segment
+(append_rows()), leaving the bytes already stored untouched. Readers decode
+segmented chunks like any other; compact() folds the segments back into the
+regular layout once the chunks are complete.
+"""
+import itertools
+
+import numpy as np
+
+from .codec import append_rows, fill_value, recode, segment_info
+from .reader import _read_chunk, filter_cd_values
+
+
+def _chunk_origins(shape, chunks):
+    return itertools.product(*(range(0, n, c) for n, c in zip(shape, chunks)))
+
+
+def append(dset, values, cache=None):
+    """
+    Appends values, shaped (steps, *dset.shape[1:]), to the end of the first axis
+    of dset, which must be resizable along it. Each chunk the new steps fall into
+    gets them as a new segment. Pass the ChunkCache used by the readers to drop
+    its stale entries. Returns the new length of the first axis.
+
+    Segments are delta coded along the first axis with P4N128V whatever the
+    dataset's predictor, codec, block_series and mask; compact() re-encodes the
+    chunks with them. Every chunk is encoded before dset is resized. If writing fails, the chunks
+    already written are restored and dset shrinks back to its old length.
+    """
+    values = np.asarray(values, dtype=dset.dtype)
+    if values.shape[1:] != dset.shape[1:]:
+        raise ValueError(f"values of shape {values.shape} do not extend {dset.shape}")
+    cd_values = filter_cd_values(dset)
+    old, chunks = dset.shape[0], dset.chunks
+    if len(values) == 0:
+        return old
+    new = old + len(values)
+
+    step = chunks[0]
+    blobs, restore = [], {}
+    for t0 in range(old - old % step, new, step):
+        start_row = max(old - t0, 0)
+        steps = values[t0 + start_row - old:t0 + step - old]
+        for origin in _chunk_origins(dset.shape[1:], chunks[1:]):
+            rows = steps[(slice(None),) + tuple(slice(o, o + c) for o, c in zip(origin, chunks[1:]))]
+            if rows.shape[1:] != chunks[1:]:  # edge chunk
+                padded = np.full((len(rows),) + chunks[1:], fill_value(dset.dtype), dset.dtype)
+                padded[(slice(None),) + tuple(slice(0, n) for n in rows.shape[1:])] = rows
+                rows = padded
+            offset = (t0,) + origin
+            raw = _read_chunk(dset, offset) if t0 < old else None
+            blobs.append((offset, append_rows(raw, rows, start_row, cd_values, dset.fillvalue)))
+            if start_row:
+                # What the chunk holds now; an unwritten one as its rows of fill value
+                restore[offset] = raw if raw is not None else append_rows(
+                    None, np.full((start_row,) + chunks[1:], dset.fillvalue, dset.dtype), 0,
+                    cd_values)
+
+    dset.resize(new, axis=0)
+    written = []
+    try:
+        for offset, blob in blobs:
+            dset.id.write_direct_chunk(offset, blob)
+            written.append(offset)
+    except BaseException:
+        try:
+            for offset in written:
+                if offset in restore:
+                    dset.id.write_direct_chunk(offset, restore[offset])
+        finally:
+            dset.resize(old, axis=0)
+        raise
+    if cache is not None:
+        cache.invalidate(dset.file.filename, dset.name)
+    return dset.shape[0]
+
+
+def compact(dset, min_segments=2, full_only=True, cache=None):
+    """
+    Re-encodes the segmented chunks of dset in the regular layout, which takes
+    less space and decodes faster. Chunks with fewer than min_segments segments
+    are kept; with full_only, so are those still waiting for rows. Returns the
+    number of chunks rewritten.
+    """
+    cd_values = filter_cd_values(dset)
+    count = 0
+    for offset in _chunk_origins(dset.shape, dset.chunks):
+        raw = _read_chunk(dset, offset)
+        info = segment_info(raw) if raw is not None else None
+        if info is None or len(info.segment_rows) < min_segments:
+            continue
+        if full_only and info.rows < dset.chunks[0]:
+            continue
+        dset.id.write_direct_chunk(offset, recode(raw, cd_values))
+        count += 1
+    if count and cache is not None:
+        cache.invalidate(dset.file.filename, dset.name)
+    return count
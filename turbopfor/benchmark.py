@@ -0,0 +1,366 @@
+"""
+Benchmark suite on synthetic fields, writing machine-readable results.
+
+Every case (field, dtype, chunk shape, filter) writes and reads a dataset
+through h5py. For TurboPFor it also times the raw encode/decode kernels
+without HDF5. Each case runs in a fresh process, so its peak RSS is its own.
+Results go to JSON. --baseline compares them against an earlier run and exits
+non-zero on a regression, so codec changes can be gated on it.
+
+    python -m turbopfor.benchmark --output bench.json
+    python -m turbopfor.benchmark --baseline bench.json --tolerance 0.15
+"""
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from .codec import FILTER_ID, cd_values_for, decode_into, encode, fill_value
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+FIELDS = ("smooth", "noisy", "masked", "constant", "spiky")
+DTYPES = ("int16", "int32", "float32")
+CHUNKS = ((366, 20, 20), (100, 50, 50), (24, 100, 100))
+FILTERS = ("turbopfor", "none", "gzip", "lzf", "shuffle", "szip")
+SHAPE = (366, 100, 100)
+
+# Quantization of the float32 cases: 0.05 K steps around 273.15 K
+MULTIPLIER = 20.0
+OFFSET = 273.15
+
+# Metrics compared by --baseline and whether larger values are better
+METRICS = {
+    "ratio": True,
+    "write_mb_s": True,
+    "read_mb_s": True,
+    "encode_mb_s": True,
+    "decode_mb_s": True,
+    "peak_rss_mb": False,
+}
+
+Case = collections.namedtuple("Case", ["field", "dtype", "chunks", "filter"])
+
+
+def make_field(kind, shape, dtype, seed=0):
+    """
+    Returns a synthetic (time, y, x) temperature-like field in kelvin, quantized
+    like the float32 cases for integer dtypes:
+
+    smooth: seasonal and spatial waves with a little noise
+    noisy: the same with noise of a few degrees
+    masked: smooth with a disk of fill values (a land/sea mask)
+    constant: a single value everywhere
+    spiky: smooth with rare large outliers
+    """
+    dtype = np.dtype(dtype)
+    rng = np.random.default_rng(seed)
+    t, y, x = np.meshgrid(*(np.linspace(0, 1, n, dtype=np.float32) for n in shape),
+                          indexing="ij", sparse=True)
+    values = (OFFSET + 10 * np.sin(2 * np.pi * t) + 5 * np.cos(3 * y) + 3 * np.sin(5 * x)
+              ).astype(np.float32)
+    if kind == "constant":
+        values = np.full(shape, OFFSET, dtype=np.float32)
+    elif kind == "noisy":
+        values = values + rng.normal(0, 3, shape).astype(np.float32)
+    elif kind == "spiky":
+        values = values + rng.normal(0, 0.1, shape).astype(np.float32)
+        spikes = rng.random(shape) < 1e-3
+        values[spikes] += rng.normal(0, 50, int(spikes.sum())).astype(np.float32)
+    else:
+        values = values + rng.normal(0, 0.1, shape).astype(np.float32)
+    missing = None
+    if kind == "masked":
+        missing = np.broadcast_to((y - 0.5) ** 2 + (x - 0.4) ** 2 < 0.1, shape)
+
+    if dtype.kind != "f":
+        info = np.iinfo(dtype)
+        values = np.round((values - OFFSET) * MULTIPLIER)
+        if dtype.kind == "u":
+            values += (info.max + 1) // 2
+        # Keep the fill value free for the masked cells
+        low, high = (info.min + 1, info.max) if dtype.kind == "i" else (info.min, info.max - 1)
+        values = np.clip(values, low, high).astype(dtype)
+    if missing is not None:
+        values[missing] = fill_value(dtype)
+    return values
+
+
+def _filter_options(name, chunks, dtype):
+    """h5py create_dataset keywords for a filter, or None if it is unavailable here."""
+    if name == "none":
+        return {}
+    if name == "turbopfor":
+        float_options = {"multiplier": MULTIPLIER, "offset": OFFSET} if dtype.kind == "f" else {}
+        return {"compression": FILTER_ID,
+                "compression_opts": cd_values_for(chunks, dtype, mask=True, **float_options)}
+    if name == "gzip":
+        return {"compression": "gzip", "compression_opts": 4}
+    if name == "lzf":
+        return {"compression": "lzf"}
+    if name == "shuffle":
+        return {"compression": "gzip", "compression_opts": 4, "shuffle": True}
+    if name == "szip":
+        if not h5py.h5z.filter_avail(h5py.h5z.FILTER_SZIP):
+            return None
+        return {"compression": "szip", "compression_opts": ("nn", 16)}
+    raise ValueError(f"unknown filter {name!r}")
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _mb_per_s(nbytes, seconds):
+    return nbytes / (1024 * 1024) / seconds if seconds > 0 else None
+
+
+def _best_time(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _chunk_slices(shape, chunks):
+    for origin in itertools.product(*(range(0, n, c) for n, c in zip(shape, chunks))):
+        yield tuple(slice(o, min(o + c, n)) for o, c, n in zip(origin, chunks, shape))
+
+
+def _kernel_times(data, chunks, dtype, repeat):
+    """Encode and decode times of the raw kernels over all whole chunks of data."""
+    float_options = {"multiplier": MULTIPLIER, "offset": OFFSET} if dtype.kind == "f" else {}
+    blocks = [np.ascontiguousarray(data[s]) for s in _chunk_slices(data.shape, chunks)]
+    blocks = [b for b in blocks if b.shape == tuple(chunks)]
+    if not blocks:
+        return None, None, 0
+    encoded = [encode(b, mask=True, **float_options) for b in blocks]
+    out = np.empty(chunks, dtype=dtype)
+
+    def decode_all():
+        for buf in encoded:
+            decode_into(buf, out, **float_options)
+
+    encode_time = _best_time(lambda: [encode(b, mask=True, **float_options) for b in blocks],
+                             repeat)
+    decode_time = _best_time(decode_all, repeat)
+    nbytes = sum(b.nbytes for b in blocks)
+    return encode_time, decode_time, nbytes
+
+
+def run_case(case, shape=SHAPE, repeat=3, directory=None):
+    """
+    Runs one Case and returns its result dict, or None if the filter is not
+    available. Peak RSS is that of the whole process, so run cases in fresh
+    processes (see run()) for per-case numbers.
+    """
+    dtype = np.dtype(case.dtype)
+    chunks = tuple(min(c, n) for c, n in zip(case.chunks, shape))
+    options = _filter_options(case.filter, chunks, dtype)
+    if options is None:
+        return None
+    data = make_field(case.field, shape, dtype)
+    result = dict(case._asdict(), chunks=list(chunks), shape=list(shape),
+                  raw_mb=data.nbytes / (1024 * 1024))
+
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        path = os.path.join(tmp, "bench.h5")
+
+        def write():
+            with h5py.File(path, "w") as f:
+                f.create_dataset("data", data=data, chunks=chunks, **options)
+
+        def read():
+            # Reopen each time so the chunk cache holds nothing decoded
+            with h5py.File(path, "r") as f:
+                f["data"][...]
+
+        write_time = _best_time(write, repeat)
+        read_time = _best_time(read, repeat)
+        with h5py.File(path, "r") as f:
+            stored = f["data"].id.get_storage_size()
+            restored = f["data"][...]
+
+    if dtype.kind == "f":
+        # Within the quantization step, with NaN in the same cells
+        valid = ~np.isnan(data)
+        error = float(np.max(np.abs(restored[valid] - data[valid]), initial=0.0))
+        exact = bool(np.array_equal(np.isnan(restored), ~valid)
+                     and error <= 0.5 / MULTIPLIER + 1e-3)
+    else:
+        error = 0.0
+        exact = bool(np.array_equal(restored, data))
+    result.update(
+        ratio=data.nbytes / stored if stored else None,
+        stored_mb=stored / (1024 * 1024),
+        write_mb_s=_mb_per_s(data.nbytes, write_time),
+        read_mb_s=_mb_per_s(data.nbytes, read_time),
+        encode_mb_s=None,
+        decode_mb_s=None,
+        max_error=error,
+        exact=exact,
+    )
+    if case.filter == "turbopfor":
+        encode_time, decode_time, nbytes = _kernel_times(data, chunks, dtype, repeat)
+        if nbytes:
+            result.update(encode_mb_s=_mb_per_s(nbytes, encode_time),
+                          decode_mb_s=_mb_per_s(nbytes, decode_time))
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def cases(fields=FIELDS, dtypes=DTYPES, chunks=CHUNKS, filters=FILTERS):
+    """The cross product of the sweep, as Case tuples."""
+    return [Case(*c) for c in itertools.product(fields, dtypes, [tuple(c) for c in chunks],
+                                                 filters)]
+
+
+def environment():
+    """Describes the machine and library versions a run was made with."""
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "h5py": h5py.version.version,
+        "hdf5": h5py.version.hdf5_version,
+    }
+
+
+def run(case_list, shape=SHAPE, repeat=3, isolate=True, directory=None, progress=None):
+    """
+    Runs the cases one after another and returns the results document.
+    isolate runs each case in a fresh process so peak RSS is per case.
+    """
+    results = []
+    if isolate:
+        context = multiprocessing.get_context("spawn")
+        executor = concurrent.futures.ProcessPoolExecutor(1, mp_context=context,
+                                                          max_tasks_per_child=1)
+    else:
+        executor = None
+    try:
+        for case in case_list:
+            if executor is None:
+                result = run_case(case, shape, repeat, directory)
+            else:
+                result = executor.submit(run_case, case, shape, repeat, directory).result()
+            if result is None:
+                continue
+            results.append(result)
+            if progress is not None:
+                progress(result)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return {"environment": environment(), "shape": list(shape), "repeat": repeat,
+            "results": results}
+
+
+def _key(result):
+    return (result["field"], result["dtype"], tuple(result["chunks"]), result["filter"])
+
+
+def compare(results, baseline, tolerance=0.1, metrics=METRICS):
+    """
+    Compares two results documents case by case. Returns a list of
+    (case key, metric, baseline value, new value) for every metric that got
+    worse by more than the tolerance fraction. Cases missing from either side
+    are ignored.
+    """
+    previous = {_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        old = previous.get(_key(result))
+        if old is None:
+            continue
+        for metric, higher_is_better in metrics.items():
+            before, after = old.get(metric), result.get(metric)
+            if before is None or after is None:
+                continue
+            if higher_is_better:
+                worse = after < before * (1 - tolerance)
+            else:
+                worse = after > before * (1 + tolerance)
+            if worse:
+                regressions.append((_key(result), metric, before, after))
+        if old.get("exact") and not result.get("exact"):
+            regressions.append((_key(result), "exact", True, False))
+    return regressions
+
+
+def _format(result):
+    def number(value, spec=".1f"):
+        return "-" if value is None else format(value, spec)
+
+    return (f"{result['field']:9} {result['dtype']:8} {'x'.join(map(str, result['chunks'])):12} "
+            f"{result['filter']:10} ratio {number(result['ratio'], '.2f'):>6}  "
+            f"write {number(result['write_mb_s']):>7}  read {number(result['read_mb_s']):>7}  "
+            f"enc {number(result['encode_mb_s']):>7}  dec {number(result['decode_mb_s']):>7} MB/s  "
+            f"rss {number(result['peak_rss_mb']):>6} MB")
+
+
+def _csv(value):
+    return [v for v in value.split(",") if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed relative loss per metric before it is a regression")
+    parser.add_argument("--fields", type=_csv, default=list(FIELDS))
+    parser.add_argument("--dtypes", type=_csv, default=list(DTYPES))
+    parser.add_argument("--chunks", nargs="+", default=[",".join(map(str, c)) for c in CHUNKS],
+                        help="chunk shapes, e.g. 366,20,20 100,50,50")
+    parser.add_argument("--filters", type=_csv, default=list(FILTERS))
+    parser.add_argument("--shape", default=",".join(map(str, SHAPE)))
+    parser.add_argument("--repeat", type=int, default=3, help="timings keep the best of n runs")
+    parser.add_argument("--in-process", action="store_true",
+                        help="run all cases in this process; peak RSS is then cumulative")
+    args = parser.parse_args(argv)
+
+    shape = tuple(int(n) for n in args.shape.split(","))
+    chunks = [tuple(int(n) for n in c.split(",")) for c in args.chunks]
+    results = run(cases(args.fields, args.dtypes, chunks, args.filters), shape, args.repeat,
+                  isolate=not args.in_process, progress=lambda r: print(_format(r), flush=True))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for key, metric, before, after in regressions:
+            print(f"REGRESSION {'/'.join(map(str, key))}: {metric} {before:.4g} -> {after:.4g}")
+        if regressions:
+            return 1
+        print(f"no regressions beyond {args.tolerance:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Byte-budgeted LRU cache of decoded chunks, shared by the readers.
+
+Repeated point and series queries hit the same chunks over and over; keeping
+their decoded form skips both read_direct_chunk and the decode.
+"""
+import collections
+import os
+import threading
+import weakref
+
+CacheStats = collections.namedtuple(
+    "CacheStats", ["hits", "misses", "evictions", "entries", "nbytes", "max_bytes"])
+
+
+# id(dset) -> (weak reference to dset, (file, dataset)), dropped with the dataset object
+_key_prefixes = {}
+
+
+def _key_prefix(dset):
+    """(file, dataset) of dset, looked up in HDF5 once per dataset object."""
+    ident = id(dset)
+    entry = _key_prefixes.get(ident)
+    if entry is not None and entry[0]() is dset:
+        return entry[1]
+    prefix = (os.path.realpath(dset.file.filename), dset.name)
+    _key_prefixes[ident] = (weakref.ref(dset, lambda _: _key_prefixes.pop(ident, None)), prefix)
+    return prefix
+
+
+def chunk_key(dset, origin, block=None):
+    """
+    Cache key of a chunk: (file, dataset, chunk origin), plus the sub-block
+    for blocked reads that decode only part of the chunk.
+    """
+    key = _key_prefix(dset) + (tuple(int(o) for o in origin),)
+    return key if block is None else key + (int(block),)
+
+
+class ChunkCache:
+    """
+    Thread-safe LRU cache of decoded chunk arrays holding at most max_bytes.
+
+    Cached arrays are made read-only since every reader shares them. Two
+    threads missing the same key at once both decode it; the second result
+    replaces the first. The cache does not see writes to the file, call
+    invalidate() after modifying a dataset.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._nbytes = 0
+        self._hits = self._misses = self._evictions = 0
+
+    def get(self, key):
+        """Returns the cached array for key, or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key, array):
+        """
+        Caches array under key, evicting the least recently used entries. A stored
+        array is made read-only; one larger than max_bytes is left as it is.
+        """
+        if array.nbytes > self.max_bytes:
+            return
+        array.flags.writeable = False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._nbytes -= old.nbytes
+            self._entries[key] = array
+            self._nbytes += array.nbytes
+            while self._nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+                self._evictions += 1
+
+    def get_or_load(self, key, load):
+        """Returns the cached array for key, calling load() and caching its result on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = load()
+            self.put(key, value)
+        return value
+
+    def invalidate(self, filename=None, dataset=None):
+        """Drops all entries, or those of one file and optionally one dataset in it."""
+        with self._lock:
+            if filename is None:
+                keys = list(self._entries)
+            else:
+                filename = os.path.realpath(filename)
+                keys = [k for k in self._entries
+                        if k[0] == filename and (dataset is None or k[1] == dataset)]
+            for key in keys:
+                self._nbytes -= self._entries.pop(key).nbytes
+
+    def stats(self):
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions,
+                              len(self._entries), self._nbytes, self.max_bytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        s = self.stats()
+        return (f"{type(self).__name__}(max_bytes={s.max_bytes}, entries={s.entries}, "
+                f"nbytes={s.nbytes}, hits={s.hits}, misses={s.misses})")
@@ -0,0 +1,505 @@
+"""
+NumPy-level access to the TurboPFor filter pipeline without going through HDF5.
+
+encode() produces exactly the bytes the HDF5 filter stores for a chunk, so the
+output can be written with write_direct_chunk, kept in memory, or stored in a
+Zarr array through the numcodecs codec below.
+"""
+import collections
+import ctypes
+import struct
+
+import numpy as np
+
+from . import _lib
+
+try:
+    from numcodecs.abc import Codec
+    from numcodecs.compat import ensure_contiguous_ndarray, ensure_ndarray
+    from numcodecs.registry import register_codec
+except ImportError:  # numcodecs is optional
+    Codec = object
+    register_codec = None
+
+FILTER_ID = 62016  # Must match TURBOPFOR_FILTER in turbopfor_h5plugin.c
+
+# numpy dtype -> cd_values[0] (DataElementType in turbopfor_h5plugin.c)
+ELEMENT_TYPES = {
+    np.dtype(np.int16): 0,
+    np.dtype(np.uint16): 1,
+    np.dtype(np.int32): 2,
+    np.dtype(np.uint32): 3,
+    np.dtype(np.float32): 4,  # quantized to int32 by the filter
+}
+
+DTYPES = {code: dtype for dtype, code in ELEMENT_TYPES.items()}
+
+# Predictor in turbopfor_h5plugin.c; an int k selects a delta along chunk axis k
+PREDICTORS = {
+    "delta2d": 0,
+    "lorenzo2d": 1,
+    "lorenzo3d": 2,
+    "auto": 255,
+}
+PREDICTOR_AXIS = 16
+
+# Codec in turbopfor_h5plugin.c: the entropy stage after the predictor
+CODECS = {
+    "p4n128v": 0,
+    "p4n256v": 1,  # AVX2; falls back to p4n128v on other CPUs and for 16-bit types
+    "vsimple": 2,
+    "bitpack": 3,
+    "trle": 4,
+    "auto": 255,
+}
+
+# Option bits packed into cd_values[0] next to the element type (OPTION_* in the plugin)
+PREDICTOR_SHIFT = 8
+CODEC_SHIFT = 16
+BLOCK_SHIFT = 28
+MAX_BLOCK_SERIES = 1 << 14
+OPTION_MASK = 1 << 24
+
+# ChunkHeader in turbopfor_h5plugin.c
+HEADER = struct.Struct("<2sBBBBHII")
+HEADER_MAGIC = b"TP"
+CHUNK_BLOCKED = 0x1
+CHUNK_MASKED = 0x2
+CHUNK_CONSTANT = 0x4
+CHUNK_SEGMENTED = 0x8
+MASK_SECTION = struct.Struct("<2I")  # length, bitmap row length
+QUANTIZED_FILL = np.iinfo(np.int32).min  # stored value of NaN in float chunks
+
+# BlockTable in turbopfor_h5plugin.c, followed by nblocks + 1 uint32 offsets
+BLOCK_TABLE = struct.Struct("<4I")
+
+# SegmentTable in turbopfor_h5plugin.c (nsegments, rows), followed by
+# nsegments uint32 row counts and nsegments uint32 stream sizes
+SEGMENT_TABLE = struct.Struct("<2I")
+
+ChunkHeader = collections.namedtuple(
+    "ChunkHeader", ["version", "dtype", "predictor", "codec", "flags", "nelem", "raw_size"])
+
+BlockIndex = collections.namedtuple(
+    "BlockIndex", ["dtype", "nblocks", "block_series", "length0", "nseries", "offsets"])
+
+SegmentInfo = collections.namedtuple("SegmentInfo", ["rows", "segment_rows", "segment_bytes"])
+
+
+def _element_type(dtype):
+    dtype = np.dtype(dtype)
+    try:
+        return ELEMENT_TYPES[dtype]
+    except KeyError:
+        raise TypeError(f"TurboPFor does not support dtype {dtype}") from None
+
+
+def _block_option(block_series):
+    if not block_series:
+        return 0
+    exponent = int(block_series).bit_length() - 1
+    if block_series != 1 << exponent or block_series > MAX_BLOCK_SERIES:
+        raise ValueError(f"block_series must be a power of two up to {MAX_BLOCK_SERIES}")
+    return (exponent + 1) << BLOCK_SHIFT
+
+
+def _predictor_option(predictor, ndim):
+    if predictor is None:
+        return 0
+    if isinstance(predictor, str):
+        try:
+            code = PREDICTORS[predictor]
+        except KeyError:
+            raise ValueError(f"unknown predictor {predictor!r}") from None
+        required = {"lorenzo2d": 2, "lorenzo3d": 3}.get(predictor, 0)
+        if ndim < required:
+            raise ValueError(f"{predictor} needs chunks with at least {required} dimensions")
+    else:
+        if not 0 <= predictor < ndim:
+            raise ValueError(f"predictor axis {predictor} out of range for {ndim} dimensions")
+        code = PREDICTOR_AXIS + int(predictor)
+    return code << PREDICTOR_SHIFT
+
+
+def _codec_option(codec):
+    if codec is None:
+        return 0
+    try:
+        return CODECS[codec] << CODEC_SHIFT
+    except KeyError:
+        raise ValueError(f"unknown codec {codec!r}") from None
+
+
+def fill_value(dtype):
+    """
+    Returns the value mask mode treats as missing: the minimum of signed and
+    the maximum of unsigned dtypes, NaN for float32.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == "f":
+        return dtype.type(np.nan)
+    info = np.iinfo(dtype)
+    return info.min if info.min < 0 else info.max
+
+
+def _float_bits(value):
+    return struct.unpack("<I", struct.pack("<f", value))[0]
+
+
+def _quantization_values(dtype, multiplier, offset):
+    if np.dtype(dtype).kind != "f":
+        if multiplier is not None:
+            raise ValueError("multiplier only applies to float32 data")
+        return (0,)
+    if multiplier is None:
+        raise ValueError("float32 data needs a quantization multiplier")
+    if not (np.isfinite(multiplier) and np.isfinite(offset)) or multiplier == 0:
+        raise ValueError("multiplier and offset must be finite and multiplier non-zero")
+    return (_float_bits(multiplier), _float_bits(offset))
+
+
+def cd_values_for(chunks, dtype, block_series=None, predictor=None, mask=False,
+                  multiplier=None, offset=0.0, codec=None):
+    """
+    Returns the filter cd_values (compression_opts) for a chunk shape and dtype.
+
+    block_series stores the chunk as independently decodable sub-blocks of that
+    many series (columns along the first chunk dimension), see read_series().
+
+    predictor selects what the values are predicted from before PFor:
+    "delta2d" (default) differences consecutive rows of the chunk flattened to 2D,
+    an int k differences along chunk axis k (0 is time for (time, lat, lon) chunks),
+    "lorenzo2d"/"lorenzo3d" use the last two/three axes, and "auto" tries all of
+    them per chunk and records the winner in the chunk header.
+    Sub-blocked chunks always difference along the first axis.
+
+    codec selects the entropy stage after the predictor, one of CODECS:
+    "p4n128v" (default) is PFor, "p4n256v" its AVX2 variant for 32-bit types
+    (p4n128v is written on CPUs without AVX2, and its chunks only decode on AVX2
+    machines), "vsimple" and "trle" suit long runs of small or equal values,
+    "bitpack" drops PFor's exceptions for the fastest decode, and "auto" tries
+    them per chunk after picking the predictor. Sub-blocked chunks always use PFor.
+
+    mask stores cells equal to fill_value(dtype) in a validity bitmap and
+    replaces them before prediction, so a land/sea or swath edge does not
+    cost PFor exceptions. Decoding restores the fill value.
+
+    float32 data is quantized by the filter to round((value - offset) * multiplier)
+    in int32 and restored on read; NaN becomes the fill value, so combine it with mask.
+    """
+    chunks = tuple(int(c) for c in chunks)
+    options = (_element_type(dtype) | _predictor_option(predictor, len(chunks))
+               | _codec_option(codec) | _block_option(block_series)
+               | (OPTION_MASK if mask else 0))
+    return (options,) + _quantization_values(dtype, multiplier, offset) + chunks
+
+
+def dataset_options(chunks, dtype, **options):
+    """
+    Returns h5py create_dataset() keywords (chunks, compression, compression_opts)
+    for a TurboPFor dataset. The cd_values come from the same chunk shape, so the
+    filter's dims cannot disagree with chunks=. options are those of cd_values_for().
+    """
+    chunks = tuple(int(c) for c in chunks)
+    return {"chunks": chunks, "compression": FILTER_ID,
+            "compression_opts": cd_values_for(chunks, dtype, **options)}
+
+
+def quantization(cd_values):
+    """Returns (multiplier, offset) of float32 cd_values, or None for integer types."""
+    if cd_values[0] & 0xff != ELEMENT_TYPES[np.dtype(np.float32)]:
+        return None
+    multiplier, offset = struct.unpack("<2f", struct.pack("<2I", *cd_values[1:3]))
+    return (multiplier or 1.0), offset
+
+
+def dequantize(values, multiplier, offset=0.0):
+    """Maps quantized int32 values back to float32, the fill value to NaN."""
+    values = np.asarray(values)
+    # The filter sees both parameters as float32
+    multiplier, offset = float(np.float32(multiplier)), float(np.float32(offset))
+    out = (values * (1.0 / multiplier) + offset).astype(np.float32)
+    out[values == QUANTIZED_FILL] = np.nan
+    return out
+
+
+def chunk_header(buf):
+    """
+    Parses the header of an encoded chunk.
+    Returns a ChunkHeader, or None for chunks written before headers were introduced.
+    """
+    if len(buf) < HEADER.size:
+        return None
+    magic, version, type_code, predictor, codec, flags, nelem, raw_size = HEADER.unpack_from(buf)
+    if magic != HEADER_MAGIC or version == 0:
+        return None
+    return ChunkHeader(version, DTYPES.get(type_code), predictor, codec, flags, nelem, raw_size)
+
+
+def constant_value(buf):
+    """
+    Returns the value of a chunk whose elements are all equal (e.g. entirely
+    outside the domain), or None if the chunk holds encoded data.
+    """
+    header = chunk_header(buf)
+    if header is None or not header.flags & CHUNK_CONSTANT:
+        return None
+    return np.frombuffer(buf, dtype=header.dtype.newbyteorder("<"), count=1, offset=HEADER.size)[0]
+
+
+def block_index(buf):
+    """
+    Parses the sub-block offset table of a chunk stored in the blocked layout.
+    Returns a BlockIndex, or None if the chunk is a single stream.
+    """
+    header = chunk_header(buf)
+    if header is None or not header.flags & CHUNK_BLOCKED:
+        return None
+    pos = HEADER.size
+    if header.flags & CHUNK_MASKED:
+        pos += MASK_SECTION.size + MASK_SECTION.unpack_from(buf, pos)[0]
+    nblocks, block_series, length0, nseries = BLOCK_TABLE.unpack_from(buf, pos)
+    offsets = np.frombuffer(buf, dtype="<u4", count=nblocks + 1, offset=pos + BLOCK_TABLE.size)
+    return BlockIndex(header.dtype, nblocks, block_series, length0, nseries, offsets)
+
+
+def segment_info(buf):
+    """
+    Parses the segment table of a chunk written by append_rows().
+    Returns a SegmentInfo, or None if the chunk is not segmented.
+    """
+    header = chunk_header(buf)
+    if header is None or not header.flags & CHUNK_SEGMENTED:
+        return None
+    nsegments, rows = SEGMENT_TABLE.unpack_from(buf, HEADER.size)
+    lengths = np.frombuffer(buf, dtype="<u4", count=2 * nsegments,
+                            offset=HEADER.size + SEGMENT_TABLE.size)
+    return SegmentInfo(rows, lengths[:nsegments], lengths[nsegments:])
+
+
+def _cd_array(cd_values):
+    return (ctypes.c_uint * len(cd_values))(*cd_values)
+
+
+def _as_bytes(buf):
+    """Returns a uint8 view of any bytes-like object, without copying."""
+    return np.frombuffer(buf, dtype=np.uint8)
+
+
+def encode(array, block_series=None, predictor=None, mask=False, multiplier=None, offset=0.0,
+           codec=None):
+    """
+    Compresses an ndarray as a single chunk whose shape is the array shape.
+    Options are those of cd_values_for(). Returns the compressed bytes.
+    """
+    array = np.ascontiguousarray(array)
+    if array.ndim == 0:
+        array = array.reshape(1)
+    cd_values = _cd_array(cd_values_for(array.shape, array.dtype, block_series, predictor, mask,
+                                        multiplier, offset, codec))
+
+    lib = _lib.load()
+    out = np.empty(lib.turbopfor_encode_bound(array.nbytes), dtype=np.uint8)
+    n = lib.turbopfor_encode(len(cd_values), cd_values, array.ctypes.data, array.nbytes,
+                             out.ctypes.data, out.nbytes)
+    if n == 0:
+        raise ValueError("TurboPFor encoding failed")
+    return out[:n].tobytes()
+
+
+def decode_into(buf, out, multiplier=None, offset=0.0):
+    """
+    Decompresses a chunk produced by encode() (or stored by the HDF5 filter)
+    into out, a C-contiguous ndarray with the chunk's shape and dtype.
+    float32 chunks need the multiplier and offset they were encoded with.
+    Returns out.
+    """
+    if not (out.flags.c_contiguous and out.flags.writeable):
+        raise ValueError("out must be a writeable C-contiguous ndarray")
+    shape = out.shape if out.ndim > 0 else (1,)
+    cd_values = _cd_array(cd_values_for(shape, out.dtype, multiplier=multiplier, offset=offset))
+    src = _as_bytes(buf)
+
+    n = _lib.load().turbopfor_decode(len(cd_values), cd_values, src.ctypes.data, src.nbytes,
+                                     out.ctypes.data, out.nbytes)
+    if n != out.nbytes:
+        raise ValueError("TurboPFor decoding failed")
+    return out
+
+
+def decode(buf, shape, dtype=np.int16, multiplier=None, offset=0.0):
+    """
+    Decompresses a chunk into a new ndarray of the given shape and dtype.
+    float32 chunks need the multiplier and offset they were encoded with.
+    """
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+    # Decoding into a padded allocation avoids the temporary copy in turbopfor_decode
+    storage = np.empty(_lib.load().turbopfor_decode_bound(nbytes), dtype=np.uint8)
+    out = storage[:nbytes].view(dtype).reshape(shape)
+    cd_values = _cd_array(cd_values_for(shape if len(shape) > 0 else (1,), dtype,
+                                        multiplier=multiplier, offset=offset))
+    src = _as_bytes(buf)
+
+    n = _lib.load().turbopfor_decode(len(cd_values), cd_values, src.ctypes.data, src.nbytes,
+                                     storage.ctypes.data, storage.nbytes)
+    if n != nbytes:
+        raise ValueError("TurboPFor decoding failed")
+    return out
+
+
+def decode_block(buf, block, index=None, multiplier=None, offset=0.0):
+    """
+    Decodes sub-block `block` of a blocked chunk without touching the others.
+    Returns a (series length, block width) ndarray whose columns are series.
+    float32 chunks need the multiplier and offset they were encoded with.
+    """
+    if index is None:
+        index = block_index(buf)
+    if index is None:
+        raise ValueError("chunk is not stored in the blocked layout")
+    quantized = index.dtype.kind == "f"
+    if quantized and multiplier is None:
+        raise ValueError("float32 data needs a quantization multiplier")
+    dtype = np.dtype(np.int32) if quantized else index.dtype
+    width = min(index.block_series, index.nseries - block * index.block_series)
+    nbytes = index.length0 * width * dtype.itemsize
+    lib = _lib.load()
+    storage = np.empty(lib.turbopfor_decode_bound(nbytes), dtype=np.uint8)
+    src = _as_bytes(buf)
+
+    n = lib.turbopfor_decode_block(src.ctypes.data, src.nbytes, block, storage.ctypes.data, storage.nbytes)
+    if n != nbytes:
+        raise ValueError("TurboPFor block decoding failed")
+    values = storage[:nbytes].view(dtype).reshape(index.length0, width)
+    return dequantize(values, multiplier, offset) if quantized else values
+
+
+def decode_series(buf, series, index=None, multiplier=None, offset=0.0):
+    """Decodes one series (column along the first chunk dimension) of a blocked chunk."""
+    if index is None:
+        index = block_index(buf)
+    if index is None:
+        raise ValueError("chunk is not stored in the blocked layout")
+    block, column = divmod(series, index.block_series)
+    return decode_block(buf, block, index, multiplier, offset)[:, column]
+
+
+def append_rows(buf, rows, start_row, cd_values, fillvalue=None):
+    """
+    Appends rows along the first axis of a stored chunk without re-encoding
+    the rows it already holds. buf is the stored chunk, or None if it was never
+    written; start_row is the number of its rows in use, where rows[0] goes.
+    rows has the chunk shape except for its first axis and the dtype of cd_values;
+    float32 rows are quantized with the cd_values multiplier and offset. The
+    first start_row rows of a chunk that was never written hold fillvalue, by
+    default the filter's fill value; pass the dataset's to keep them unchanged.
+
+    Returns the chunk in the segmented layout. Segmented chunks must hold exactly
+    start_row rows; other chunks are converted, keeping their first start_row rows.
+    """
+    cd = _cd_array(cd_values)
+    dtype = DTYPES[cd_values[0] & 0xff]
+    rows = np.ascontiguousarray(rows, dtype=dtype)
+    src = _as_bytes(b"" if buf is None else buf)
+    chunks = cd_values[3 if dtype.kind == "f" else 2:]
+    raw_size = int(np.prod(chunks, dtype=np.int64)) * dtype.itemsize
+    if rows.ndim == 0 or rows.size != len(rows) * int(np.prod(chunks[1:], dtype=np.int64)):
+        raise ValueError(f"rows of shape {rows.shape} do not fit chunks {tuple(chunks)}")
+    if buf is None and start_row and fillvalue is not None:
+        # The rows before start_row become part of the first segment anyway
+        rows = rows.reshape(len(rows), -1)
+        prefix = np.full((start_row, rows.shape[1]), fillvalue, dtype=dtype)
+        rows, start_row = np.concatenate([prefix, rows]), 0
+
+    lib = _lib.load()
+    out = np.empty(lib.turbopfor_append_bound(src.nbytes, raw_size), dtype=np.uint8)
+    n = lib.turbopfor_append(len(cd), cd, src.ctypes.data if src.nbytes else None, src.nbytes,
+                             start_row, rows.ctypes.data, len(rows), out.ctypes.data, out.nbytes)
+    if n == 0:
+        raise ValueError("TurboPFor append failed")
+    return out[:n].tobytes()
+
+
+def recode(buf, cd_values):
+    """
+    Decodes a stored chunk and encodes it again with cd_values, e.g. to fold the
+    segments of an appended chunk back into the regular layout. Returns the bytes.
+    """
+    header = chunk_header(buf)
+    if header is None:
+        raise ValueError("chunk has no header")
+    cd = _cd_array(cd_values)
+    src = _as_bytes(buf)
+
+    lib = _lib.load()
+    raw = np.empty(lib.turbopfor_decode_bound(header.raw_size), dtype=np.uint8)
+    if lib.turbopfor_decode(len(cd), cd, src.ctypes.data, src.nbytes,
+                            raw.ctypes.data, raw.nbytes) != header.raw_size:
+        raise ValueError("TurboPFor decoding failed")
+    out = np.empty(lib.turbopfor_encode_bound(header.raw_size), dtype=np.uint8)
+    n = lib.turbopfor_encode(len(cd), cd, raw.ctypes.data, header.raw_size,
+                             out.ctypes.data, out.nbytes)
+    if n == 0:
+        raise ValueError("TurboPFor encoding failed")
+    return out[:n].tobytes()
+
+
+class TurboPFor(Codec):
+    """
+    numcodecs codec producing the HDF5 filter's byte format, e.g. for Zarr stores.
+
+    Parameters
+    ----------
+    dtype : dtype of the chunks (int16, uint16, int32, uint32 or float32)
+    chunks : chunk shape; the filter's delta step depends on it
+    block_series : optional sub-block size, see cd_values_for()
+    predictor : optional predictor, see cd_values_for()
+    mask : store fill values in a validity bitmap, see cd_values_for()
+    multiplier, offset : quantization of float32 chunks, see cd_values_for()
+    codec : optional entropy stage, see cd_values_for()
+    """
+
+    codec_id = "turbopfor"
+
+    def __init__(self, dtype="<i2", chunks=None, block_series=None, predictor=None, mask=False,
+                 multiplier=None, offset=0.0, codec=None):
+        self.dtype = np.dtype(dtype)
+        if chunks is None:
+            raise ValueError("TurboPFor codec needs the chunk shape")
+        self.chunks = tuple(int(c) for c in chunks)
+        cd_values_for(self.chunks, self.dtype, block_series, predictor, mask, multiplier, offset,
+                      codec)
+        self.block_series = block_series
+        self.predictor = predictor
+        self.mask = bool(mask)
+        self.multiplier = multiplier
+        self.offset = offset
+        self.codec = codec
+
+    def encode(self, buf):
+        array = ensure_contiguous_ndarray(buf).view(self.dtype)
+        return encode(array.reshape(self.chunks), self.block_series, self.predictor,
+                      self.mask, self.multiplier, self.offset, self.codec)
+
+    def decode(self, buf, out=None):
+        if out is None:
+            return decode(ensure_contiguous_ndarray(buf), self.chunks, self.dtype,
+                          self.multiplier, self.offset)
+        target = ensure_ndarray(out).view(self.dtype).reshape(self.chunks)
+        decode_into(ensure_contiguous_ndarray(buf), target, self.multiplier, self.offset)
+        return out
+
+    def get_config(self):
+        return {"id": self.codec_id, "dtype": self.dtype.str, "chunks": list(self.chunks),
+                "block_series": self.block_series, "predictor": self.predictor, "mask": self.mask,
+                "multiplier": self.multiplier, "offset": self.offset, "codec": self.codec}
+
+    def __repr__(self):
+        return (f"{type(self).__name__}(dtype={self.dtype.str!r}, chunks={self.chunks!r}, "
+                f"block_series={self.block_series!r}, predictor={self.predictor!r}, mask={self.mask!r}, "
+                f"multiplier={self.multiplier!r}, offset={self.offset!r}, codec={self.codec!r})")
+
+
+if register_codec is not None:
+    register_codec(TurboPFor)
@@ -0,0 +1,383 @@
+"""
+Streaming conversion of a NetCDF4/HDF5 variable into a TurboPFor dataset.
+
+The source is read one chunk-aligned slab at a time (one row of destination
+chunks spanning the last axis). Worker processes read, quantize and encode the
+slabs; the parent only writes the finished chunks with write_direct_chunk, so
+memory stays at a few slabs and encoding scales with the number of cores.
+Under MPI, convert_mpi() spreads the slabs over the ranks instead.
+
+    python -m turbopfor.convert in.nc4 out.h5 tasmin --chunks 366,20,20 --multiplier 20
+    mpirun -n 32 python -m turbopfor.convert --mpi in.nc4 out.h5 tasmin --chunks 366,20,20
+"""
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import math
+import multiprocessing
+import os
+import time
+
+import h5py
+import numpy as np
+
+from .codec import CODECS, dataset_options, encode, fill_value
+from .pyramid import STATISTICS, build_pyramid, month_edges
+
+# netCDF dimension bookkeeping, which does not carry over to the new file
+SKIPPED_ATTRS = {
+    "DIMENSION_LIST", "REFERENCE_LIST", "CLASS", "NAME",
+    "_Netcdf4Dimid", "_Netcdf4Coordinates",
+}
+
+# Attributes describing the packing of the source values; dropped only when
+# the values are unpacked and masked, kept when they are stored as is
+PACKING_ATTRS = {"_FillValue", "missing_value", "scale_factor", "add_offset"}
+
+# MPI message tag of encoded slabs sent to the writing rank
+SLAB_TAG = 62016
+
+
+class ConversionStats(collections.namedtuple(
+        "ConversionStats", ["chunks", "raw_bytes", "stored_bytes", "seconds"])):
+    """Totals of a convert() run; raw_bytes counts the destination dtype."""
+
+    @property
+    def mb_per_s(self):
+        return self.raw_bytes / (1024 * 1024) / self.seconds if self.seconds > 0 else float("inf")
+
+    @property
+    def ratio(self):
+        return self.raw_bytes / self.stored_bytes if self.stored_bytes else float("inf")
+
+
+def _attr_scalar(attrs, name):
+    value = attrs.get(name)
+    if isinstance(value, np.ndarray):
+        value = value.reshape(-1)[0]
+    return value
+
+
+# Per-process state of the workers, set by _open_source
+_source = None
+
+
+def _open_source(path, variable, options):
+    global _source
+    f = h5py.File(path, "r")
+    _source = (f, f[variable], options)
+
+
+def _close_source():
+    global _source
+    if _source is not None:
+        _source[0].close()
+    _source = None
+
+
+def _prepare(values, attrs, options):
+    """
+    Unpacks source values to float32 with missing cells as NaN, or passes
+    integer values through unchanged.
+    """
+    dtype = options["dtype"]
+    if dtype.kind != "f":
+        return values.astype(dtype, copy=False)
+    missing = np.zeros(values.shape, dtype=bool)
+    for name in ("_FillValue", "missing_value"):
+        value = _attr_scalar(attrs, name)
+        if value is not None:
+            missing |= values == value
+    values = values.astype(np.float32)
+    scale, add = _attr_scalar(attrs, "scale_factor"), _attr_scalar(attrs, "add_offset")
+    if scale is not None:
+        values *= np.float32(scale)
+    if add is not None:
+        values += np.float32(add)
+    values[missing] = fill_value(dtype)
+    return values
+
+
+def _encode_slab(start):
+    """Reads, converts and encodes the slab at chunk-grid position start."""
+    _, dset, options = _source
+    chunks = options["chunks"]
+    shape = dset.shape
+    corner = tuple(i * c for i, c in zip(start, chunks[:-1]))
+    stop = tuple(min(o + c, n) for o, c, n in zip(corner, chunks[:-1], shape[:-1]))
+    values = _prepare(dset[tuple(slice(a, b) for a, b in zip(corner, stop))],
+                      dset.attrs, options)
+
+    # Pad to whole chunks; HDF5 ignores the part beyond the dataset extent
+    padded = tuple(c for c in chunks[:-1]) + (-(-shape[-1] // chunks[-1]) * chunks[-1],)
+    if values.shape != padded:
+        full = np.full(padded, fill_value(options["dtype"]), dtype=options["dtype"])
+        full[tuple(slice(0, n) for n in values.shape)] = values
+        values = full
+
+    encoded = []
+    for x0 in range(0, shape[-1], chunks[-1]):
+        chunk = np.ascontiguousarray(values[..., x0:x0 + chunks[-1]])
+        encoded.append((corner + (x0,), encode(chunk, **options["encode"])))
+    return encoded
+
+
+def _plan(src, variable, chunks, multiplier, offset, block_series, predictor, mask, codec):
+    """Reads the source metadata; returns shape, dtype, attrs, worker options and slab positions."""
+    chunks = tuple(int(c) for c in chunks)
+    with h5py.File(src, "r") as f:
+        source = f[variable]
+        shape, src_dtype = source.shape, source.dtype
+        skipped = SKIPPED_ATTRS | (PACKING_ATTRS if multiplier is not None else set())
+        attrs = {k: v for k, v in source.attrs.items() if k not in skipped}
+    if len(chunks) != len(shape):
+        raise ValueError(f"chunks {chunks} do not match the variable's shape {shape}")
+    dtype = np.dtype(np.float32) if multiplier is not None else src_dtype
+    encode_options = dict(block_series=block_series, predictor=predictor, mask=mask,
+                          multiplier=multiplier, offset=offset, codec=codec)
+    options = {"chunks": chunks, "dtype": dtype, "encode": encode_options}
+    grid = [range(-(-n // c)) for n, c in zip(shape[:-1], chunks[:-1])]
+    return shape, dtype, attrs, options, itertools.product(*grid)
+
+
+def _create_dataset(out, name, shape, attrs, options):
+    dtype = options["dtype"]
+    dset = out.create_dataset(name, shape=shape, dtype=dtype, fillvalue=fill_value(dtype),
+                              **dataset_options(options["chunks"], dtype, **options["encode"]))
+    for key, value in attrs.items():
+        dset.attrs[key] = value
+    return dset
+
+
+def _raw_bytes(encoded, shape, chunks, itemsize):
+    """Bytes of the source the chunks of an encoded slab cover, edge chunks clipped."""
+    return sum(math.prod(min(c, n - p) for p, c, n in zip(position, chunks, shape))
+               for position, _ in encoded) * itemsize
+
+
+def _write_slab(dset, encoded):
+    """Writes the chunks of an encoded slab; returns their stored bytes."""
+    stored = 0
+    for position, blob in encoded:
+        dset.id.write_direct_chunk(position, blob)
+        stored += len(blob)
+    return stored
+
+
+def convert(src, dst, variable, chunks, multiplier=None, offset=0.0, block_series=None,
+            predictor=None, mask=True, workers=None, dst_variable=None, codec=None,
+            pyramid=None):
+    """
+    Converts `variable` of the NetCDF4/HDF5 file src into a TurboPFor dataset in dst.
+
+    With a multiplier the destination is float32 quantized by the filter (see
+    cd_values_for()), and source values are unpacked with their scale_factor and
+    add_offset first, and cells equal to _FillValue or missing_value become NaN.
+    Without one the source must be int16, uint16, int32 or uint32 and is stored as
+    is, together with its packing attributes. workers is the number of encoding processes, defaulting
+    to the CPU count; 0 encodes in this process. pyramid, a dict of build_pyramid()
+    options ({} for the defaults), also stores aggregate levels of the result.
+    Returns ConversionStats.
+    """
+    shape, dtype, attrs, options, slabs = _plan(src, variable, chunks, multiplier, offset,
+                                                block_series, predictor, mask, codec)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    start_time = time.perf_counter()
+    nchunks = raw_bytes = stored_bytes = 0
+    with h5py.File(dst, "a") as out:
+        dset = _create_dataset(out, dst_variable or variable, shape, attrs, options)
+
+        def write(encoded):
+            nonlocal nchunks, raw_bytes, stored_bytes
+            stored_bytes += _write_slab(dset, encoded)
+            nchunks += len(encoded)
+            raw_bytes += _raw_bytes(encoded, shape, options["chunks"], dtype.itemsize)
+
+        if workers == 0:
+            _open_source(src, variable, options)
+            try:
+                for start in slabs:
+                    write(_encode_slab(start))
+            finally:
+                _close_source()
+        else:
+            # spawn: forked workers would inherit the open HDF5 files of this process
+            context = multiprocessing.get_context("spawn")
+            with concurrent.futures.ProcessPoolExecutor(
+                    workers, mp_context=context, initializer=_open_source,
+                    initargs=(src, variable, options)) as pool:
+                # Keep only a couple of slabs per worker in flight to bound memory
+                pending = collections.deque()
+                for start in slabs:
+                    pending.append(pool.submit(_encode_slab, start))
+                    if len(pending) >= 2 * workers:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+        if pyramid is not None:
+            build_pyramid(dset, **pyramid)
+
+    return ConversionStats(nchunks, raw_bytes, stored_bytes, time.perf_counter() - start_time)
+
+
+def convert_mpi(src, dst, variable, chunks, multiplier=None, offset=0.0, block_series=None,
+                predictor=None, mask=True, dst_variable=None, codec=None, pyramid=None,
+                comm=None):
+    """
+    convert() with the slabs spread over the ranks of an MPI communicator
+    (mpi4py's COMM_WORLD by default); run it on every rank, e.g. under mpirun.
+
+    Rank r reads and encodes slabs r, r + size, ... of the source. The other
+    ranks send their encoded chunks to rank 0, the only one opening dst, which
+    writes them with write_direct_chunk between encoding its own slabs. This
+    needs neither parallel HDF5 nor a parallel file system for dst. Each rank
+    holds about one slab. Rank 0 builds the pyramid levels, if any, at the end.
+    Returns the ConversionStats of the whole run on every rank.
+
+    A rank that fails reports it to rank 0 and stops, and rank 0 keeps taking
+    the other ranks' slabs after an error of its own, so no rank waits forever.
+    The rank that failed raises its exception, the others a RuntimeError.
+    """
+    if comm is None:
+        from mpi4py import MPI  # optional, only needed for MPI runs
+        comm = MPI.COMM_WORLD
+    rank, size = comm.Get_rank(), comm.Get_size()
+    shape, dtype, attrs, options, slabs = _plan(src, variable, chunks, multiplier, offset,
+                                                block_series, predictor, mask, codec)
+    slabs = list(slabs)
+    mine = slabs[rank::size]
+
+    comm.Barrier()
+    start_time = time.perf_counter()
+    stats = error = None
+    # Messages to rank 0 are (rank, encoded slab, None) or (rank, None, error text)
+    remaining = {r: len(slabs[r::size]) for r in range(1, size)}
+
+    def receive():
+        source, encoded, failure = comm.recv(tag=SLAB_TAG)
+        if failure is not None:
+            remaining[source] = 0  # a failed rank sends nothing more
+            raise RuntimeError(f"rank {source} failed: {failure}")
+        remaining[source] -= 1
+        return encoded
+
+    try:
+        if rank != 0:
+            try:
+                _open_source(src, variable, options)
+                for start in mine:
+                    comm.send((rank, _encode_slab(start), None), dest=0, tag=SLAB_TAG)
+            except Exception as exc:
+                comm.send((rank, None, repr(exc)), dest=0, tag=SLAB_TAG)
+                raise
+        else:
+            _open_source(src, variable, options)
+            nchunks = raw_bytes = stored_bytes = 0
+            with h5py.File(dst, "a") as out:
+                dset = _create_dataset(out, dst_variable or variable, shape, attrs, options)
+
+                def write(encoded):
+                    nonlocal nchunks, raw_bytes, stored_bytes
+                    stored_bytes += _write_slab(dset, encoded)
+                    nchunks += len(encoded)
+                    raw_bytes += _raw_bytes(encoded, shape, options["chunks"], dtype.itemsize)
+
+                for start in mine:
+                    write(_encode_slab(start))
+                    # Drain what arrived meanwhile so senders do not wait on this rank
+                    while sum(remaining.values()) and comm.iprobe(tag=SLAB_TAG):
+                        write(receive())
+                while sum(remaining.values()):
+                    write(receive())
+                if pyramid is not None:
+                    build_pyramid(dset, **pyramid)
+            stats = ConversionStats(nchunks, raw_bytes, stored_bytes,
+                                    time.perf_counter() - start_time)
+    except Exception as exc:
+        error = exc
+        if rank == 0:
+            # Let the other ranks finish sending before everyone gives up
+            while sum(remaining.values()):
+                try:
+                    receive()
+                except RuntimeError:
+                    pass
+    finally:
+        _close_source()
+    failed = comm.allreduce(int(error is not None))
+    if error is not None:
+        raise error
+    if failed:
+        raise RuntimeError("conversion failed on another rank")
+    return comm.bcast(stats, root=0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("src")
+    parser.add_argument("dst")
+    parser.add_argument("variable")
+    parser.add_argument("--chunks", required=True,
+                        help="comma separated chunk shape, e.g. 366,20,20")
+    parser.add_argument("--multiplier", type=float,
+                        help="store float32 quantized to 1/multiplier steps")
+    parser.add_argument("--offset", type=float, default=0.0)
+    parser.add_argument("--block-series", type=int)
+    parser.add_argument("--predictor")
+    parser.add_argument("--codec", choices=sorted(CODECS))
+    parser.add_argument("--no-mask", action="store_true")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--pyramid", action="store_true",
+                        help="also store aggregate levels (see turbopfor.pyramid)")
+    parser.add_argument("--pyramid-time", default="7,30",
+                        help="time windows of the aggregate levels, in steps")
+    parser.add_argument("--pyramid-months", metavar="TIME_VARIABLE", nargs="?", const="time",
+                        help="also a calendar month level, with the month edges taken from "
+                             "the CF time coordinate of src (default 'time')")
+    parser.add_argument("--pyramid-space", default="2,4",
+                        help="spatial downsampling factors of the aggregate levels")
+    parser.add_argument("--pyramid-stats", default="mean",
+                        help=f"statistics of the aggregate levels, from {','.join(STATISTICS)}")
+    parser.add_argument("--mpi", action="store_true",
+                        help="spread the slabs over the ranks of mpirun (needs mpi4py)")
+    args = parser.parse_args(argv)
+
+    predictor = args.predictor
+    if predictor is not None and predictor.isdigit():
+        predictor = int(predictor)
+    options = dict(multiplier=args.multiplier, offset=args.offset,
+                   block_series=args.block_series, predictor=predictor,
+                   mask=not args.no_mask, codec=args.codec)
+    if args.pyramid:
+        time_windows = [int(w) for w in args.pyramid_time.split(",") if w]
+        if args.pyramid_months:
+            with h5py.File(args.src, "r") as f:
+                coordinate = f[args.pyramid_months]
+                edges = month_edges(coordinate[...], coordinate.attrs["units"],
+                                    coordinate.attrs.get("calendar", "standard"))
+            time_windows.append(("month", edges))
+        options["pyramid"] = {
+            "time_windows": time_windows,
+            "space_factors": [int(f) for f in args.pyramid_space.split(",") if f],
+            "statistics": args.pyramid_stats.split(","),
+        }
+    chunks = [int(c) for c in args.chunks.split(",")]
+    if args.mpi:
+        from mpi4py import MPI
+        stats = convert_mpi(args.src, args.dst, args.variable, chunks, comm=MPI.COMM_WORLD,
+                            **options)
+        if MPI.COMM_WORLD.Get_rank() != 0:
+            return
+    else:
+        stats = convert(args.src, args.dst, args.variable, chunks, workers=args.workers,
+                        **options)
+    print(f"{stats.chunks} chunks, {stats.raw_bytes / 2**20:.1f} MB -> "
+          f"{stats.stored_bytes / 2**20:.1f} MB (ratio {stats.ratio:.2f}) in "
+          f"{stats.seconds:.2f}s: {stats.mb_per_s:.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Memory-mapped reads of read-only TurboPFor files, without HDF5 on the read path.
+
+HDF5 reads a chunk by looking it up in the chunk B-tree, reading it into a
+temporary buffer, running the filter into another buffer and copying the
+result into the array. A MappedDataset looks the chunk addresses up once
+(get_chunk_info) and keeps them in a sidecar file next to the HDF5 file.
+Reads then decode the chunk bytes from the memory-mapped file, with no read
+into a temporary buffer, into a per-thread chunk buffer and copy the selected
+part into the output array, on a thread pool and without taking HDF5's global
+lock.
+
+The file must not change while it is mapped. The sidecar records the file's
+size and modification time and is rebuilt when either differs.
+"""
+import mmap
+import os
+import threading
+
+import h5py
+import numpy as np
+
+from . import _lib
+from .codec import constant_value, decode_into, quantization
+from .reader import _run_all, _selection, filter_cd_values
+
+INDEX_VERSION = 1
+
+
+def sidecar_path(path, name):
+    """Default sidecar of dataset name in the file at path: <path>.<name>.tpidx.npz."""
+    return f"{os.fspath(path)}.{name.strip('/').replace('/', '.')}.tpidx.npz"
+
+
+def _file_signature(path):
+    st = os.stat(path)
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def build_index(dset):
+    """
+    Returns the chunk index of a TurboPFor dataset as a dict of arrays: origins
+    (n, ndim), file offsets and sizes of the n stored chunks, and the dataset's
+    shape, chunks, dtype, cd_values and fill value.
+    """
+    origins, offsets, sizes = [], [], []
+
+    def visit(info):
+        if info.filter_mask:
+            raise ValueError(f"chunk {info.chunk_offset} was stored without the TurboPFor filter")
+        origins.append(info.chunk_offset)
+        offsets.append(info.byte_offset)
+        sizes.append(info.size)
+
+    if hasattr(dset.id, "chunk_iter"):
+        dset.id.chunk_iter(visit)
+    else:
+        for i in range(dset.id.get_num_chunks()):
+            visit(dset.id.get_chunk_info(i))
+    return {
+        "version": np.array(INDEX_VERSION),
+        "origins": np.array(origins, dtype=np.int64).reshape(-1, dset.ndim),
+        "offsets": np.array(offsets, dtype=np.int64),  # absolute, user block included
+        "sizes": np.array(sizes, dtype=np.int64),
+        "shape": np.array(dset.shape, dtype=np.int64),
+        "chunks": np.array(dset.chunks, dtype=np.int64),
+        "dtype": np.array(dset.dtype.str),
+        "cd_values": np.array(filter_cd_values(dset), dtype=np.int64),
+        "fillvalue": np.array(dset.fillvalue, dtype=dset.dtype),
+    }
+
+
+def load_index(path, name, sidecar=None, rebuild=False):
+    """
+    Returns the chunk index of dataset name in the file at path, from the sidecar
+    if it is current, otherwise built with build_index() and saved to the sidecar.
+    When the sidecar cannot be written, e.g. in a read-only directory, the index
+    is only kept in memory.
+    """
+    sidecar = sidecar_path(path, name) if sidecar is None else os.fspath(sidecar)
+    signature = _file_signature(path)
+    if not rebuild and os.path.exists(sidecar):
+        with np.load(sidecar) as stored:
+            index = dict(stored)
+        if (index.get("version") == INDEX_VERSION
+                and np.array_equal(index.get("signature"), signature)):
+            return index
+    with h5py.File(path, "r") as f:
+        index = build_index(f[name])
+    index["signature"] = signature
+    # Write next to the sidecar and rename, so concurrent readers never see half a file
+    partial = f"{sidecar}.{os.getpid()}.tmp"
+    try:
+        with open(partial, "wb") as out:
+            np.savez(out, **index)
+        os.replace(partial, sidecar)
+    except OSError:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+    return index
+
+
+class MappedDataset:
+    """
+    Read-only view of a TurboPFor dataset decoded from a memory-mapped file.
+
+    Supports ints and step-1 slices like read_parallel(): dset[key] or
+    dset.read(key, out=...), which decodes into a caller's array. Unwritten
+    chunks read as the fill value. workers defaults to the CPU count.
+    """
+
+    def __init__(self, path, name, sidecar=None, rebuild=False, workers=None):
+        self.path = os.fspath(path)
+        self.name = name
+        index = load_index(self.path, name, sidecar, rebuild)
+        self.shape = tuple(int(n) for n in index["shape"])
+        self.chunks = tuple(int(c) for c in index["chunks"])
+        self.dtype = np.dtype(str(index["dtype"]))
+        self.cd_values = tuple(int(v) for v in index["cd_values"])
+        self.fillvalue = index["fillvalue"][()]
+        self.quantized = quantization(self.cd_values) or (None, 0.0)
+        self.workers = workers or os.cpu_count() or 1
+
+        # Dense chunk grid -> position in offsets/sizes, -1 for unwritten chunks
+        grid = tuple(-(-n // c) for n, c in zip(self.shape, self.chunks))
+        self._slots = np.full(grid, -1, dtype=np.int64)
+        if len(index["origins"]):
+            self._slots[tuple((index["origins"] // self.chunks).T)] = np.arange(len(index["origins"]))
+        self._offsets = index["offsets"]
+        self._sizes = index["sizes"]
+
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._bytes = np.frombuffer(self._map, dtype=np.uint8)
+        self._scratch = threading.local()
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def chunk_bytes(self, origin):
+        """The stored bytes of the chunk at origin as a view of the mapping, or None."""
+        slot = self._slots[tuple(o // c for o, c in zip(origin, self.chunks))]
+        if slot < 0:
+            return None
+        start = self._offsets[slot]
+        return self._bytes[start:start + self._sizes[slot]]
+
+    def _chunk_buffer(self):
+        """Per-thread chunk-shaped array with the padding the decoder writes past the end."""
+        buf = getattr(self._scratch, "chunk", None)
+        if buf is None:
+            nbytes = int(np.prod(self.chunks)) * self.dtype.itemsize
+            storage = np.empty(_lib.load().turbopfor_decode_bound(nbytes), dtype=np.uint8)
+            buf = self._scratch.chunk = storage[:nbytes].view(self.dtype).reshape(self.chunks)
+        return buf
+
+    def _read_chunk(self, origin, inner, target):
+        blob = self.chunk_bytes(origin)
+        if blob is None:
+            target[...] = self.fillvalue
+            return
+        value = constant_value(blob)
+        if value is not None:
+            target[...] = value
+            return
+        # The decoder needs room past the end of the chunk, which a slice of the
+        # output does not have, so decode into the padded buffer and copy
+        chunk = decode_into(blob, self._chunk_buffer(), *self.quantized)
+        target[...] = chunk[inner]
+
+    def read(self, key=Ellipsis, out=None, workers=None):
+        """
+        Reads self[key] into out (a new array by default). out must have the
+        shape of the selection, with int-indexed axes dropped, and the dtype of
+        the dataset.
+        """
+        ranges, out_shape = _selection(key, self.shape)
+        if out is None:
+            out = np.empty(out_shape, dtype=self.dtype)
+        elif out.shape != out_shape or out.dtype != self.dtype:
+            raise ValueError(f"out must be a {self.dtype} array of shape {out_shape}")
+        if out.size == 0:
+            return out
+        # Work on a view that keeps the int-indexed axes
+        full = out.reshape(tuple(b - a for a, b in ranges))
+
+        def read_chunk(index):
+            origin = tuple(i * c for i, c in zip(index, self.chunks))
+            inner = tuple(slice(max(a, o) - o, min(b, o + c) - o)
+                          for (a, b), o, c in zip(ranges, origin, self.chunks))
+            target = tuple(slice(s.start + o - a, s.stop + o - a)
+                           for s, o, (a, _) in zip(inner, origin, ranges))
+            self._read_chunk(origin, inner, full[target])
+
+        grid = [range(a // c, -(-b // c)) for (a, b), c in zip(ranges, self.chunks)]
+        indices = np.stack(np.meshgrid(*grid, indexing="ij"), axis=-1).reshape(-1, self.ndim)
+        _run_all(read_chunk, indices, workers or self.workers)
+        return out
+
+    def __getitem__(self, key):
+        return self.read(key)
+
+    def read_series(self, *coords):
+        """Reads the series self[:, *coords]."""
+        return self.read((slice(None),) + tuple(coords))
+
+    def close(self):
+        """Unmaps the file; views returned by chunk_bytes() must be released first."""
+        self._bytes = None
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return (f"{type(self).__name__}({self.path!r}, {self.name!r}, shape={self.shape}, "
+                f"chunks={self.chunks}, dtype={self.dtype.str!r})")
@@ -0,0 +1,289 @@
+"""
+Aggregate levels of a (time, y, x) TurboPFor dataset, stored next to it.
+
+A level holds one statistic (mean, min or max) over time windows and square
+spatial blocks of the primary dataset, e.g. weekly means at half resolution.
+Levels are float32 datasets quantized and compressed with the same filter,
+in the group "<name>_pyramid" beside the dataset. read_aggregate() answers a
+coarse query from the smallest level it can be derived from, so a monthly
+overview map reads a few kilobytes instead of every chunk of the region.
+
+Time windows are a fixed number of steps, or named windows given by their
+edges (e.g. calendar months computed from the time coordinate).
+"""
+import collections
+import itertools
+import math
+
+import numpy as np
+
+from .codec import dataset_options, fill_value, quantization
+from .reader import _selection, filter_cd_values, read_parallel
+
+STATISTICS = ("mean", "min", "max")
+
+# Seconds per step of CF time units ("days since 2000-01-01")
+TIME_UNITS = {"days": 86400, "day": 86400, "d": 86400, "hours": 3600, "hour": 3600, "h": 3600,
+              "minutes": 60, "minute": 60, "min": 60, "seconds": 1, "second": 1, "s": 1}
+
+PyramidLevel = collections.namedtuple(
+    "PyramidLevel", ["name", "statistic", "time_window", "space_factor", "edges"])
+
+
+def pyramid_group(dset):
+    """Name of the group holding the levels of dset."""
+    return f"{dset.name}_pyramid"
+
+
+def _window_edges(window, length):
+    """(label, edges) of a time window: an int number of steps or (name, edges)."""
+    if isinstance(window, (int, np.integer)):
+        if window < 1:
+            raise ValueError("time windows must be at least one step")
+        return str(int(window)), np.append(np.arange(0, length, window), length)
+    name, edges = window
+    edges = np.asarray(edges, dtype=np.int64)
+    if (edges.ndim != 1 or len(edges) < 2 or np.any(np.diff(edges) <= 0)
+            or edges[0] < 0 or edges[-1] > length):
+        raise ValueError(f"edges of window {name!r} must increase within [0, {length}]")
+    if str(name).isdigit():
+        raise ValueError(f"named windows cannot be numbers: {name!r}")
+    return str(name), edges
+
+
+def month_edges(times, units, calendar="standard"):
+    """
+    Edges of the calendar months covered by a CF time coordinate, e.g. values
+    in "days since 2000-01-01", for a ("month", edges) time window. Only the
+    Gregorian calendars are supported; the first and last months may be partial.
+    """
+    if isinstance(units, bytes):
+        units = units.decode()
+    if isinstance(calendar, bytes):
+        calendar = calendar.decode()
+    if calendar.lower() not in ("standard", "gregorian", "proleptic_gregorian"):
+        raise ValueError(f"unsupported calendar {calendar!r}, use the standard one")
+    step, since, origin = units.strip().partition(" since ")
+    if not since or step.lower() not in TIME_UNITS:
+        raise ValueError(f"unsupported time units {units!r}")
+    date, _, clock = origin.strip().rstrip("Z").partition(" ")
+    try:
+        year, month, day = (int(v) for v in date.split("-"))
+        hms = [float(v) for v in clock.replace("T", "").split(":") if v]
+    except ValueError:
+        raise ValueError(f"unsupported time units {units!r}") from None
+    seconds = sum(v * s for v, s in zip(hms, (3600, 60, 1)))
+    start = np.datetime64(f"{year:04d}-{month:02d}-{day:02d}", "s")
+
+    times = np.asarray(times, dtype=np.float64)
+    if times.ndim != 1 or np.any(np.diff(times) <= 0):
+        raise ValueError("time values must increase")
+    offsets = np.round(times * TIME_UNITS[step.lower()] + seconds).astype("timedelta64[s]")
+    months = (start + offsets).astype("datetime64[M]")
+    return np.concatenate(([0], np.flatnonzero(np.diff(months)) + 1, [len(times)]))
+
+
+def _block_lengths(n, factor):
+    """Sizes of the factor-wide blocks covering an axis of length n."""
+    return np.minimum(factor, n - np.arange(0, n, factor))
+
+
+def _reduce(values, weights, edges, factor, statistic):
+    """
+    Reduces (time, y, x) values with per-cell weights over the time windows
+    between edges and factor x factor spatial blocks. NaN values and zero weights
+    are missing. Returns the reduced values and their summed weights.
+    """
+    weights = np.where(np.isnan(values), 0.0, weights)
+    starts = edges[:-1] - edges[0]
+    values, weights = values[edges[0]:edges[-1]], weights[edges[0]:edges[-1]]
+    pad = [(0, 0)] + [(0, -n % factor) for n in values.shape[1:]]
+    values = np.pad(values, pad, constant_values=np.nan)
+    weights = np.pad(weights, pad)
+    ny, nx = values.shape[1] // factor, values.shape[2] // factor
+
+    def blocks(a, reduce):
+        a = reduce.reduceat(a, starts, axis=0)
+        a = a.reshape(len(starts), ny, factor, nx, factor)
+        return reduce.reduce(reduce.reduce(a, axis=4), axis=2)
+
+    total = blocks(weights, np.add)
+    if statistic == "mean":
+        out = blocks(np.where(weights > 0, values * weights, 0.0), np.add)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out = out / total
+    elif statistic in ("min", "max"):
+        reduce, empty = (np.minimum, np.inf) if statistic == "min" else (np.maximum, -np.inf)
+        out = blocks(np.where(weights > 0, values, empty), reduce)
+    else:
+        raise ValueError(f"unknown statistic {statistic!r}, use one of {STATISTICS}")
+    out[total == 0] = np.nan
+    return out, total
+
+
+def _as_float(values, dtype):
+    """Primary values as float64 with the fill value of integer data as NaN."""
+    out = values.astype(np.float64)
+    if dtype.kind != "f":
+        out[values == fill_value(dtype)] = np.nan
+    return out
+
+
+def build_pyramid(dset, time_windows=(7, 30), space_factors=(2, 4), statistics=("mean",),
+                  multiplier=None, offset=None, workers=None):
+    """
+    Computes and stores the aggregate levels of a (time, y, x) TurboPFor dataset
+    in a file open for writing: every statistic for every combination of the
+    per-step data and time_windows with full resolution and space_factors, except
+    the primary itself. time_windows are step counts or (name, edges) pairs.
+
+    Levels are quantized with multiplier and offset, by default those of float32
+    data and 1.0 and 0.0 for integer data. The primary is read in tiles of all
+    time steps by a multiple of its chunk width, so memory stays at a few tiles.
+    Existing levels are replaced. Returns the PyramidLevels.
+    """
+    if dset.ndim != 3:
+        raise ValueError("pyramids need a (time, y, x) dataset")
+    statistics = tuple(statistics)
+    for statistic in statistics:
+        if statistic not in STATISTICS:
+            raise ValueError(f"unknown statistic {statistic!r}, use one of {STATISTICS}")
+    if multiplier is None:
+        multiplier, default_offset = quantization(filter_cd_values(dset)) or (1.0, 0.0)
+        if offset is None:
+            offset = default_offset
+    elif offset is None:
+        offset = 0.0
+
+    shape, chunks = dset.shape, dset.chunks
+    windows = {"1": np.arange(shape[0] + 1)}
+    for window in time_windows:
+        label, edges = _window_edges(window, shape[0])
+        windows[label] = edges
+    factors = sorted({1} | {int(f) for f in space_factors})
+    if factors[0] < 1:
+        raise ValueError("space factors must be at least 1")
+    combos = [(w, f) for w, f in itertools.product(windows.items(), factors)
+              if (w[0], f) != ("1", 1)]
+    if not combos:
+        return []
+
+    # Tiles must hold whole blocks of every factor
+    step = math.lcm(*factors)
+    tile = tuple(-(-c // step) * step for c in chunks[1:])
+
+    group = dset.file.require_group(pyramid_group(dset))
+    levels, targets = [], {}
+    for (label, edges), factor in combos:
+        level_shape = (len(edges) - 1,) + tuple(-(-n // factor) for n in shape[1:])
+        level_chunks = (min(level_shape[0], chunks[0]),) + tuple(
+            min(n, t // factor) for n, t in zip(level_shape[1:], tile))
+        for statistic in statistics:
+            name = f"{statistic}_t{label}_s{factor}"
+            if name in group:
+                del group[name]
+            target = group.create_dataset(
+                name, shape=level_shape, dtype=np.float32, fillvalue=np.nan,
+                **dataset_options(level_chunks, np.float32, mask=True,
+                                  multiplier=multiplier, offset=offset))
+            target.attrs.update(statistic=statistic, time_window=label, space_factor=factor,
+                                source_shape=np.array(shape))
+            if not label.isdigit():  # fixed windows are rebuilt from the label
+                target.attrs["time_edges"] = edges
+            targets[name] = target
+            levels.append(PyramidLevel(target.name, statistic, label, factor, edges))
+
+    for y0, x0 in itertools.product(range(0, shape[1], tile[0]), range(0, shape[2], tile[1])):
+        values = _as_float(read_parallel(dset, np.s_[:, y0:y0 + tile[0], x0:x0 + tile[1]],
+                                         workers), dset.dtype)
+        ones = np.ones_like(values)
+        for (label, edges), factor in combos:
+            for statistic in statistics:
+                out, _ = _reduce(values, ones, edges, factor, statistic)
+                targets[f"{statistic}_t{label}_s{factor}"][
+                    :, y0 // factor:y0 // factor + out.shape[1],
+                    x0 // factor:x0 // factor + out.shape[2]] = out
+    return levels
+
+
+def pyramid_levels(dset):
+    """The PyramidLevels stored for dset that still match its shape."""
+    group = dset.file.get(pyramid_group(dset))
+    if group is None:
+        return []
+    levels = []
+    for level in group.values():
+        attrs = level.attrs
+        if tuple(attrs["source_shape"]) != dset.shape:
+            continue
+        label = str(attrs["time_window"])
+        edges = (_window_edges(int(label), dset.shape[0])[1] if label.isdigit()
+                 else np.asarray(attrs["time_edges"]))
+        levels.append(PyramidLevel(level.name, str(attrs["statistic"]), label,
+                                   int(attrs["space_factor"]), edges))
+    return levels
+
+
+def _choose_level(dset, statistic, time_window, space_factor):
+    """The smallest level (None for the primary) time_window and space_factor derive from."""
+    best, best_size = None, math.prod(dset.shape)
+    for level in pyramid_levels(dset):
+        if level.statistic != statistic or space_factor % level.space_factor:
+            continue
+        if isinstance(time_window, str):
+            if level.time_window != time_window:
+                continue
+        elif not level.time_window.isdigit() or time_window % int(level.time_window):
+            continue
+        size = dset.file[level.name].size
+        if size < best_size:
+            best, best_size = level, size
+    return best
+
+
+def read_aggregate(dset, statistic="mean", time_window=1, space_factor=1, key=Ellipsis,
+                   workers=None):
+    """
+    Reads statistic over time windows and space_factor x space_factor blocks of a
+    (time, y, x) TurboPFor dataset. time_window is a number of steps or the name
+    of a window stored with build_pyramid(). key selects from the aggregated
+    grid, with ints and step-1 slices as in read_parallel().
+
+    The result comes from the smallest stored level the query derives from,
+    reduced further where needed, or from the primary data. Means of partial
+    windows and blocks are weighted by the number of cells they cover. Returns
+    a float32 array; windows without data are NaN.
+    """
+    if dset.ndim != 3:
+        raise ValueError("aggregates need a (time, y, x) dataset")
+    if statistic not in STATISTICS:
+        raise ValueError(f"unknown statistic {statistic!r}, use one of {STATISTICS}")
+    level = _choose_level(dset, statistic, time_window, space_factor)
+    if isinstance(time_window, str) and level is None:
+        raise KeyError(f"no {statistic} level with time window {time_window!r}")
+    if level is None:
+        source, src_factor = dset, 1
+        src_edges = np.arange(dset.shape[0] + 1)
+    else:
+        source, src_factor, src_edges = dset.file[level.name], level.space_factor, level.edges
+    ratio_t = 1 if isinstance(time_window, str) else time_window // (
+        int(level.time_window) if level is not None else 1)
+    ratio_s = space_factor // src_factor
+
+    ntime = len(src_edges) - 1
+    grid = (-(-ntime // ratio_t),) + tuple(-(-n // space_factor) for n in dset.shape[1:])
+    ranges, out_shape = _selection(key, grid)
+    src_ranges = [(a * r, min(b * r, n))
+                  for (a, b), r, n in zip(ranges, (ratio_t, ratio_s, ratio_s), source.shape)]
+    values = read_parallel(source, tuple(slice(a, b) for a, b in src_ranges), workers)
+    values = _as_float(values, source.dtype)
+
+    if values.size and (ratio_t > 1 or ratio_s > 1):
+        # Cells each source value stands for, to weight partial windows and blocks
+        (t0, t1), (y0, y1), (x0, x1) = src_ranges
+        weights = (np.diff(src_edges)[t0:t1, None, None]
+                   * _block_lengths(dset.shape[1], src_factor)[None, y0:y1, None]
+                   * _block_lengths(dset.shape[2], src_factor)[None, None, x0:x1])
+        edges = np.append(np.arange(0, t1 - t0, ratio_t), t1 - t0)
+        values, _ = _reduce(values, weights.astype(np.float64), edges, ratio_s, statistic)
+    return values.astype(np.float32).reshape(out_shape)
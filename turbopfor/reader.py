@@ -0,0 +1,271 @@
+"""
+Read paths that work on the stored chunk bytes (read_direct_chunk) instead of
+going through HDF5's filter pipeline.
+"""
+import concurrent.futures
+import itertools
+import os
+
+import numpy as np
+
+from .cache import chunk_key
+from .codec import (BLOCK_SHIFT, FILTER_ID, block_index, constant_value, decode, decode_block,
+                    quantization)
+
+
+def filter_cd_values(dset):
+    """Returns the TurboPFor cd_values a dataset was created with."""
+    plist = dset.id.get_create_plist()
+    for i in range(plist.get_nfilters()):
+        code, _, values, _ = plist.get_filter(i)
+        if code == FILTER_ID:
+            return tuple(values)
+    raise ValueError(f"{dset.name} is not compressed with TurboPFor")
+
+
+def _read_chunk(dset, offset):
+    """Returns the stored bytes of the chunk at offset, or None if it was never written."""
+    info = dset.id.get_chunk_info_by_coord(offset)
+    if info.byte_offset is None:
+        return None
+    filter_mask, raw = dset.id.read_direct_chunk(offset)
+    if filter_mask:
+        raise ValueError("chunk was stored without the TurboPFor filter")
+    return raw
+
+
+def _decoded_chunk(dset, origin, quantized, cache=None):
+    """
+    Returns the decoded chunk at origin, a scalar for constant chunks or the
+    fill value for chunks that were never written. Decoded arrays go through cache.
+    """
+    key = chunk_key(dset, origin) if cache is not None else None
+    if key is not None:
+        chunk = cache.get(key)
+        if chunk is not None:
+            return chunk
+    raw = _read_chunk(dset, origin)
+    if raw is None:
+        return dset.fillvalue
+    value = constant_value(raw)
+    if value is not None:
+        return value
+    chunk = decode(raw, dset.chunks, dset.dtype, *quantized)
+    if key is not None:
+        cache.put(key, chunk)
+    return chunk
+
+
+def _gather_blocks(blocks, series, block_series, length, dtype):
+    """Assembles the (length, len(series)) columns of series from decoded sub-blocks."""
+    out = np.empty((length, len(series)), dtype=dtype)
+    for block, values in blocks.items():
+        selected = series // block_series == block
+        out[:, selected] = values[:length, series[selected] % block_series]
+    return out
+
+
+def _chunk_columns(dset, origin, series, block_series, quantized, cache=None):
+    """
+    Returns the series (columns along the first axis) of the chunk at origin as
+    a (chunk length, len(series)) array, or a scalar for constant and unwritten
+    chunks. Blocked chunks decode only the sub-blocks holding the series; whole
+    chunks and sub-blocks go through cache.
+    """
+    length = dset.chunks[0]
+    blocks = {}
+    if cache is not None:
+        chunk = cache.get(chunk_key(dset, origin))
+        if chunk is not None:
+            return chunk.reshape(length, -1)[:, series]
+        if block_series:
+            for block in np.unique(series // block_series):
+                values = cache.get(chunk_key(dset, origin, block))
+                if values is not None:
+                    blocks[block] = values
+            if len(blocks) == len(np.unique(series // block_series)):
+                return _gather_blocks(blocks, series, block_series, length, dset.dtype)
+
+    raw = _read_chunk(dset, origin)
+    if raw is None:
+        return dset.fillvalue
+    value = constant_value(raw)
+    if value is not None:
+        return value
+    index = block_index(raw)
+    if index is None:
+        chunk = decode(raw, dset.chunks, dset.dtype, *quantized)
+        if cache is not None:
+            cache.put(chunk_key(dset, origin), chunk)
+        return chunk.reshape(length, -1)[:, series]
+    for block in np.unique(series // index.block_series):
+        if block not in blocks:
+            blocks[block] = decode_block(raw, block, index, *quantized)
+            if cache is not None:
+                cache.put(chunk_key(dset, origin, block), blocks[block])
+    return _gather_blocks(blocks, series, index.block_series, length, dset.dtype)
+
+
+def _block_series(cd_values):
+    block = (cd_values[0] >> BLOCK_SHIFT) & 0xf
+    return 1 << (block - 1) if block else 0
+
+
+def read_series(dset, *coords, cache=None):
+    """
+    Reads the series dset[:, *coords] of a TurboPFor dataset.
+
+    For chunks stored in the blocked layout (cd_values_for(..., block_series=n))
+    only the sub-block holding the series is decoded, constant chunks are not
+    decoded at all; other chunks are decoded whole. With a ChunkCache, decoded
+    sub-blocks and chunks are kept for later reads.
+    """
+    chunks = dset.chunks
+    if len(coords) != dset.ndim - 1:
+        raise ValueError(f"expected {dset.ndim - 1} coordinates, got {len(coords)}")
+    local = tuple(c % k for c, k in zip(coords, chunks[1:]))
+    series = int(np.ravel_multi_index(local, chunks[1:])) if local else 0
+    corner = tuple(c - l for c, l in zip(coords, local))
+    cd_values = filter_cd_values(dset)
+    quantized = quantization(cd_values) or (None, 0.0)
+    block_series = _block_series(cd_values)
+
+    out = np.empty(dset.shape[0], dtype=dset.dtype)
+    for t0 in range(0, dset.shape[0], chunks[0]):
+        n = min(chunks[0], dset.shape[0] - t0)
+        values = _chunk_columns(dset, (t0,) + corner, np.array([series]), block_series,
+                                quantized, cache)
+        out[t0:t0 + n] = values[:n, 0] if isinstance(values, np.ndarray) else values
+    return out
+
+
+def _run_all(function, items, workers):
+    """
+    Calls function on every item, on a pool of `workers` threads (the CPU count
+    by default). With one worker or one item it runs inline, sparing the pool's
+    start-up. Re-raises the first error.
+    """
+    items = list(items)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(items) <= 1:
+        for item in items:
+            function(item)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(min(workers, len(items))) as pool:
+            list(pool.map(function, items))
+
+
+def read_points(dset, ys, xs, t_slice=slice(None), workers=None, cache=None):
+    """
+    Reads the series dset[t_slice, ys[i], xs[i]] of many points of a 3-D
+    (time, y, x) TurboPFor dataset as one (n_points, n_time) array.
+
+    Points are grouped by chunk so that each chunk (or, for blocked chunks,
+    each sub-block holding a requested series) is decoded once per call, and
+    the groups are decoded on a thread pool of `workers` threads, or inline for
+    one worker or one group.
+    """
+    if dset.ndim != 3:
+        raise ValueError("read_points needs a (time, y, x) dataset")
+    chunks, shape = dset.chunks, dset.shape
+    ys, xs = np.broadcast_arrays(np.asarray(ys, dtype=np.int64).ravel(),
+                                 np.asarray(xs, dtype=np.int64).ravel())
+    if ys.size and (ys.min() < 0 or ys.max() >= shape[1] or xs.min() < 0 or xs.max() >= shape[2]):
+        raise IndexError("point coordinates out of range")
+    t0, t1, step = t_slice.indices(shape[0])
+    if step != 1:
+        raise IndexError("only step 1 time slices are supported")
+    t1 = max(t0, t1)
+    cd_values = filter_cd_values(dset)
+    quantized = quantization(cd_values) or (None, 0.0)
+    block_series = _block_series(cd_values)
+
+    out = np.empty((ys.size, t1 - t0), dtype=dset.dtype)
+    if out.size == 0:
+        return out
+    series = (ys % chunks[1]) * chunks[2] + xs % chunks[2]
+    # Sort the points by chunk column and split them into one group per chunk column
+    keys = (ys // chunks[1]) * -(-shape[2] // chunks[2]) + xs // chunks[2]
+    order = np.argsort(keys, kind="stable")
+    starts = np.flatnonzero(np.diff(keys[order], prepend=-1))
+    groups = np.split(order, starts[1:])
+
+    def read_group(points):
+        corner = (ys[points[0]] // chunks[1] * chunks[1], xs[points[0]] // chunks[2] * chunks[2])
+        for origin in range(t0 // chunks[0] * chunks[0], t1, chunks[0]):
+            lo, hi = max(t0, origin), min(t1, origin + chunks[0])
+            values = _chunk_columns(dset, (origin,) + corner, series[points], block_series,
+                                    quantized, cache)
+            if isinstance(values, np.ndarray):
+                out[points, lo - t0:hi - t0] = values[lo - origin:hi - origin].T
+            else:
+                out[points, lo - t0:hi - t0] = values
+
+    _run_all(read_group, groups, workers)
+    return out
+
+
+def _selection(key, shape):
+    """
+    Normalizes an index of ints and step-1 slices into per-axis (start, stop)
+    ranges and the output shape (axes indexed by an int are dropped).
+    """
+    if not isinstance(key, tuple):
+        key = (key,)
+    if any(k is Ellipsis for k in key):
+        i = key.index(Ellipsis)
+        key = key[:i] + (slice(None),) * (len(shape) - len(key) + 1) + key[i + 1:]
+    key = key + (slice(None),) * (len(shape) - len(key))
+    if len(key) != len(shape):
+        raise IndexError(f"too many indices for a {len(shape)}-dimensional dataset")
+
+    ranges, out_shape = [], []
+    for k, n in zip(key, shape):
+        if isinstance(k, slice):
+            start, stop, step = k.indices(n)
+            if step != 1:
+                raise IndexError("only step 1 slices are supported")
+            stop = max(start, stop)
+            ranges.append((start, stop))
+            out_shape.append(stop - start)
+        else:
+            k = int(k)
+            if k < 0:
+                k += n
+            if not 0 <= k < n:
+                raise IndexError(f"index {k} out of range for axis of size {n}")
+            ranges.append((k, k + 1))
+    return ranges, tuple(out_shape)
+
+
+def read_parallel(dset, key=Ellipsis, workers=None, cache=None):
+    """
+    Reads dset[key] of a TurboPFor dataset by decoding its chunks on a thread pool.
+
+    key may contain ints and step-1 slices. The stored chunks are fetched with
+    read_direct_chunk and decoded by the TurboPFor kernel, which runs without the
+    GIL, then copied straight into the output array. workers defaults to the CPU
+    count; a single worker or chunk is decoded inline. With a ChunkCache, decoded
+    chunks are looked up and kept there.
+    """
+    chunks = dset.chunks
+    ranges, out_shape = _selection(key, dset.shape)
+    quantized = quantization(filter_cd_values(dset)) or (None, 0.0)
+    # Decode into an output that keeps the int-indexed axes, drop them at the end
+    out = np.empty(tuple(b - a for a, b in ranges), dtype=dset.dtype)
+    if out.size == 0:
+        return out.reshape(out_shape)
+
+    def read_chunk(index):
+        origin = tuple(i * c for i, c in zip(index, chunks))
+        # Intersection of the chunk with the selection, in chunk and in output coordinates
+        inner = tuple(slice(max(a, o) - o, min(b, o + c) - o)
+                      for (a, b), o, c in zip(ranges, origin, chunks))
+        target = tuple(slice(s.start + o - a, s.stop + o - a)
+                       for s, o, (a, _) in zip(inner, origin, ranges))
+        chunk = _decoded_chunk(dset, origin, quantized, cache)
+        out[target] = chunk[inner] if isinstance(chunk, np.ndarray) else chunk
+
+    grid = [range(a // c, -(-b // c)) for (a, b), c in zip(ranges, chunks)]
+    _run_all(read_chunk, itertools.product(*grid), workers)
+    return out.reshape(out_shape)
@@ -0,0 +1,255 @@
+"""
+asyncio access to a variable split across files, e.g. one file per year.
+
+Opening an HDF5 file and looking up a dataset costs more than decoding the few
+chunks a point query needs. A FileHandlePool keeps those handles open across
+requests, and a TimeseriesService reads each file's extent once, fans a query
+out to the files it spans on an executor and stitches the pieces in time order.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import os
+import threading
+
+import h5py
+import numpy as np
+
+from .reader import filter_cd_values, read_points
+
+PoolStats = collections.namedtuple("PoolStats", ["hits", "misses", "evictions", "open", "max_files"])
+
+FilePart = collections.namedtuple("FilePart", ["path", "start", "stop", "first_time"])
+
+
+class _Handle:
+    def __init__(self, file):
+        self.file = file
+        self.datasets = {}
+        self.users = 0
+        self.evicted = False
+
+
+class FileHandlePool:
+    """
+    Thread-safe LRU pool of at most max_files read-only h5py.File handles.
+
+    Handles are borrowed with dataset() or file(). An evicted handle still in use
+    is closed when its last borrower returns it, so the pool may briefly hold
+    more files than max_files. file_options are passed to h5py.File, e.g.
+    rdcc_nbytes.
+    """
+
+    def __init__(self, max_files=32, **file_options):
+        if max_files < 1:
+            raise ValueError("max_files must be at least 1")
+        self.max_files = int(max_files)
+        self.file_options = file_options
+        self._files = collections.OrderedDict()  # path -> _Handle
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._evictions = 0
+
+    def _acquire(self, path):
+        path = os.path.realpath(path)
+        with self._lock:
+            handle = self._files.get(path)
+            if handle is not None:
+                self._files.move_to_end(path)
+                self._hits += 1
+                handle.users += 1
+                return handle
+            self._misses += 1
+        # Open outside the lock; a racing open of the same path keeps the first handle
+        file = h5py.File(path, "r", **self.file_options)
+        with self._lock:
+            handle = self._files.get(path)
+            if handle is None:
+                handle = self._files[path] = _Handle(file)
+                file = None
+                self._evict()
+            handle.users += 1
+        if file is not None:
+            file.close()
+        return handle
+
+    def _evict(self):
+        while len(self._files) > self.max_files:
+            _, handle = self._files.popitem(last=False)
+            self._evictions += 1
+            handle.evicted = True
+            if handle.users == 0:
+                handle.file.close()
+
+    def _release(self, handle):
+        with self._lock:
+            handle.users -= 1
+            if handle.evicted and handle.users == 0:
+                handle.file.close()
+
+    @contextlib.contextmanager
+    def file(self, path):
+        """Borrows the open h5py.File of path."""
+        handle = self._acquire(path)
+        try:
+            yield handle.file
+        finally:
+            self._release(handle)
+
+    @contextlib.contextmanager
+    def dataset(self, path, name):
+        """Borrows dataset name of path; the lookup is done once per open file."""
+        handle = self._acquire(path)
+        try:
+            dset = handle.datasets.get(name)
+            if dset is None:
+                dset = handle.datasets[name] = handle.file[name]
+            yield dset
+        finally:
+            self._release(handle)
+
+    def close(self):
+        """Closes every handle not in use and forgets the rest, which close on release."""
+        with self._lock:
+            for handle in self._files.values():
+                handle.evicted = True
+                if handle.users == 0:
+                    handle.file.close()
+            self._files.clear()
+
+    def stats(self):
+        with self._lock:
+            return PoolStats(self._hits, self._misses, self._evictions, len(self._files),
+                             self.max_files)
+
+    def __len__(self):
+        return len(self._files)
+
+    def __repr__(self):
+        s = self.stats()
+        return (f"{type(self).__name__}(max_files={s.max_files}, open={s.open}, "
+                f"hits={s.hits}, misses={s.misses})")
+
+
+class TimeseriesService:
+    """
+    Point and series queries over one variable stored in several files that
+    split its first (time) axis, e.g. tasmin_2019.h5, tasmin_2020.h5.
+
+    Files are put in time order by the first value of their time_variable when
+    every file has one with the same units, otherwise by path. The per-file
+    extents are read on first use and kept. Indices along the time axis are
+    positions in the concatenation of all files.
+
+    Queries run on executor (a thread pool of `workers` threads by default), one
+    task per file. pool and cache default to a new FileHandlePool and no
+    ChunkCache; share them between services to share their budgets.
+    """
+
+    def __init__(self, paths, variable, time_variable="time", pool=None, cache=None,
+                 executor=None, workers=None):
+        self.paths = [os.fspath(p) for p in paths]
+        if not self.paths:
+            raise ValueError("no files given")
+        self.variable = variable
+        self.time_variable = time_variable
+        self.pool = FileHandlePool() if pool is None else pool
+        self.cache = cache
+        self._own_executor = executor is None
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(
+            workers or min(32, os.cpu_count() or 1))
+        self._parts = None
+        self._open_lock = asyncio.Lock()
+
+    def _file_info(self, path):
+        with self.pool.file(path) as f:
+            dset = f[self.variable]
+            filter_cd_values(dset)  # fail early on files written without the filter
+            first_time, units = None, None
+            if self.time_variable in f and len(f[self.time_variable]) > 0:
+                time = f[self.time_variable]
+                first_time, units = time[0], time.attrs.get("units")
+            return dset.shape, dset.dtype, first_time, units
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def parts(self):
+        """Returns the files as FileParts in time order, reading their extents on first use."""
+        if self._parts is not None:
+            return self._parts
+        async with self._open_lock:
+            if self._parts is None:
+                infos = await asyncio.gather(*(self._run(self._file_info, p) for p in self.paths))
+                shapes = {shape[1:] for shape, _, _, _ in infos}
+                if len(shapes) != 1:
+                    raise ValueError(f"files disagree on the shape after the time axis: {shapes}")
+                order = list(range(len(self.paths)))
+                if (all(t is not None for _, _, t, _ in infos)
+                        and len({u for _, _, _, u in infos}) == 1):
+                    order.sort(key=lambda i: infos[i][2])
+                else:
+                    order.sort(key=lambda i: self.paths[i])
+                parts, start = [], 0
+                for i in order:
+                    stop = start + infos[i][0][0]
+                    parts.append(FilePart(self.paths[i], start, stop, infos[i][2]))
+                    start = stop
+                self._shape = (start,) + shapes.pop()
+                self._dtype = infos[0][1]
+                self._parts = parts
+        return self._parts
+
+    async def shape(self):
+        """Shape of the variable with the files concatenated along time."""
+        await self.parts()
+        return self._shape
+
+    def _read_points(self, path, ys, xs, t_slice):
+        with self.pool.dataset(path, self.variable) as dset:
+            return read_points(dset, ys, xs, t_slice, workers=1, cache=self.cache)
+
+    async def read_points(self, ys, xs, t_slice=slice(None)):
+        """
+        Reads the series of the points (ys[i], xs[i]) over t_slice of the
+        concatenated time axis as one (n_points, n_time) array.
+        """
+        parts = await self.parts()
+        t0, t1, step = t_slice.indices(parts[-1].stop)
+        if step != 1:
+            raise IndexError("only step 1 time slices are supported")
+        tasks = [self._run(self._read_points, part.path, ys, xs,
+                           slice(max(t0, part.start) - part.start, min(t1, part.stop) - part.start))
+                 for part in parts if part.start < t1 and t0 < part.stop]
+        if not tasks:
+            ys = np.broadcast_arrays(np.ravel(ys), np.ravel(xs))[0]
+            return np.empty((ys.size, 0), dtype=self._dtype)
+        return np.concatenate(await asyncio.gather(*tasks), axis=1)
+
+    async def read_series(self, y, x, t_slice=slice(None)):
+        """Reads the series at (y, x) over t_slice of the concatenated time axis."""
+        return (await self.read_points([y], [x], t_slice))[0]
+
+    async def times(self):
+        """The time coordinates of all files in order, or None if a file has none."""
+        parts = await self.parts()
+        if any(part.first_time is None for part in parts):
+            return None
+
+        def read(path):
+            with self.pool.file(path) as f:
+                return f[self.time_variable][:]
+
+        return np.concatenate(await asyncio.gather(*(self._run(read, p.path) for p in parts)))
+
+    def close(self):
+        """Shuts down the executor if the service created it. The pool stays open."""
+        if self._own_executor:
+            self.executor.shutdown()
+
+    async def __aenter__(self):
+        await self.parts()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
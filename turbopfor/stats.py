@@ -0,0 +1,67 @@
+"""
+Runtime counters of the plugin library (TurboPForStats in turbopfor_h5plugin.h).
+
+The counters are process-wide and cover both the HDF5 filter and the ctypes
+entry points, as long as HDF5 and turbopfor load the same library file. They
+are collected only while enabled, by TURBOPFOR_STATS=1 in the environment or
+enable_filter_stats().
+"""
+import collections
+import ctypes
+
+from . import _lib
+
+RATIO_BINS = 8  # TURBOPFOR_RATIO_BINS
+
+
+class _Direction(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_uint64) for name in (
+        "calls", "errors", "bytes_in", "bytes_out", "total_ns", "predict_ns", "codec_ns")]
+    _fields_ += [("ratio_histogram", ctypes.c_uint64 * RATIO_BINS)]
+
+
+class _Stats(ctypes.Structure):
+    _fields_ = [("encode", _Direction), ("decode", _Direction)]
+
+
+class DirectionStats(collections.namedtuple(
+        "DirectionStats", ["calls", "errors", "bytes_in", "bytes_out", "seconds",
+                           "predict_seconds", "codec_seconds", "ratio_histogram"])):
+    """
+    Counters of encoding or decoding. bytes_in/bytes_out are what went into and
+    came out of the library, so the raw side is bytes_in when encoding and
+    bytes_out when decoding. predict_seconds and codec_seconds split the time in
+    the delta/predictor step and in the entropy codec. ratio_histogram[0] counts
+    chunks that grew, ratio_histogram[k] chunks with a raw/stored ratio in
+    [2**(k-1), 2**k) and the last entry everything above.
+    """
+
+    @property
+    def other_seconds(self):
+        """Time outside prediction and coding: headers, masks, copies, allocation."""
+        return max(self.seconds - self.predict_seconds - self.codec_seconds, 0.0)
+
+
+FilterStats = collections.namedtuple("FilterStats", ["encode", "decode"])
+
+
+def _direction(d):
+    return DirectionStats(d.calls, d.errors, d.bytes_in, d.bytes_out, d.total_ns / 1e9,
+                          d.predict_ns / 1e9, d.codec_ns / 1e9, tuple(d.ratio_histogram))
+
+
+def filter_stats():
+    """Returns a FilterStats snapshot of the encode and decode counters."""
+    raw = _Stats()
+    _lib.load().turbopfor_stats_get(ctypes.addressof(raw))
+    return FilterStats(_direction(raw.encode), _direction(raw.decode))
+
+
+def reset_filter_stats():
+    """Zeroes all counters."""
+    _lib.load().turbopfor_stats_reset()
+
+
+def enable_filter_stats(enabled=True):
+    """Switches collection on or off and returns the previous state."""
+    return bool(_lib.load().turbopfor_stats_enable(int(bool(enabled))))
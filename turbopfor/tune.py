@@ -0,0 +1,285 @@
+"""
+Chunk-shape tuning for a weighted access pattern.
+
+Candidate chunk shapes are ranked first by a model of how many elements a
+query decodes. The best few are then measured on a sample of the data: each
+one is written through the TurboPFor filter to an in-memory HDF5 file, which
+gives the ratio and encode speed, and every chunk is read back, which gives
+the cost of one chunk. The expected cost of a query on the full dataset is
+the number of chunks it touches times that cost. Candidates are ranked by
+the weighted mean over the access pattern, optionally traded against the
+measured ratio and encode speed.
+
+    python -m turbopfor.tune data.h5 tasmin --access series=0.7,map=0.3
+"""
+import argparse
+import collections
+import itertools
+import json
+import math
+import time
+import uuid
+
+import h5py
+import numpy as np
+
+from .codec import FILTER_ID, cd_values_for, dataset_options
+
+
+class ChunkEvaluation(collections.namedtuple(
+        "ChunkEvaluation",
+        ["chunks", "cd_values", "ratio", "encode_mb_s", "chunk_seconds", "query_seconds",
+         "read_seconds", "score"])):
+    """
+    Measurements of one chunk shape. chunk_seconds is the time to read and decode
+    one chunk through h5py, query_seconds maps each query extent of the access
+    pattern to its expected cost on the full dataset and read_seconds is their
+    weighted mean. score ranks the shapes (lower is better): read_seconds
+    multiplied by (1 / ratio) ** storage_weight and (1 / encode_mb_s) **
+    encode_weight, so with weights of 0 it is the read cost alone.
+    """
+
+
+MIN_CHUNK_BYTES = 16 * 1024
+MAX_CHUNK_BYTES = 4 * 1024 * 1024
+
+# Fixed cost of reading one chunk through HDF5 (lookup, I/O call, filter setup),
+# in elements decoded in the same time; keeps the model from favouring tiny chunks
+CHUNK_OVERHEAD_ELEMENTS = 32 * 1024
+
+
+def _named_extent(name, ndim):
+    """Query extent of a named pattern; None spans the whole axis."""
+    if name == "series":  # all of the first (time) axis at one point
+        return (None,) + (1,) * (ndim - 1)
+    if name == "map":  # one step of the first axis, everything else
+        return (1,) + (None,) * (ndim - 1)
+    if name == "point":
+        return (1,) * ndim
+    if name == "full":
+        return (None,) * ndim
+    raise ValueError(f"unknown access pattern {name!r}, use series, map, point, full "
+                     f"or a tuple of extents")
+
+
+def access_extents(access, ndim):
+    """
+    Normalizes an access pattern to {extent tuple: weight}. access maps a name
+    ("series", "map", "point", "full") or an extent tuple to its weight.
+    In tuples, None spans the whole axis.
+    """
+    if isinstance(access, str):
+        access = parse_access(access)
+    extents = {}
+    for query, weight in access.items():
+        extent = _named_extent(query, ndim) if isinstance(query, str) else tuple(query)
+        if len(extent) != ndim:
+            raise ValueError(f"query {query!r} does not have {ndim} dimensions")
+        extents[extent] = extents.get(extent, 0.0) + float(weight)
+    if not extents or sum(extents.values()) <= 0:
+        raise ValueError("access pattern needs a positive weight")
+    return extents
+
+
+def parse_access(text):
+    """Parses "series=0.7,map=0.3" or "30x10x10=1" into an access dict."""
+    access = {}
+    for item in text.split(","):
+        query, _, weight = item.partition("=")
+        query = query.strip()
+        if "x" in query:
+            query = tuple(None if n in ("", ":") else int(n) for n in query.split("x"))
+        access[query] = float(weight) if weight else 1.0
+    return access
+
+
+def chunks_touched(extent, chunks, shape):
+    """Expected number of chunks a query of the given extent touches at a random position."""
+    total = 1.0
+    for q, c, n in zip(extent, chunks, shape):
+        q = n if q is None else min(q, n)
+        total *= min(1 + (q - 1) / c, math.ceil(n / c))
+    return total
+
+
+def candidate_chunks(shape, itemsize, min_bytes=MIN_CHUNK_BYTES, max_bytes=MAX_CHUNK_BYTES,
+                     limit=None):
+    """
+    Chunk shapes whose extents are powers of two or the whole axis and whose size is
+    between min_bytes and max_bytes. limit caps each axis, e.g. at a sample shape.
+    """
+    axes = []
+    for i, n in enumerate(shape):
+        top = n if limit is None else min(n, limit[i])
+        sizes = {top} | {1 << k for k in range(top.bit_length()) if 1 << k <= top}
+        axes.append(sorted(sizes))
+    found = []
+    for chunks in itertools.product(*axes):
+        nbytes = math.prod(chunks) * itemsize
+        if min_bytes <= nbytes <= max_bytes:
+            found.append(chunks)
+    if not found:
+        # Tiny datasets: one chunk holding everything the limit allows
+        found.append(tuple(axis[-1] for axis in axes))
+    return found
+
+
+def modeled_cost(chunks, shape, extents):
+    """
+    Weighted elements decoded per query plus CHUNK_OVERHEAD_ELEMENTS per chunk
+    touched; the model used to preselect candidates.
+    """
+    size = math.prod(chunks) + CHUNK_OVERHEAD_ELEMENTS
+    return sum(w * chunks_touched(e, chunks, shape) * size for e, w in extents.items())
+
+
+def evaluate_chunks(sample, chunks, shape, extents, repeat=3, storage_weight=0.0,
+                    encode_weight=0.0, **options):
+    """
+    Writes sample through the filter with the given chunk shape and measures it.
+    shape is the full dataset shape the query costs are projected onto. With a
+    storage_weight of w, a shape that stores the data in half the space may read
+    2 ** w times slower and score the same; encode_weight does the same for the
+    encode speed. options are those of cd_values_for(). Returns a ChunkEvaluation.
+    """
+    chunks = tuple(int(c) for c in chunks)
+    create_options = dataset_options(chunks, sample.dtype, **options)
+    name = f"turbopfor-tune-{uuid.uuid4().hex}.h5"
+    # In-memory file without chunk cache, so every read decodes
+    with h5py.File(name, "w", driver="core", backing_store=False, rdcc_nbytes=0) as f:
+        best = float("inf")
+        for i in range(repeat):
+            start = time.perf_counter()
+            dset = f.create_dataset(f"sample{i}", data=sample, **create_options)
+            f.flush()
+            best = min(best, time.perf_counter() - start)
+        encode_seconds = best
+        stored = dset.id.get_storage_size()
+
+        origins = list(itertools.product(*(range(0, n - c + 1, c)
+                                           for n, c in zip(sample.shape, chunks))))
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for origin in origins:
+                dset[tuple(slice(o, o + c) for o, c in zip(origin, chunks))]
+            best = min(best, time.perf_counter() - start)
+        chunk_seconds = best / len(origins)
+
+    query_seconds = {e: chunks_touched(e, chunks, shape) * chunk_seconds for e in extents}
+    total = sum(extents.values())
+    read_seconds = sum(w * query_seconds[e] for e, w in extents.items()) / total
+    ratio = sample.nbytes / stored if stored else float("inf")
+    encode_mb_s = (sample.nbytes / (1024 * 1024) / encode_seconds if encode_seconds > 0
+                   else float("inf"))
+    score = read_seconds * (1 / ratio) ** storage_weight * (1 / encode_mb_s) ** encode_weight
+    return ChunkEvaluation(chunks, cd_values_for(chunks, sample.dtype, **options), ratio,
+                           encode_mb_s, chunk_seconds, query_seconds, read_seconds, score)
+
+
+def tune_chunks(sample, access, shape=None, candidates=None, top=8, repeat=3,
+                min_bytes=MIN_CHUNK_BYTES, max_bytes=MAX_CHUNK_BYTES, storage_weight=0.0,
+                encode_weight=0.0, **options):
+    """
+    Recommends chunk shapes for reading data like sample with the access pattern
+    access (see access_extents()). shape is the full dataset shape, defaulting to
+    the sample's. candidates defaults to candidate_chunks(); the `top` best of them
+    by modeled_cost() are measured with evaluate_chunks(). By default they are
+    ranked by read cost only; storage_weight and encode_weight also reward a
+    higher ratio and encode speed (see evaluate_chunks()). options are those of
+    cd_values_for(), e.g. mask, predictor or multiplier.
+
+    Returns the ChunkEvaluations sorted by score. The first one is the recommendation,
+    and dataset_options(result.chunks, dtype, **options) creates a dataset with it.
+    """
+    sample = np.ascontiguousarray(sample)
+    shape = tuple(sample.shape if shape is None else shape)
+    if len(shape) != sample.ndim:
+        raise ValueError(f"shape {shape} does not match the sample's {sample.ndim} dimensions")
+    extents = access_extents(access, sample.ndim)
+    if candidates is None:
+        candidates = candidate_chunks(shape, sample.dtype.itemsize, min_bytes, max_bytes,
+                                      limit=sample.shape)
+    candidates = [tuple(int(c) for c in chunks) for chunks in candidates]
+    for chunks in candidates:
+        if len(chunks) != sample.ndim or any(c > n for c, n in zip(chunks, sample.shape)):
+            raise ValueError(f"candidate {chunks} does not fit the sample shape {sample.shape}")
+    candidates.sort(key=lambda chunks: modeled_cost(chunks, shape, extents))
+    results = [evaluate_chunks(sample, chunks, shape, extents, repeat, storage_weight,
+                               encode_weight, **options)
+               for chunks in candidates[:top]]
+    return sorted(results, key=lambda r: r.score)
+
+
+def sample_slices(shape, itemsize, max_bytes=64 * 1024 * 1024):
+    """
+    Slices of a leading sub-box of a dataset of at most max_bytes, keeping the
+    first (time) axis whole as long as possible and shrinking the others evenly.
+    """
+    extent = list(shape)
+    while math.prod(extent) * itemsize > max_bytes:
+        axis = max(range(1, len(extent)), key=lambda i: extent[i]) if len(extent) > 1 else 0
+        if extent[axis] == 1:
+            axis = 0
+        extent[axis] = max(1, extent[axis] // 2)
+    return tuple(slice(0, n) for n in extent)
+
+
+def _extent_label(extent):
+    return "x".join(":" if n is None else str(n) for n in extent)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("file")
+    parser.add_argument("variable")
+    parser.add_argument("--access", default="series=1",
+                        help='weighted queries, e.g. "series=0.7,map=0.3" or "30x10x10=1"')
+    parser.add_argument("--candidates", nargs="+",
+                        help="chunk shapes to measure, e.g. 366,20,20 100,50,50")
+    parser.add_argument("--top", type=int, default=8,
+                        help="number of modeled candidates to measure")
+    parser.add_argument("--sample-mb", type=float, default=64)
+    parser.add_argument("--storage-weight", type=float, default=0.0,
+                        help="trade read cost for compression ratio (0: read cost only)")
+    parser.add_argument("--encode-weight", type=float, default=0.0,
+                        help="trade read cost for encode speed (0: read cost only)")
+    parser.add_argument("--multiplier", type=float,
+                        help="tune for float32 quantized to 1/multiplier steps")
+    parser.add_argument("--offset", type=float, default=0.0)
+    parser.add_argument("--predictor")
+    parser.add_argument("--no-mask", action="store_true")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    with h5py.File(args.file, "r") as f:
+        dset = f[args.variable]
+        shape = dset.shape
+        sample = dset[sample_slices(shape, dset.dtype.itemsize, int(args.sample_mb * 2**20))]
+    options = {"mask": not args.no_mask}
+    if args.multiplier is not None:
+        sample = sample.astype(np.float32)
+        options.update(multiplier=args.multiplier, offset=args.offset)
+    if args.predictor is not None:
+        options["predictor"] = int(args.predictor) if args.predictor.isdigit() else args.predictor
+    candidates = None
+    if args.candidates:
+        candidates = [tuple(int(n) for n in c.split(",")) for c in args.candidates]
+
+    results = tune_chunks(sample, parse_access(args.access), shape, candidates, args.top,
+                          storage_weight=args.storage_weight,
+                          encode_weight=args.encode_weight, **options)
+    if args.json:
+        print(json.dumps([dict(r._asdict(), query_seconds={
+            _extent_label(e): s for e, s in r.query_seconds.items()}) for r in results], indent=1))
+        return
+    print(f"{'chunks':>16} {'ratio':>7} {'enc MB/s':>9} {'ms/chunk':>9} {'ms/query':>9}")
+    for r in results:
+        print(f"{'x'.join(map(str, r.chunks)):>16} {r.ratio:7.2f} {r.encode_mb_s:9.1f} "
+              f"{r.chunk_seconds * 1e3:9.3f} {r.read_seconds * 1e3:9.3f}")
+    best = results[0]
+    print(f"\nchunks={best.chunks}, compression={FILTER_ID}, compression_opts={best.cd_values}")
+
+
+if __name__ == "__main__":
+    main()
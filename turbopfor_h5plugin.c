@@ -41,17 +41,17 @@
 #include <float.h>
 
 #include "hdf5.h"
+#if !defined(_WIN32)
+#include <pthread.h>
+#endif
 
 #include "conf.h"
 #include "time_.h"
 #define BITUTIL_IN
 #include "bitutil.h"
 
-#if defined(__i386__) || defined(__x86_64__)
-#define SSE
-#define AVX2
-#elif defined(__ARM_NEON) || defined(__powerpc64__)
-#define SSE
+#if defined(_MSC_VER) && (defined(_M_X64) || defined(_M_IX86))
+#include <intrin.h>
 #endif
 
 #ifndef min
@@ -64,7 +64,10 @@
 typedef enum DataElementType
 {
 	ELEMENT_TYPE_SHORT = 0,
-	ELEMENT_TYPE_USHORT = 1
+	ELEMENT_TYPE_USHORT = 1,
+	ELEMENT_TYPE_INT = 2,
+	ELEMENT_TYPE_UINT = 3,
+	ELEMENT_TYPE_FLOAT = 4 /* quantized to int32 by the filter, see quantize */
 } DataElementType;
 
 void delta2d_encode(size_t length0, size_t length1, short* chunkBuffer) {
@@ -94,131 +97,2035 @@ void delta2d_decode(size_t length0, size_t length1, short* chunkBuffer) {
         }
     }
 }
-#define SetBit(A, k) (A[(k / 32)] |= (1 << (k % 32)))
-#define ClearBit(A, k) (A[(k / 32)] &= ~(1 << (k % 32)))
-#define TestBit(A, k) (A[(k / 32)] & (1 << (k % 32)))
+/*
+ * 32-bit variants work on unsigned values so that overflowing differences wrap
+ * around instead of being undefined; the same code serves int32 and uint32.
+ */
+void delta2d_encode32(size_t length0, size_t length1, uint32_t* chunkBuffer) {
+    if (length0 <= 1) {
+        return;
+    }
+    size_t d0, d1;
+    for (d0 = length0-1; d0 >= 1; d0--) {
+        uint32_t* curr = chunkBuffer + d0 * length1;
+        uint32_t* prev = chunkBuffer + (d0 - 1) * length1;
+        for (d1 = 0; d1 < length1; d1++) {
+            curr[d1] -= prev[d1];
+        }
+    }
+}
 
-/**
- * @brief the filter for Turbopfor
- *
- * @param flags : is set by HDF5 for decompress or compress
- * @param cd_nelmts: the # of values in  cd_values
- * @param cd_values: the pointer of the parameter
- * 			cd_values[0]: type of data:  short (0),  int (1)
- *          cd_values[1]: scaling factor for encoding of short data type:
- *                        0: multiply by 1
- *                        1: multiply by 1
- *                        >=2: multiplication factor
+void delta2d_decode32(size_t length0, size_t length1, uint32_t* chunkBuffer) {
+    if (length0 <= 1) {
+        return;
+    }
+    size_t d0, d1;
+    for (d0 = 1; d0 < length0; d0++) {
+        uint32_t* curr = chunkBuffer + d0 * length1;
+        uint32_t* prev = chunkBuffer + (d0 - 1) * length1;
+        for (d1 = 0; d1 < length1; d1++) {
+            curr[d1] += prev[d1];
+        }
+    }
+}
+/*
+ * Delta along one axis of a chunk viewed as outer x length x stride, and the
+ * zigzag mapping of the resulting signed residuals. Defined for 16 and 32 bit
+ * lanes; arithmetic is unsigned, so it wraps for every element type.
+ */
+#define DEFINE_PREDICTOR_KERNELS(_bits_)                                                     \
+	static void axis_delta_encode##_bits_(uint##_bits_##_t *a, size_t outer, size_t length, \
+										  size_t stride)                                    \
+	{                                                                                        \
+		for (size_t o = 0; o < outer; o++)                                                   \
+		{                                                                                    \
+			uint##_bits_##_t *base = a + o * length * stride;                                \
+			for (size_t i = length - 1; i >= 1; i--)                                         \
+				for (size_t j = 0; j < stride; j++)                                          \
+					base[i * stride + j] -= base[(i - 1) * stride + j];                      \
+		}                                                                                    \
+	}                                                                                        \
+	static void axis_delta_decode##_bits_(uint##_bits_##_t *a, size_t outer, size_t length, \
+										  size_t stride)                                    \
+	{                                                                                        \
+		for (size_t o = 0; o < outer; o++)                                                   \
+		{                                                                                    \
+			uint##_bits_##_t *base = a + o * length * stride;                                \
+			for (size_t i = 1; i < length; i++)                                              \
+				for (size_t j = 0; j < stride; j++)                                          \
+					base[i * stride + j] += base[(i - 1) * stride + j];                      \
+		}                                                                                    \
+	}                                                                                        \
+	static void zigzag_encode##_bits_(uint##_bits_##_t *a, size_t n)                         \
+	{                                                                                        \
+		for (size_t i = 0; i < n; i++)                                                       \
+			a[i] = (uint##_bits_##_t)((a[i] << 1) ^ (0 - (a[i] >> (_bits_ - 1))));           \
+	}                                                                                        \
+	static void zigzag_decode##_bits_(uint##_bits_##_t *a, size_t n)                         \
+	{                                                                                        \
+		for (size_t i = 0; i < n; i++)                                                       \
+			a[i] = (uint##_bits_##_t)((a[i] >> 1) ^ (0 - (a[i] & 1)));                      \
+	}
+
+DEFINE_PREDICTOR_KERNELS(16)
+DEFINE_PREDICTOR_KERNELS(32)
+
+#define SetBit(A, k) ((A)[((k) / 32)] |= (1u << ((k) % 32)))
+#define ClearBit(A, k) ((A)[((k) / 32)] &= ~(1u << ((k) % 32)))
+#define TestBit(A, k) ((A)[((k) / 32)] & (1u << ((k) % 32)))
+
+#define bitmap_words(_n_) (((_n_) + 31) / 32)
+#define mask_words(_m_, _row_bits_) (((_m_) + (_row_bits_) - 1) / (_row_bits_) * bitmap_words(_row_bits_))
+
+/*
+ * Mask mode: cells holding the fill value are recorded in a validity bitmap
+ * and replaced by the last valid value before them, so the edge of the valid
+ * domain no longer produces huge deltas and PFor exceptions. Decoding puts the
+ * fill value back wherever the bitmap bit is clear.
  *
- *          cd_values[2, -]: size of each dimension of a chunk
- * @param nbytes : input data size
- * @param buf_size : output data size
- * @param buf : the pointer to data buffer
- * @return size_t
+ * The bitmap has one row of row_words words per row_bits elements, so a mask
+ * that does not change along the first chunk axis repeats word for word.
  */
-DLL_EXPORT size_t turbopfor_filter(unsigned int flags, size_t cd_nelmts,
-								   const unsigned int cd_values[], size_t nbytes,
-								   size_t *buf_size, void **buf)
+#define DEFINE_MASK_KERNELS(_bits_)                                                            \
+	static size_t mask_encode##_bits_(uint##_bits_##_t *a, size_t m, size_t row_bits,         \
+									  uint##_bits_##_t fill, uint32_t *bitmap)                 \
+	{                                                                                          \
+		size_t row_words = bitmap_words(row_bits);                                             \
+		uint##_bits_##_t last = 0;                                                             \
+		size_t nfill = 0, i, c;                                                                \
+		for (i = 0; i < m; i++)                                                                \
+		{                                                                                      \
+			if (a[i] != fill)                                                                  \
+			{                                                                                  \
+				last = a[i];                                                                   \
+				break;                                                                         \
+			}                                                                                  \
+		}                                                                                      \
+		memset(bitmap, 0, mask_words(m, row_bits) * sizeof(uint32_t));                        \
+		for (i = 0; i < m; i += row_bits, bitmap += row_words)                                 \
+		{                                                                                      \
+			for (c = 0; c < min(row_bits, m - i); c++)                                         \
+			{                                                                                  \
+				if (a[i + c] == fill)                                                          \
+				{                                                                              \
+					a[i + c] = last;                                                           \
+					nfill++;                                                                   \
+				}                                                                              \
+				else                                                                           \
+				{                                                                              \
+					last = a[i + c];                                                           \
+					SetBit(bitmap, c);                                                         \
+				}                                                                              \
+			}                                                                                  \
+		}                                                                                      \
+		return nfill;                                                                          \
+	}                                                                                          \
+	static void mask_decode##_bits_(uint##_bits_##_t *a, size_t m, size_t row_bits,           \
+									uint##_bits_##_t fill, const uint32_t *bitmap)             \
+	{                                                                                          \
+		size_t row_words = bitmap_words(row_bits);                                             \
+		for (size_t i = 0; i < m; i += row_bits, bitmap += row_words)                          \
+		{                                                                                      \
+			size_t n = min(row_bits, m - i);                                                   \
+			for (size_t w = 0; w < row_words; w++)                                             \
+			{                                                                                  \
+				if (bitmap[w] == 0xffffffffu)                                                  \
+					continue;                                                                  \
+				for (size_t c = w * 32; c < min(n, w * 32 + 32); c++)                          \
+					if (!TestBit(bitmap, c))                                                   \
+						a[i + c] = fill;                                                       \
+			}                                                                                  \
+		}                                                                                      \
+	}
+
+DEFINE_MASK_KERNELS(16)
+DEFINE_MASK_KERNELS(32)
+
+/*
+ * Some TurboPFor decoders unpack the tail of a stream in groups of 32 values
+ * and may write past the last element. Every decode target gets this many
+ * spare bytes.
+ */
+#define DECODE_PAD 256
+
+/*
+ * Every chunk written by this version starts with a ChunkHeader so the decoder
+ * knows the exact raw size before touching the payload. Chunks without the
+ * magic come from earlier versions and hold a bare p4nzenc128v16 stream.
+ * Fields are stored in host (little-endian) order, like the TurboPFor streams.
+ */
+#define HEADER_VERSION 1
+#define HEADER_SIZE 16
+
+/*
+ * Apart from the legacy DELTA2D, predictors are products of per-axis deltas
+ * (a Lorenzo predictor is the delta along each of its axes), followed by a
+ * zigzag step and plain PFor.
+ */
+typedef enum Predictor
 {
+	PREDICTOR_DELTA2D = 0,   /* delta between consecutive rows of the flattened 2D chunk */
+	PREDICTOR_LORENZO2D = 1, /* last two chunk axes */
+	PREDICTOR_LORENZO3D = 2, /* last three chunk axes */
+	PREDICTOR_AXIS = 16,     /* + k: delta along chunk axis k */
+	PREDICTOR_AUTO = 255     /* cd_values only: try the candidates, keep the smallest */
+} Predictor;
 
-	size_t ret_value = 0;
-	size_t origSize = nbytes; /* Number of bytes for output (compressed) buffer */
-#ifdef DEBUG
-	printf("cd_nelmts = %zu, cd_values = ", cd_nelmts);
-	for (int i = 0; i < cd_nelmts; i++)
+/*
+ * Entropy stage applied after the predictor and zigzag step. Only the legacy
+ * DELTA2D + P4N128V pairing uses the p4nz* entry points, which zigzag internally.
+ */
+typedef enum Codec
+{
+	CODEC_P4N128V = 0, /* PFor, 128-bit SIMD */
+	CODEC_P4N256V = 1, /* PFor, 256-bit AVX2; 32-bit types only */
+	CODEC_VSIMPLE = 2, /* variable simple, for runs of small values */
+	CODEC_BITPACK = 3, /* plain bit packing without exceptions, fastest decode */
+	CODEC_TRLE = 4,    /* TurboRLE over the bytes, for long runs of equal values */
+	CODEC_COUNT,
+	CODEC_AUTO = 255 /* cd_values only: try the candidates, keep the smallest */
+} Codec;
+
+typedef struct ChunkHeader
+{
+	uint8_t magic[2]; /* 'T', 'P' */
+	uint8_t version;
+	uint8_t type;      /* DataElementType */
+	uint8_t predictor; /* Predictor */
+	uint8_t codec;     /* Codec */
+	uint16_t flags;    /* ChunkFlags */
+	uint32_t nelem;    /* number of elements in the chunk */
+	uint32_t raw_size; /* decoded size in bytes */
+} ChunkHeader;
+
+typedef enum ChunkFlags
+{
+	CHUNK_BLOCKED = 0x1, /* payload is a BlockTable followed by sub-blocks */
+	CHUNK_MASKED = 0x2,  /* payload starts with a validity bitmap, see write_mask */
+	CHUNK_CONSTANT = 0x4, /* every element equals the single element in the payload */
+	CHUNK_SEGMENTED = 0x8 /* payload is a SegmentTable followed by segments, see append_segment */
+} ChunkFlags;
+
+static void write_header(unsigned char *out, unsigned int type, unsigned int predictor,
+						 unsigned int codec, size_t m, size_t raw_size, unsigned int flags)
+{
+	ChunkHeader h;
+	memset(&h, 0, sizeof(h));
+	h.magic[0] = 'T';
+	h.magic[1] = 'P';
+	h.version = HEADER_VERSION;
+	h.type = (uint8_t)type;
+	h.predictor = (uint8_t)predictor;
+	h.codec = (uint8_t)codec;
+	h.flags = (uint16_t)flags;
+	h.nelem = (uint32_t)m;
+	h.raw_size = (uint32_t)raw_size;
+	memcpy(out, &h, HEADER_SIZE);
+}
+
+/*
+ * Parse the header at the start of a chunk.
+ * Returns HEADER_SIZE if there is one, 0 for a headerless (legacy) chunk.
+ */
+static size_t read_header(const unsigned char *in, size_t nbytes, ChunkHeader *h)
+{
+	if (nbytes < HEADER_SIZE)
+		return 0;
+	memcpy(h, in, HEADER_SIZE);
+	if (h->magic[0] != 'T' || h->magic[1] != 'P' || h->version == 0 || h->version > HEADER_VERSION)
+		return 0;
+	return HEADER_SIZE;
+}
+
+/*
+ * Per-thread scratch buffers, reused across calls so that neither direction
+ * allocates a full-size temporary per chunk. Buffers grow on demand; the entry
+ * points trim slots above SCRATCH_KEEP_BYTES before returning, so one oversized
+ * chunk does not stay allocated for the life of the thread.
+ */
+#ifndef SCRATCH_KEEP_BYTES
+#define SCRATCH_KEEP_BYTES ((size_t)8 << 20)
+#endif
+
+typedef enum ScratchSlot
+{
+	SCRATCH_WORK = 0, /* working copy of the raw chunk */
+	SCRATCH_OUT = 1,  /* encoder output before it is trimmed to size */
+	SCRATCH_BLOCK = 2, /* one sub-block gathered from or decoded for a blocked chunk */
+	SCRATCH_TRIAL = 3, /* PREDICTOR_AUTO: copy of the chunk for one candidate */
+	SCRATCH_TRIAL_OUT = 4, /* PREDICTOR_AUTO: output of the candidate under test */
+	SCRATCH_MASK = 5,      /* validity bitmap */
+	SCRATCH_SLOTS
+} ScratchSlot;
+
+typedef struct ScratchPool
+{
+	void *data[SCRATCH_SLOTS];
+	size_t size[SCRATCH_SLOTS];
+} ScratchPool;
+
+static void scratch_free(ScratchPool *pool, size_t keep)
+{
+	for (int i = 0; i < SCRATCH_SLOTS; i++)
 	{
-		printf("%d , ", cd_values[i]);
+		if (pool->size[i] > keep)
+		{
+			free(pool->data[i]);
+			pool->data[i] = NULL;
+			pool->size[i] = 0;
+		}
 	}
-	printf("\n");
+}
+
+#if defined(_WIN32)
+static __declspec(thread) ScratchPool scratch_tls;
+
+static ScratchPool *scratch_pool(void)
+{
+	return &scratch_tls;
+}
+
+/* Static TLS has no destructor, so the buffers are freed when the thread detaches */
+BOOL WINAPI DllMain(HINSTANCE instance, DWORD reason, LPVOID reserved)
+{
+	(void)instance;
+	(void)reserved;
+	if (reason == DLL_THREAD_DETACH || reason == DLL_PROCESS_DETACH)
+		scratch_free(&scratch_tls, 0);
+	return TRUE;
+}
+#else
+static pthread_key_t scratch_key;
+static pthread_once_t scratch_once = PTHREAD_ONCE_INIT;
+
+static void scratch_release(void *p)
+{
+	scratch_free(p, 0);
+	free(p);
+}
+
+static void scratch_key_init(void)
+{
+	pthread_key_create(&scratch_key, scratch_release);
+}
+
+static ScratchPool *scratch_pool(void)
+{
+	ScratchPool *pool;
+	pthread_once(&scratch_once, scratch_key_init);
+	pool = pthread_getspecific(scratch_key);
+	if (pool == NULL)
+	{
+		pool = calloc(1, sizeof(ScratchPool));
+		if (pool != NULL && pthread_setspecific(scratch_key, pool) != 0)
+		{
+			free(pool);
+			pool = NULL;
+		}
+	}
+	return pool;
+}
 #endif
 
-	unsigned m = 1;
-	unsigned n, l;
-	unsigned char *out;
-	for (int i = 2; i < cd_nelmts; i++)
+/*
+ * Why the last call on this thread failed, when it is something the caller can
+ * act on; turbopfor_filter puts it on the HDF5 error stack. Set without HDF5
+ * calls, since the ctypes entry points run outside HDF5's lock.
+ */
+#if defined(_WIN32)
+static __declspec(thread) const char *last_error;
+#else
+static __thread const char *last_error;
+#endif
+
+/* Returns a buffer of at least size bytes owned by the calling thread, NULL on failure */
+static void *scratch_get(ScratchSlot slot, size_t size)
+{
+	ScratchPool *pool = scratch_pool();
+	if (pool == NULL)
+		return NULL;
+	if (pool->size[slot] < size)
 	{
-		m = m * cd_values[i];
+		// Old contents are never needed, so skip realloc's copy
+		free(pool->data[slot]);
+		pool->data[slot] = malloc(size);
+		pool->size[slot] = pool->data[slot] != NULL ? size : 0;
 	}
-	unsigned chunk0 = 1;
-	unsigned chunk1 = cd_values[cd_nelmts-1];
-	for (int i = 2; i < cd_nelmts-1; i++)
+	return pool->data[slot];
+}
+
+/* Frees the calling thread's slots above SCRATCH_KEEP_BYTES, once no buffer is in use */
+static void scratch_trim(void)
+{
+	ScratchPool *pool = scratch_pool();
+	if (pool != NULL)
+		scratch_free(pool, SCRATCH_KEEP_BYTES);
+}
+
+DLL_EXPORT void turbopfor_scratch_release(void)
+{
+	ScratchPool *pool = scratch_pool();
+	if (pool != NULL)
+		scratch_free(pool, 0);
+}
+
+/*
+ * Runtime counters, see TurboPForStats. Off unless TURBOPFOR_STATS is set to
+ * something other than "0" or turbopfor_stats_enable() is called; when off each
+ * chunk costs one branch per counter site. Counters are updated with relaxed
+ * atomics, so readers see each field consistent but not the struct as a whole.
+ */
+static TurboPForStats stats;
+static int stats_state = -1; /* -1: TURBOPFOR_STATS not read yet */
+
+#if defined(_MSC_VER)
+#define STAT_ADD(field, v) InterlockedExchangeAdd64((volatile LONG64 *)&(field), (LONG64)(v))
+#else
+#define STAT_ADD(field, v) __atomic_fetch_add(&(field), (uint64_t)(v), __ATOMIC_RELAXED)
+#endif
+
+static int stats_enabled(void)
+{
+	if (stats_state < 0)
 	{
-		chunk0 = chunk0 * cd_values[i];
+		const char *env = getenv("TURBOPFOR_STATS");
+		stats_state = env != NULL && env[0] != '\0' && strcmp(env, "0") != 0;
 	}
-	
-    // Note: cd_values[1] (scalefactor) is ignored in this version.
-    // Quantization should be performed before passing data to the filter.
+	return stats_state;
+}
 
-	int32_t *A;
-	int A_n;
-#ifdef DEBUG
-	clock_t t;
-	t = clock();
+/* Monotonic wall clock in nanoseconds */
+static uint64_t monotonic_ns(void)
+{
+#if defined(_WIN32)
+	static LARGE_INTEGER frequency;
+	LARGE_INTEGER now;
+	if (frequency.QuadPart == 0)
+		QueryPerformanceFrequency(&frequency);
+	QueryPerformanceCounter(&now);
+	return (uint64_t)((double)now.QuadPart * 1e9 / (double)frequency.QuadPart);
+#else
+	struct timespec ts;
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return (uint64_t)ts.tv_sec * 1000000000u + (uint64_t)ts.tv_nsec;
 #endif
-	if (flags & H5Z_FLAG_REVERSE)
+}
+
+/* Start of a timed section, 0 when counters are off */
+static uint64_t stats_clock(void)
+{
+	return stats_enabled() ? monotonic_ns() : 0;
+}
+
+/* Adds the time since start (from stats_clock) to *field; returns the current time */
+static uint64_t stats_lap(uint64_t *field, uint64_t start)
+{
+	uint64_t now;
+	if (start == 0)
+		return 0;
+	now = monotonic_ns();
+	STAT_ADD(*field, now - start);
+	return now;
+}
+
+/*
+ * Counts one chunk processed in a direction. ratio_of is the stored size of a
+ * whole chunk for the ratio histogram, 0 to leave the histogram alone.
+ */
+static void stats_chunk(TurboPForDirectionStats *d, size_t bytes_in, size_t bytes_out,
+						size_t raw, size_t ratio_of, uint64_t start)
+{
+	if (start == 0)
+		return;
+	STAT_ADD(d->calls, 1);
+	STAT_ADD(d->bytes_in, bytes_in);
+	STAT_ADD(d->bytes_out, bytes_out);
+	if (ratio_of != 0)
 	{
-		void *old_buf = *buf;
-		switch (cd_values[0])
-		{
-		case ELEMENT_TYPE_SHORT:
-		{
-			n = m * sizeof(unsigned short);
-			// Allocate output buffer with padding for SIMD safety
-			out = (unsigned char *)malloc(CBUF(n) + 1024 * 1024);
+		unsigned int bin = 0;
+		// Bin k >= 1 holds ratios in [2^(k-1), 2^k), the last one everything above
+		while (bin < TURBOPFOR_RATIO_BINS - 1 && raw >= ratio_of << bin)
+			bin++;
+		STAT_ADD(d->ratio_histogram[bin], 1);
+	}
+	stats_lap(&d->total_ns, start);
+}
 
-			// Decode directly into the output buffer
-			p4nzdec128v16((unsigned char *)*buf, m, (uint16_t *)out);
-			
-            // Apply Delta Decoding in-place
-            short *short_p = (short *)out;
-			delta2d_decode(chunk0, chunk1, short_p);
-            
-			break;
-		}
-		default:
-			printf("Not supported data type yet !\n");
-			// goto error; // Commented out because 'error' label is not defined
-		}
+static void stats_error(TurboPForDirectionStats *d)
+{
+	if (stats_enabled())
+		STAT_ADD(d->errors, 1);
+}
 
-#ifdef DEBUG
-		t = clock() - t;
-		double time_taken = ((double)t) / CLOCKS_PER_SEC; // in seconds
-		printf("H5TurboPfor dec : cost %f seconds  \n", time_taken);
-#endif
-		if (old_buf != NULL)
-			free(old_buf);
-		*buf = out;
-		ret_value = n;
+/*
+ * cd_values[0] packs the element type with the encoding options:
+ *   bits  0-7 : DataElementType
+ *   bits  8-15: Predictor, ignored for the blocked layout
+ *   bits 16-23: Codec, ignored for the blocked layout
+ *   bits 24-27: OPTION_* flags
+ *   bits 28-31: sub-block size b; 0 stores the chunk as a single stream,
+ *               otherwise series are grouped in blocks of 2^(b-1) (see encode_blocked)
+ * Older files only ever stored the element type, so they decode unchanged.
+ */
+#define OPTION_TYPE(v) ((v) & 0xffu)
+#define OPTION_PREDICTOR(v) (((v) >> 8) & 0xffu)
+#define OPTION_CODEC(v) (((v) >> 16) & 0xffu)
+#define OPTION_BLOCK(v) (((v) >> 28) & 0xfu)
+#define OPTION_FLAGS(v) ((v) & 0x0f000000u)
+
+#define OPTION_MASK 0x01000000u /* store fill-value cells in a validity bitmap */
+
+#define MAX_DIMS 32 /* H5S_MAX_RANK */
+
+typedef struct FilterParams
+{
+	unsigned int type;      /* DataElementType */
+	unsigned int predictor; /* Predictor */
+	unsigned int codec;     /* Codec */
+	unsigned int options;   /* OPTION_* flags */
+	unsigned int ndim;
+	size_t dims[MAX_DIMS];
+	size_t m;             /* elements per chunk */
+	size_t length0;       /* rows of the 2D view: all chunk dimensions but the last */
+	size_t length1;       /* last chunk dimension */
+	size_t series_length; /* first chunk dimension; a series runs along it */
+	size_t block_series;  /* series per sub-block, 0 for a single stream */
+	double multiplier;    /* ELEMENT_TYPE_FLOAT: stored = round((value - offset) * multiplier) */
+	double offset;
+} FilterParams;
+
+/*
+ * Bit mask of the chunk axes a predictor takes deltas along, 0 for DELTA2D
+ * and for predictors that do not fit a chunk of ndim dimensions.
+ */
+static unsigned int predictor_axes(unsigned int predictor, unsigned int ndim)
+{
+	switch (predictor)
+	{
+	case PREDICTOR_LORENZO2D:
+		return ndim >= 2 ? 3u << (ndim - 2) : 0;
+	case PREDICTOR_LORENZO3D:
+		return ndim >= 3 ? 7u << (ndim - 3) : 0;
+	default:
+		if (predictor >= PREDICTOR_AXIS && predictor - PREDICTOR_AXIS < ndim)
+			return 1u << (predictor - PREDICTOR_AXIS);
+		return 0;
+	}
+}
+
+/**
+ * @brief decode cd_values into FilterParams
+ *
+ * All chunk dimensions except the last are folded into length0, the last one
+ * is length1. For ELEMENT_TYPE_FLOAT cd_values[1] and cd_values[2] hold the
+ * multiplier and offset as float32 bits and the dimensions start at cd_values[3].
+ *
+ * @return 0 on success, -1 if cd_values does not describe a chunk
+ */
+static int parse_params(size_t cd_nelmts, const unsigned int cd_values[], FilterParams *p)
+{
+	unsigned int block;
+	size_t first = 2;
+
+	if (cd_nelmts < 1)
+		return -1;
+	p->type = OPTION_TYPE(cd_values[0]);
+	p->predictor = OPTION_PREDICTOR(cd_values[0]);
+	p->codec = OPTION_CODEC(cd_values[0]);
+	p->options = OPTION_FLAGS(cd_values[0]);
+	p->multiplier = 1.0;
+	p->offset = 0.0;
+	if (p->type == ELEMENT_TYPE_FLOAT)
+	{
+		float v[2];
+		if (cd_nelmts < 3)
+			return -1;
+		memcpy(v, cd_values + 1, sizeof(v));
+		// 0 keeps the old meaning of cd_values[1]: multiply by 1
+		if (v[0] != 0.0f)
+			p->multiplier = v[0];
+		p->offset = v[1];
+		if (!isfinite(p->multiplier) || !isfinite(p->offset))
+			return -1;
+		first = 3;
+	}
+	if (cd_nelmts < first + 1 || cd_nelmts - first > MAX_DIMS)
+		return -1;
+	p->ndim = (unsigned int)(cd_nelmts - first);
+	p->m = 1;
+	p->length0 = 1;
+	for (size_t i = first; i < cd_nelmts; i++)
+	{
+		p->dims[i - first] = cd_values[i];
+		p->m = p->m * cd_values[i];
+		if (i < cd_nelmts - 1)
+			p->length0 = p->length0 * cd_values[i];
+	}
+	p->length1 = cd_values[cd_nelmts - 1];
+	p->series_length = cd_values[first];
+	block = OPTION_BLOCK(cd_values[0]);
+	p->block_series = block == 0 ? 0 : (size_t)1 << (block - 1);
+	if (p->m == 0)
+		return -1;
+	if (p->predictor != PREDICTOR_AUTO && predictor_axes(p->predictor, p->ndim) == 0 &&
+		p->predictor != PREDICTOR_DELTA2D)
+		return -1;
+	if (p->codec >= CODEC_COUNT && p->codec != CODEC_AUTO)
+		return -1;
+	return 0;
+}
+
+static size_t element_size(unsigned int type)
+{
+	switch (type)
+	{
+	case ELEMENT_TYPE_SHORT:
+	case ELEMENT_TYPE_USHORT:
+		return sizeof(short);
+	case ELEMENT_TYPE_INT:
+	case ELEMENT_TYPE_UINT:
+	case ELEMENT_TYPE_FLOAT:
+		return sizeof(int32_t);
+	default:
+		return 0;
+	}
+}
+
+/* The integer type a chunk is encoded as */
+static unsigned int storage_type(unsigned int type)
+{
+	return type == ELEMENT_TYPE_FLOAT ? ELEMENT_TYPE_INT : type;
+}
+
+/*
+ * Fixed-point quantization of ELEMENT_TYPE_FLOAT chunks, in place:
+ * round((value - offset) * multiplier) saturated to int32, NaN becomes the
+ * int32 fill value (INT32_MIN) so that mask mode can take it out.
+ */
+static int32_t quantize_value(const FilterParams *p, float value)
+{
+	double v = nearbyint(((double)value - p->offset) * p->multiplier);
+	if (isnan(v))
+		return INT32_MIN;
+	if (v >= (double)INT32_MAX)
+		return INT32_MAX;
+	if (v <= (double)(INT32_MIN + 1))
+		return INT32_MIN + 1;
+	return (int32_t)v;
+}
+
+static float dequantize_value(const FilterParams *p, int32_t value)
+{
+	return value == INT32_MIN ? NAN : (float)(value * (1.0 / p->multiplier) + p->offset);
+}
+
+static void quantize(const FilterParams *p, void *a, size_t n)
+{
+	const float *in = a;
+	int32_t *out = a;
+	for (size_t i = 0; i < n; i++)
+		out[i] = quantize_value(p, in[i]);
+}
+
+static void dequantize(const FilterParams *p, void *a)
+{
+	const int32_t *in = a;
+	float *out = a;
+	for (size_t i = 0; i < p->m; i++)
+		out[i] = dequantize_value(p, in[i]);
+}
+
+/* The fill value of mask mode: the minimum of signed and the maximum of unsigned types */
+static uint32_t fill_value(unsigned int type)
+{
+	switch (type)
+	{
+	case ELEMENT_TYPE_SHORT:
+		return 0x8000u;
+	case ELEMENT_TYPE_USHORT:
+		return 0xffffu;
+	case ELEMENT_TYPE_INT:
+		return 0x80000000u;
+	default:
+		return 0xffffffffu;
+	}
+}
+
+/* Bitmap row length: one row per index of the first chunk axis */
+static size_t mask_row_bits(const FilterParams *p)
+{
+	return p->ndim >= 2 ? p->m / p->series_length : p->m;
+}
+
+/* Builds the validity bitmap of a chunk and substitutes its fill cells in place */
+static size_t mask_encode(unsigned int type, void *a, size_t m, size_t row_bits, uint32_t *bitmap)
+{
+	if (element_size(type) == 2)
+		return mask_encode16(a, m, row_bits, (uint16_t)fill_value(type), bitmap);
+	return mask_encode32(a, m, row_bits, fill_value(type), bitmap);
+}
+
+/*
+ * Mask section: uint32_t length, uint32_t row_bits, then the bitmap rows each
+ * XORed with the row before, TurboRLE compressed unless that does not make
+ * them smaller (length == raw bitmap size). Destroys bitmap, returns the size
+ * of the section.
+ */
+static size_t write_mask(uint32_t *bitmap, size_t m, size_t row_bits, unsigned char *out)
+{
+	size_t row_words = bitmap_words(row_bits);
+	size_t words = mask_words(m, row_bits);
+	unsigned raw = (unsigned)(words * sizeof(uint32_t));
+	uint32_t header[2] = {0, (uint32_t)row_bits};
+	unsigned char *dst = out + sizeof(header);
+
+	for (size_t w = words; w-- > row_words;)
+		bitmap[w] ^= bitmap[w - row_words];
+	header[0] = trlec((const unsigned char *)bitmap, raw, dst);
+	if (header[0] == 0 || header[0] >= raw)
+	{
+		memcpy(dst, bitmap, raw);
+		header[0] = raw;
 	}
+	memcpy(out, header, sizeof(header));
+	return sizeof(header) + header[0];
+}
+
+/* Size of the mask section at in, 0 if it does not fit in nbytes */
+static size_t mask_size(const unsigned char *in, size_t nbytes)
+{
+	uint32_t header[2];
+	if (nbytes < sizeof(header))
+		return 0;
+	memcpy(header, in, sizeof(header));
+	if (header[1] == 0 || header[0] > nbytes - sizeof(header))
+		return 0;
+	return sizeof(header) + header[0];
+}
+
+/*
+ * Expands the mask section at in into a bitmap in scratch space.
+ * *row_bits receives the length of a bitmap row.
+ */
+static const uint32_t *read_mask(const unsigned char *in, size_t m, size_t *row_bits)
+{
+	uint32_t header[2];
+	size_t row_words, words;
+	unsigned raw;
+	uint32_t *bitmap;
+
+	memcpy(header, in, sizeof(header));
+	*row_bits = header[1];
+	row_words = bitmap_words(header[1]);
+	words = mask_words(m, header[1]);
+	raw = (unsigned)(words * sizeof(uint32_t));
+	bitmap = scratch_get(SCRATCH_MASK, raw + DECODE_PAD);
+	if (bitmap == NULL)
+		return NULL;
+	if (header[0] == raw)
+		memcpy(bitmap, in + sizeof(header), raw);
+	else
+		trled(in + sizeof(header), header[0], (unsigned char *)bitmap, raw);
+	for (size_t w = row_words; w < words; w++)
+		bitmap[w] ^= bitmap[w - row_words];
+	return bitmap;
+}
+
+/* Puts the fill value back into the cells of a decoded chunk whose bit is clear */
+static void mask_decode(unsigned int type, void *a, size_t m, size_t row_bits, const uint32_t *bitmap)
+{
+	if (element_size(type) == 2)
+		mask_decode16(a, m, row_bits, (uint16_t)fill_value(type), bitmap);
 	else
+		mask_decode32(a, m, row_bits, fill_value(type), bitmap);
+}
+
+/*
+ * Encode m elements held in work (modified in place by the delta step) into out.
+ * Returns the number of bytes written, 0 on error.
+ */
+static size_t encode_chunk(unsigned int type, size_t m, size_t length0, size_t length1,
+						   void *work, unsigned char *out)
+{
+	uint64_t t = stats_clock();
+	size_t l;
+
+	switch (type)
 	{
-		switch (cd_values[0])
-		{
-		case ELEMENT_TYPE_SHORT:
-		{
-			n = m * sizeof(unsigned short);
-			short *inbuf_short = *buf;
-			
-            // Apply Delta Encoding (In-Place)
-			delta2d_encode(chunk0, chunk1, inbuf_short);
+	case ELEMENT_TYPE_SHORT:
+	case ELEMENT_TYPE_USHORT:
+	{
+		// unsigned short wraps exactly like short, so both share one path
+		short *inbuf_short = work;
 
-#ifdef DEBUG
-			printf("Debug: decode A_n = %d, A[0, 1, 3]= %d, %d, %d\n", A_n, A[0], A[1], A[2]);
-#endif
+		// Apply Delta Encoding (In-Place)
+		delta2d_encode(length0, length1, inbuf_short);
+		t = stats_lap(&stats.encode.predict_ns, t);
+		l = p4nzenc128v16((uint16_t *)inbuf_short, m, out);
+		stats_lap(&stats.encode.codec_ns, t);
+		return l;
+	}
+	case ELEMENT_TYPE_INT:
+	case ELEMENT_TYPE_UINT:
+	{
+		uint32_t *inbuf_int = work;
 
-			out = (unsigned char *)malloc(CBUF(n) + 1024 * 1024);
-			l = p4nzenc128v16(inbuf_short, m, out);
-			break;
-		}
-		default:
-			printf("Not supported data type yet !\n");
-			goto error;
-		}
+		delta2d_encode32(length0, length1, inbuf_int);
+		t = stats_lap(&stats.encode.predict_ns, t);
+		l = p4nzenc128v32(inbuf_int, m, out);
+		stats_lap(&stats.encode.codec_ns, t);
+		return l;
+	}
+	default:
+		printf("Not supported data type yet !\n");
+		return 0;
+	}
+}
+
+/*
+ * Decode m elements from in into out, which must hold at least
+ * m * element_size(type) + DECODE_PAD bytes.
+ * Returns the number of raw bytes produced, 0 on error.
+ */
+static size_t decode_chunk(unsigned int type, size_t m, size_t length0, size_t length1,
+						   const unsigned char *in, void *out)
+{
+	uint64_t t = stats_clock();
+
+	switch (type)
+	{
+	case ELEMENT_TYPE_SHORT:
+	case ELEMENT_TYPE_USHORT:
+	{
+		// Decode directly into the output buffer
+		p4nzdec128v16((unsigned char *)in, m, (uint16_t *)out);
+		t = stats_lap(&stats.decode.codec_ns, t);
+
+		// Apply Delta Decoding in-place
+		delta2d_decode(length0, length1, (short *)out);
+		stats_lap(&stats.decode.predict_ns, t);
+		return m * sizeof(short);
+	}
+	case ELEMENT_TYPE_INT:
+	case ELEMENT_TYPE_UINT:
+	{
+		p4nzdec128v32((unsigned char *)in, m, (uint32_t *)out);
+		t = stats_lap(&stats.decode.codec_ns, t);
+		delta2d_decode32(length0, length1, (uint32_t *)out);
+		stats_lap(&stats.decode.predict_ns, t);
+		return m * sizeof(int32_t);
+	}
+	default:
+		printf("Not supported data type yet !\n");
+		return 0;
+	}
+}
+
+/* Apply (or undo) the per-axis deltas of a predictor in place */
+static void apply_predictor(const FilterParams *p, unsigned int predictor, void *data, int decode)
+{
+	unsigned int axes = predictor_axes(predictor, p->ndim);
+	size_t es = element_size(p->type);
+
+	for (unsigned int k = 0; k < p->ndim; k++)
+	{
+		size_t outer = 1, stride = 1;
+		if (!(axes & (1u << k)) || p->dims[k] <= 1)
+			continue;
+		for (unsigned int i = 0; i < k; i++)
+			outer *= p->dims[i];
+		for (unsigned int i = k + 1; i < p->ndim; i++)
+			stride *= p->dims[i];
+		if (es == 2 && decode)
+			axis_delta_decode16(data, outer, p->dims[k], stride);
+		else if (es == 2)
+			axis_delta_encode16(data, outer, p->dims[k], stride);
+		else if (decode)
+			axis_delta_decode32(data, outer, p->dims[k], stride);
+		else
+			axis_delta_encode32(data, outer, p->dims[k], stride);
+	}
+}
+
+/*
+ * Runtime CPU check, so one build only takes the AVX2 path on machines that
+ * have it. The result is cached; racing first calls store the same value.
+ */
+static int cpu_has_avx2(void)
+{
+	static int avx2 = -1;
+
+	if (avx2 < 0)
+	{
+#if (defined(__GNUC__) || defined(__clang__)) && (defined(__i386__) || defined(__x86_64__))
+		__builtin_cpu_init();
+		avx2 = __builtin_cpu_supports("avx2") ? 1 : 0;
+#elif defined(_MSC_VER) && (defined(_M_X64) || defined(_M_IX86))
+		int info[4];
+		__cpuid(info, 1);
+		// The OS must save the YMM registers (OSXSAVE, XCR0 bits 1-2)
+		if ((info[2] & (1 << 27)) && (_xgetbv(0) & 6) == 6)
+		{
+			__cpuidex(info, 7, 0);
+			avx2 = (info[1] & (1 << 5)) != 0;
+		}
+		else
+			avx2 = 0;
+#else
+		avx2 = 0;
+#endif
+	}
+	return avx2;
+}
+
+/* The codec actually used for a requested one on this machine */
+static unsigned int resolve_codec(unsigned int codec, size_t es)
+{
+	if (codec == CODEC_P4N256V && (es == 2 || !cpu_has_avx2()))
+		return CODEC_P4N128V;
+	return codec;
+}
+
+/* Entropy-code m zigzagged elements of size es. Returns the bytes written, 0 on error */
+static size_t codec_encode(unsigned int codec, size_t es, void *in, size_t m, unsigned char *out)
+{
+	switch (codec)
+	{
+	case CODEC_P4N128V:
+		return es == 2 ? p4nenc128v16(in, m, out) : p4nenc128v32(in, m, out);
+	case CODEC_P4N256V:
+		return p4nenc256v32(in, m, out);
+	case CODEC_VSIMPLE:
+		return (size_t)((es == 2 ? vsenc16(in, m, out) : vsenc32(in, m, out)) - out);
+	case CODEC_BITPACK:
+		return es == 2 ? bitnpack128v16(in, m, out) : bitnpack128v32(in, m, out);
+	case CODEC_TRLE:
+		return trlec(in, (unsigned)(m * es), out);
+	default:
+		return 0;
+	}
+}
+
+/* Inverse of codec_encode for the nbytes at in. Returns m * es, 0 on error */
+static size_t codec_decode(unsigned int codec, size_t es, const unsigned char *in, size_t nbytes,
+						   size_t m, void *out)
+{
+	unsigned char *src = (unsigned char *)in;
+
+	switch (codec)
+	{
+	case CODEC_P4N128V:
+		if (es == 2)
+			p4ndec128v16(src, m, out);
+		else
+			p4ndec128v32(src, m, out);
+		break;
+	case CODEC_P4N256V:
+		if (es == 2 || !cpu_has_avx2())
+		{
+			last_error = "chunk was written with the AVX2 codec p4n256v, which this CPU lacks";
+			return 0;
+		}
+		p4ndec256v32(src, m, out);
+		break;
+	case CODEC_VSIMPLE:
+		if (es == 2)
+			vsdec16(src, m, out);
+		else
+			vsdec32(src, m, out);
+		break;
+	case CODEC_BITPACK:
+		if (es == 2)
+			bitnunpack128v16(src, m, out);
+		else
+			bitnunpack128v32(src, m, out);
+		break;
+	case CODEC_TRLE:
+		if (trled(src, (unsigned)nbytes, out, (unsigned)(m * es)) == 0 && m != 0)
+			return 0;
+		break;
+	default:
+		return 0;
+	}
+	return m * es;
+}
+
+/*
+ * Encode a whole chunk held in work (overwritten) with one predictor and codec.
+ * Returns the number of bytes written, 0 on error.
+ */
+static size_t encode_predicted(const FilterParams *p, unsigned int predictor, unsigned int codec,
+							   void *work, unsigned char *out)
+{
+	size_t es = element_size(p->type);
+	uint64_t t;
+	size_t l;
+
+	if (predictor == PREDICTOR_DELTA2D && codec == CODEC_P4N128V)
+		return encode_chunk(p->type, p->m, p->length0, p->length1, work, out);
+
+	t = stats_clock();
+	if (predictor == PREDICTOR_DELTA2D && es == 2)
+		delta2d_encode(p->length0, p->length1, work);
+	else if (predictor == PREDICTOR_DELTA2D)
+		delta2d_encode32(p->length0, p->length1, work);
+	else
+		apply_predictor(p, predictor, work, 0);
+	if (es == 2)
+		zigzag_encode16(work, p->m);
+	else
+		zigzag_encode32(work, p->m);
+	t = stats_lap(&stats.encode.predict_ns, t);
+	l = codec_encode(codec, es, work, p->m, out);
+	stats_lap(&stats.encode.codec_ns, t);
+	return l;
+}
+
+/* Inverse of encode_predicted for the nbytes at in; out needs DECODE_PAD spare bytes */
+static size_t decode_predicted(const FilterParams *p, unsigned int type, unsigned int predictor,
+							   unsigned int codec, const unsigned char *in, size_t nbytes, void *out)
+{
+	size_t es = element_size(type);
+	uint64_t t;
+
+	if (predictor == PREDICTOR_DELTA2D && codec == CODEC_P4N128V)
+		return decode_chunk(type, p->m, p->length0, p->length1, in, out);
+	if ((predictor != PREDICTOR_DELTA2D && predictor_axes(predictor, p->ndim) == 0) || es == 0)
+		return 0;
+
+	t = stats_clock();
+	if (codec_decode(codec, es, in, nbytes, p->m, out) == 0)
+		return 0;
+	t = stats_lap(&stats.decode.codec_ns, t);
+	if (es == 2)
+		zigzag_decode16(out, p->m);
+	else
+		zigzag_decode32(out, p->m);
+	if (predictor == PREDICTOR_DELTA2D && es == 2)
+		delta2d_decode(p->length0, p->length1, out);
+	else if (predictor == PREDICTOR_DELTA2D)
+		delta2d_decode32(p->length0, p->length1, out);
+	else
+		apply_predictor(p, predictor, out, 1);
+	stats_lap(&stats.decode.predict_ns, t);
+	return p->m * es;
+}
+
+/*
+ * Encode with every predictor x codec pair of the candidate lists and keep the
+ * smallest result. src is preserved. Returns the size, the winner in *predictor
+ * and *codec.
+ */
+static size_t encode_best(const FilterParams *p, const void *src, unsigned char *out,
+						  const unsigned int *predictors, unsigned int npredictors,
+						  const unsigned int *codecs, unsigned int ncodecs,
+						  unsigned int *predictor, unsigned int *codec)
+{
+	size_t n = p->m * element_size(p->type);
+	size_t best = 0;
+	unsigned char *trial_out, *best_out = out;
+	void *trial;
+
+	trial = scratch_get(SCRATCH_TRIAL, n);
+	trial_out = scratch_get(SCRATCH_TRIAL_OUT, turbopfor_encode_bound(n));
+	if (trial == NULL || trial_out == NULL)
+		return 0;
+	for (unsigned int c = 0; c < npredictors * ncodecs; c++)
+	{
+		unsigned char *dst = best == 0 ? out : (best_out == out ? trial_out : out);
+		size_t l;
+
+		memcpy(trial, src, n);
+		l = encode_predicted(p, predictors[c / ncodecs], codecs[c % ncodecs], trial, dst);
+		if (l != 0 && (best == 0 || l < best))
+		{
+			best = l;
+			best_out = dst;
+			*predictor = predictors[c / ncodecs];
+			*codec = codecs[c % ncodecs];
+		}
+	}
+	if (best != 0 && best_out != out)
+		memcpy(out, best_out, best);
+	return best;
+}
+
+/*
+ * PREDICTOR_AUTO / CODEC_AUTO: pick the predictor with the default codec first,
+ * then the codec for that predictor, rather than trying every pair.
+ * src is preserved. Returns the size, the winners in *predictor and *codec.
+ */
+static size_t encode_auto(const FilterParams *p, const void *src, unsigned char *out,
+						  unsigned int *predictor, unsigned int *codec)
+{
+	unsigned int predictors[MAX_DIMS + 3], codecs[CODEC_COUNT];
+	unsigned int npredictors = 0, ncodecs = 0;
+	size_t es = element_size(p->type);
+	size_t l;
+
+	if (p->predictor == PREDICTOR_AUTO)
+	{
+		predictors[npredictors++] = PREDICTOR_DELTA2D;
+		for (unsigned int k = 0; k < p->ndim; k++)
+			if (p->dims[k] > 1)
+				predictors[npredictors++] = PREDICTOR_AXIS + k;
+		if (p->ndim >= 2)
+			predictors[npredictors++] = PREDICTOR_LORENZO2D;
+		if (p->ndim >= 3)
+			predictors[npredictors++] = PREDICTOR_LORENZO3D;
+	}
+	else
+		predictors[npredictors++] = p->predictor;
+	codecs[0] = p->codec == CODEC_AUTO ? CODEC_P4N128V : resolve_codec(p->codec, es);
+	l = encode_best(p, src, out, predictors, npredictors, codecs, 1, predictor, codec);
+	if (l == 0 || p->codec != CODEC_AUTO)
+		return l;
+
+	// P4N256V only decodes faster than P4N128V at about the same size, so it
+	// is used when asked for explicitly
+	predictors[0] = *predictor;
+	for (unsigned int c = 0; c < CODEC_COUNT; c++)
+		if (c != CODEC_P4N256V)
+			codecs[ncodecs++] = c;
+	return encode_best(p, src, out, predictors, 1, codecs, ncodecs, predictor, codec);
+}
+
+/*
+ * Blocked layout: the chunk is viewed as series_length x nseries, where a
+ * series is one column (e.g. the time series of one grid point in a time-major
+ * chunk). Consecutive series are grouped into sub-blocks that are delta and
+ * PFor encoded on their own, so one series can be decoded without the rest of
+ * the chunk and a large chunk can be decoded by several threads.
+ *
+ * Payload: BlockTable, uint32_t offsets[nblocks + 1] relative to the end of
+ * the offset table, then the sub-block streams.
+ */
+typedef struct BlockTable
+{
+	uint32_t nblocks;
+	uint32_t block_series; /* series per sub-block; the last one may hold fewer */
+	uint32_t length0;      /* values per series */
+	uint32_t nseries;
+} BlockTable;
+
+#define BLOCK_TABLE_SIZE 16
+
+/* Worst-case per-block PFor overhead on top of CBUF */
+#define BLOCK_SLACK 256
+
+/* Blocked chunks smaller than this are decoded on the calling thread only */
+#define PARALLEL_DECODE_MIN (1024 * 1024)
+
+static size_t block_count(const FilterParams *p)
+{
+	size_t nseries = p->m / p->series_length;
+	return (nseries + p->block_series - 1) / p->block_series;
+}
+
+static size_t encode_bound(const FilterParams *p)
+{
+	size_t bound = turbopfor_encode_bound(p->m * element_size(p->type));
+	if (p->options & OPTION_MASK)
+		bound += 2 * sizeof(uint32_t) + CBUF(mask_words(p->m, mask_row_bits(p)) * sizeof(uint32_t));
+	if (p->block_series != 0)
+		bound += BLOCK_TABLE_SIZE + (block_count(p) + 1) * (sizeof(uint32_t) + BLOCK_SLACK);
+	return bound;
+}
+
+/* Encode a chunk in the blocked layout; in is left untouched */
+static size_t encode_blocked(const FilterParams *p, const void *in, unsigned char *out)
+{
+	size_t es = element_size(p->type);
+	size_t length0 = p->series_length;
+	size_t nseries = p->m / length0;
+	size_t nblocks = block_count(p);
+	unsigned char *offsets = out + BLOCK_TABLE_SIZE;
+	unsigned char *payload = offsets + (nblocks + 1) * sizeof(uint32_t);
+	unsigned char *block;
+	BlockTable t;
+	uint32_t pos = 0;
+
+	block = scratch_get(SCRATCH_BLOCK, length0 * p->block_series * es);
+	if (block == NULL)
+		return 0;
+	for (size_t b = 0; b < nblocks; b++)
+	{
+		size_t first = b * p->block_series;
+		size_t width = min(p->block_series, nseries - first);
+		size_t l;
+
+		// Gather the columns of this block into a contiguous length0 x width array
+		for (size_t r = 0; r < length0; r++)
+			memcpy(block + r * width * es, (const unsigned char *)in + (r * nseries + first) * es, width * es);
+		l = encode_chunk(p->type, length0 * width, length0, width, block, payload + pos);
+		if (l == 0)
+			return 0;
+		memcpy(offsets + b * sizeof(uint32_t), &pos, sizeof(uint32_t));
+		pos += (uint32_t)l;
+	}
+	memcpy(offsets + nblocks * sizeof(uint32_t), &pos, sizeof(uint32_t));
+
+	t.nblocks = (uint32_t)nblocks;
+	t.block_series = (uint32_t)p->block_series;
+	t.length0 = (uint32_t)length0;
+	t.nseries = (uint32_t)nseries;
+	memcpy(out, &t, BLOCK_TABLE_SIZE);
+	return (size_t)(payload - out) + pos;
+}
+
+/*
+ * Validate the BlockTable at the start of a blocked payload of nbytes.
+ * Returns a pointer to the offset table, NULL if the table is inconsistent.
+ */
+static const unsigned char *read_block_table(const unsigned char *in, size_t nbytes, size_t m,
+											 BlockTable *t)
+{
+	uint32_t end;
+	size_t table_size;
+
+	if (nbytes < BLOCK_TABLE_SIZE)
+		return NULL;
+	memcpy(t, in, BLOCK_TABLE_SIZE);
+	if (t->block_series == 0 || t->nblocks == 0 || (size_t)t->length0 * t->nseries != m ||
+		t->nblocks != (t->nseries + t->block_series - 1) / t->block_series)
+		return NULL;
+	table_size = BLOCK_TABLE_SIZE + ((size_t)t->nblocks + 1) * sizeof(uint32_t);
+	if (nbytes < table_size)
+		return NULL;
+	memcpy(&end, in + table_size - sizeof(uint32_t), sizeof(uint32_t));
+	if (end > nbytes - table_size)
+		return NULL;
+	return in + BLOCK_TABLE_SIZE;
+}
+
+/*
+ * Decode sub-block b into out as a contiguous length0 x width array; out needs
+ * DECODE_PAD spare bytes. Returns the number of raw bytes produced, 0 on error.
+ */
+static size_t decode_block(unsigned int type, const BlockTable *t, const unsigned char *offsets,
+						   size_t b, void *out)
+{
+	const unsigned char *payload = offsets + ((size_t)t->nblocks + 1) * sizeof(uint32_t);
+	size_t first = b * t->block_series;
+	size_t width = min(t->block_series, t->nseries - first);
+	uint32_t pos;
+
+	memcpy(&pos, offsets + b * sizeof(uint32_t), sizeof(uint32_t));
+	return decode_chunk(type, t->length0 * width, t->length0, width, payload + pos, out);
+}
+
+/* Decode a whole blocked payload into out (raw chunk layout, DECODE_PAD spare bytes) */
+static size_t decode_blocked(unsigned int type, size_t m, const unsigned char *in, size_t nbytes,
+							 void *out)
+{
+	size_t es = element_size(type);
+	const unsigned char *offsets;
+	BlockTable t;
+	int failed = 0;
+
+	offsets = read_block_table(in, nbytes, m, &t);
+	if (offsets == NULL)
+		return 0;
+
+#ifdef _OPENMP
+#pragma omp parallel reduction(| : failed) if (t.nblocks > 1 && m * es >= PARALLEL_DECODE_MIN)
+#endif
+	{
+#ifdef _OPENMP
+#pragma omp for schedule(dynamic)
+#endif
+		for (long b = 0; b < (long)t.nblocks; b++)
+		{
+			size_t first = (size_t)b * t.block_series;
+			size_t width = min(t.block_series, t.nseries - first);
+			unsigned char *block = scratch_get(SCRATCH_BLOCK, t.length0 * width * es + DECODE_PAD);
+
+			if (block == NULL || decode_block(type, &t, offsets, (size_t)b, block) == 0)
+			{
+				failed |= 1;
+				continue;
+			}
+			// Scatter the block's columns back into the chunk
+			for (size_t r = 0; r < t.length0; r++)
+				memcpy((unsigned char *)out + (r * t.nseries + first) * es, block + r * width * es, width * es);
+		}
+		// OpenMP workers outlive the call and never pass through an entry point
+		scratch_trim();
+	}
+	return failed ? 0 : m * es;
+}
+
+/*
+ * Writes the header and the encoded payload. work is overwritten unless the
+ * chunk is blocked or the predictor is chosen automatically, mask mode is off
+ * and the type is not float.
+ */
+static size_t encode_with_header(const FilterParams *p, void *work, unsigned char *out)
+{
+	unsigned int type = p->type;
+	unsigned int predictor = p->predictor;
+	unsigned int codec = resolve_codec(p->codec, element_size(type));
+	unsigned int flags = 0;
+	size_t pos = HEADER_SIZE;
+	FilterParams quantized;
+	size_t l;
+
+	if (type == ELEMENT_TYPE_FLOAT)
+	{
+		quantize(p, work, p->m);
+		quantized = *p;
+		quantized.type = storage_type(type);
+		p = &quantized;
+	}
+
+	if (p->options & OPTION_MASK)
+	{
+		size_t row_bits = mask_row_bits(p);
+		uint32_t *bitmap = scratch_get(SCRATCH_MASK, mask_words(p->m, row_bits) * sizeof(uint32_t));
+		if (bitmap == NULL)
+			return 0;
+		// Chunks without fill cells are stored exactly as without mask mode
+		if (mask_encode(p->type, work, p->m, row_bits, bitmap) > 0)
+		{
+			pos += write_mask(bitmap, p->m, row_bits, out + pos);
+			flags |= CHUNK_MASKED;
+		}
+	}
+
+	if (p->block_series != 0)
+	{
+		// Sub-blocks always delta along the series axis and use P4N128V
+		predictor = PREDICTOR_DELTA2D;
+		codec = CODEC_P4N128V;
+		flags |= CHUNK_BLOCKED;
+		l = encode_blocked(p, work, out + pos);
+	}
+	else if (predictor == PREDICTOR_AUTO || codec == CODEC_AUTO)
+		l = encode_auto(p, work, out + pos, &predictor, &codec);
+	else
+		l = encode_predicted(p, predictor, codec, work, out + pos);
+	if (l == 0)
+		return 0;
+	write_header(out, type, predictor, codec, p->m, p->m * element_size(type), flags);
+	return pos + l;
+}
+
+/* Size of a chunk whose elements are all equal: the header and one element */
+#define CONSTANT_CHUNK_SIZE (HEADER_SIZE + sizeof(uint32_t))
+
+/*
+ * Chunks whose elements are all equal (typically all fill value) are stored as
+ * the header and that element. Float chunks are compared after quantization
+ * and store the dequantized element, so they read back like any other chunk.
+ * Returns the size written to out, or 0 if the chunk in is not uniform; the
+ * scan stops at the first differing element.
+ */
+static size_t encode_constant(const FilterParams *p, const void *in, unsigned char *out)
+{
+	size_t es = element_size(p->type);
+	size_t i;
+
+	if (p->type == ELEMENT_TYPE_FLOAT)
+	{
+		const float *a = in;
+		int32_t q = quantize_value(p, a[0]);
+		float v;
+		for (i = 1; i < p->m && quantize_value(p, a[i]) == q; i++)
+			;
+		if (i < p->m)
+			return 0;
+		v = dequantize_value(p, q);
+		memcpy(out + HEADER_SIZE, &v, es);
+	}
+	else
+	{
+		if (es == 2)
+		{
+			const uint16_t *a = in;
+			for (i = 1; i < p->m && a[i] == a[0]; i++)
+				;
+		}
+		else
+		{
+			const uint32_t *a = in;
+			for (i = 1; i < p->m && a[i] == a[0]; i++)
+				;
+		}
+		if (i < p->m)
+			return 0;
+		memcpy(out + HEADER_SIZE, in, es);
+	}
+	write_header(out, p->type, PREDICTOR_DELTA2D, CODEC_P4N128V, p->m, p->m * es, CHUNK_CONSTANT);
+	return HEADER_SIZE + es;
+}
+
+/* Fills m elements of out with the element stored after the header */
+static size_t decode_constant(unsigned int type, size_t m, const unsigned char *payload,
+							  size_t nbytes, void *out)
+{
+	size_t es = element_size(type);
+
+	if (nbytes < es)
+		return 0;
+	if (es == 2)
+	{
+		uint16_t v, *a = out;
+		memcpy(&v, payload, es);
+		for (size_t i = 0; i < m; i++)
+			a[i] = v;
+	}
+	else
+	{
+		uint32_t v, *a = out;
+		memcpy(&v, payload, es);
+		for (size_t i = 0; i < m; i++)
+			a[i] = v;
+	}
+	return m * es;
+}
+
+/*
+ * Segmented layout, written by turbopfor_append: rows along the first chunk
+ * axis are appended as segments without touching the stored ones. Each segment
+ * holds the deltas of its rows along that axis, its first row relative to the
+ * last row of the previous segment, zigzagged and P4N128V encoded. Rows after
+ * the last segment decode as the fill value.
+ *
+ * Payload: SegmentTable, uint32_t rows[nsegments], uint32_t bytes[nsegments],
+ * the last stored row as raw elements (the base of the next segment's deltas),
+ * then the segment streams.
+ */
+typedef struct SegmentTable
+{
+	uint32_t nsegments;
+	uint32_t rows; /* rows stored so far, the sum of the segment rows */
+} SegmentTable;
+
+#define SEGMENT_TABLE_SIZE 8
+
+/* Entry i of the uint32_t array at a, which need not be aligned */
+static uint32_t read_u32(const unsigned char *a, size_t i)
+{
+	uint32_t v;
+	memcpy(&v, a + i * sizeof(v), sizeof(v));
+	return v;
+}
+
+/*
+ * Parses the segment table at in; *lengths receives the rows and bytes arrays.
+ * Returns the offset of the first stream, 0 if the table does not fit nbytes or
+ * does not match a chunk of p's shape.
+ */
+static size_t read_segment_table(const FilterParams *p, size_t es, const unsigned char *in,
+								 size_t nbytes, SegmentTable *t, const unsigned char **lengths)
+{
+	size_t row = p->m / p->series_length;
+	size_t pos, rows = 0, total = 0;
+
+	if (nbytes < SEGMENT_TABLE_SIZE)
+		return 0;
+	memcpy(t, in, SEGMENT_TABLE_SIZE);
+	if (t->nsegments == 0 || t->rows > p->series_length ||
+		t->nsegments > (nbytes - SEGMENT_TABLE_SIZE) / (2 * sizeof(uint32_t)))
+		return 0;
+	pos = SEGMENT_TABLE_SIZE + 2 * sizeof(uint32_t) * t->nsegments + row * es;
+	if (pos > nbytes)
+		return 0;
+	*lengths = in + SEGMENT_TABLE_SIZE;
+	for (uint32_t s = 0; s < t->nsegments; s++)
+	{
+		rows += read_u32(*lengths, s);
+		total += read_u32(*lengths, t->nsegments + s);
+	}
+	if (rows != t->rows || total > nbytes - pos)
+		return 0;
+	return pos;
+}
+
+/* Decode a segmented payload into out, which has DECODE_PAD spare bytes */
+static size_t decode_segmented(const FilterParams *p, unsigned int type, const unsigned char *payload,
+							   size_t nbytes, void *out)
+{
+	size_t es = element_size(type);
+	size_t row = p->m / p->series_length;
+	size_t pos, r0 = 0;
+	const unsigned char *lengths;
+	SegmentTable t;
+	unsigned char *dst = out;
+
+	pos = read_segment_table(p, es, payload, nbytes, &t, &lengths);
+	if (pos == 0)
+		return 0;
+	for (uint32_t s = 0; s < t.nsegments; s++)
+	{
+		size_t k = read_u32(lengths, s), size = read_u32(lengths, t.nsegments + s);
+		if (k == 0)
+			continue;
+		if (codec_decode(CODEC_P4N128V, es, payload + pos, size, k * row, dst + r0 * row * es) == 0)
+			return 0;
+		// Undo the deltas, continuing from the last row of the previous segment
+		if (es == 2)
+		{
+			zigzag_decode16((uint16_t *)(dst + r0 * row * es), k * row);
+			axis_delta_decode16((uint16_t *)(dst + (r0 > 0 ? r0 - 1 : 0) * row * es), 1,
+								r0 > 0 ? k + 1 : k, row);
+		}
+		else
+		{
+			zigzag_decode32((uint32_t *)(dst + r0 * row * es), k * row);
+			axis_delta_decode32((uint32_t *)(dst + (r0 > 0 ? r0 - 1 : 0) * row * es), 1,
+								r0 > 0 ? k + 1 : k, row);
+		}
+		pos += size;
+		r0 += k;
+	}
+	if (es == 2)
+		for (size_t i = r0 * row; i < p->m; i++)
+			((uint16_t *)out)[i] = (uint16_t)fill_value(type);
+	else
+		for (size_t i = r0 * row; i < p->m; i++)
+			((uint32_t *)out)[i] = fill_value(type);
+	return p->m * es;
+}
+
+/* Decode the payload described by h into out, which has DECODE_PAD spare bytes */
+static size_t decode_with_header(const FilterParams *p, const ChunkHeader *h,
+								 const unsigned char *payload, size_t nbytes, void *out)
+{
+	const unsigned char *mask = NULL;
+	const uint32_t *bitmap;
+	unsigned int type = storage_type(h->type);
+	size_t n, row_bits;
+
+	if (h->flags & CHUNK_CONSTANT)
+		return decode_constant(h->type, p->m, payload, nbytes, out);
+	if (h->type == ELEMENT_TYPE_FLOAT && p->type != ELEMENT_TYPE_FLOAT)
+		return 0; // quantization parameters are missing
+	if (h->flags & CHUNK_MASKED)
+	{
+		size_t size = mask_size(payload, nbytes);
+		if (size == 0)
+			return 0;
+		mask = payload;
+		payload += size;
+		nbytes -= size;
+	}
+
+	if (h->flags & CHUNK_BLOCKED)
+		n = decode_blocked(type, p->m, payload, nbytes, out);
+	else if (h->flags & CHUNK_SEGMENTED)
+		n = decode_segmented(p, type, payload, nbytes, out);
+	else
+		n = decode_predicted(p, type, h->predictor, h->codec, payload, nbytes, out);
+
+	if (n != 0 && mask != NULL)
+	{
+		bitmap = read_mask(mask, p->m, &row_bits);
+		if (bitmap == NULL)
+			return 0;
+		mask_decode(type, out, p->m, row_bits, bitmap);
+	}
+	if (n != 0 && h->type == ELEMENT_TYPE_FLOAT)
+		dequantize(p, out);
+	return n;
+}
+
+/*
+ * Work out the element type and raw size of a stored chunk and locate its payload.
+ * Returns the payload offset, or -1 if the chunk does not match the parameters.
+ */
+static long chunk_layout(const FilterParams *p, const unsigned char *in, size_t nbytes,
+						 ChunkHeader *h)
+{
+	size_t offset = read_header(in, nbytes, h);
+
+	if (offset == 0)
+	{
+		// Legacy chunk: everything comes from cd_values
+		write_header((unsigned char *)h, p->type, PREDICTOR_DELTA2D, CODEC_P4N128V, p->m,
+					 p->m * element_size(p->type), 0);
+	}
+	if (h->nelem != p->m || element_size(h->type) == 0 || h->raw_size != p->m * element_size(h->type))
+		return -1;
+	return (long)offset;
+}
+
+DLL_EXPORT size_t turbopfor_encode_bound(size_t nbytes)
+{
+	return HEADER_SIZE + CBUF(nbytes) + 1024 * 1024;
+}
+
+DLL_EXPORT size_t turbopfor_decode_bound(size_t nbytes)
+{
+	return nbytes + DECODE_PAD;
+}
+
+static size_t encode_buffer(size_t cd_nelmts, const unsigned int cd_values[],
+							const void *in, size_t nbytes, void *out, size_t out_size)
+{
+	FilterParams p;
+	unsigned char *dst;
+	void *work;
+	size_t l;
+
+	if (parse_params(cd_nelmts, cd_values, &p) < 0)
+		return 0;
+	if (p.m * element_size(p.type) != nbytes || out_size < turbopfor_encode_bound(nbytes))
+		return 0;
+	l = encode_constant(&p, in, out);
+	if (l != 0)
+		return l;
+
+	if ((p.block_series != 0 || p.predictor == PREDICTOR_AUTO || p.codec == CODEC_AUTO) &&
+		!(p.options & OPTION_MASK) &&
+		p.type != ELEMENT_TYPE_FLOAT)
+	{
+		// Blocks and candidates are copied into scratch space, in is only read
+		work = (void *)in;
+	}
+	else
+	{
+		// The delta step works in place, so never touch the caller's data
+		work = scratch_get(SCRATCH_WORK, nbytes);
+		if (work == NULL)
+			return 0;
+		memcpy(work, in, nbytes);
+	}
+
+	// Many tiny sub-blocks can exceed the generic bound, so go through scratch then
+	dst = out_size >= encode_bound(&p) ? out : scratch_get(SCRATCH_OUT, encode_bound(&p));
+	if (dst == NULL)
+		return 0;
+	l = encode_with_header(&p, work, dst);
+	if (dst != out)
+	{
+		if (l > out_size)
+			return 0;
+		memcpy(out, dst, l);
+	}
+	return l;
+}
+
+DLL_EXPORT size_t turbopfor_encode(size_t cd_nelmts, const unsigned int cd_values[],
+								   const void *in, size_t nbytes, void *out, size_t out_size)
+{
+	uint64_t start = stats_clock();
+	size_t l = encode_buffer(cd_nelmts, cd_values, in, nbytes, out, out_size);
+
+	scratch_trim();
+	if (l == 0)
+		stats_error(&stats.encode);
+	else
+		stats_chunk(&stats.encode, nbytes, l, nbytes, l, start);
+	return l;
+}
+
+static size_t decode_buffer(size_t cd_nelmts, const unsigned int cd_values[],
+							const void *in, size_t nbytes, void *out, size_t out_size)
+{
+	const unsigned char *src = in;
+	FilterParams p;
+	ChunkHeader h;
+	long offset;
+	size_t n;
+	void *tmp;
+
+	if (parse_params(cd_nelmts, cd_values, &p) < 0)
+		return 0;
+	offset = chunk_layout(&p, src, nbytes, &h);
+	if (offset < 0)
+		return 0;
+	n = h.raw_size;
+	if (out_size < n)
+		return 0;
+	if (out_size >= turbopfor_decode_bound(n))
+		return decode_with_header(&p, &h, src + offset, nbytes - offset, out);
+
+	// The caller's buffer has no room for the decoder overrun
+	tmp = scratch_get(SCRATCH_WORK, turbopfor_decode_bound(n));
+	if (tmp == NULL)
+		return 0;
+	n = decode_with_header(&p, &h, src + offset, nbytes - offset, tmp);
+	memcpy(out, tmp, n);
+	return n;
+}
+
+/*
+ * Appends nrows rows to the chunk of nbytes at chunk (none if nbytes is 0) as a
+ * new segment. A segmented chunk must hold exactly start_row rows. Other chunks
+ * are converted once: their first start_row rows (fill values for no chunk)
+ * become the first segment together with the new rows.
+ * Returns the size written to out, 0 on error.
+ */
+static size_t append_segment(const FilterParams *p, const unsigned char *chunk, size_t nbytes,
+							 size_t start_row, const void *rows, size_t nrows, unsigned char *out)
+{
+	unsigned int type = storage_type(p->type);
+	size_t es = element_size(type);
+	size_t row = p->m / p->series_length, row_bytes = row * es;
+	size_t nbase = 0, nold = 0, old_size = 0, pos, l;
+	const unsigned char *lengths = NULL, *streams = NULL;
+	unsigned char *work, *decoded, *last;
+	SegmentTable t;
+
+	if (nrows == 0 || start_row + nrows > p->series_length)
+		return 0;
+	// Row 0 of work is the base of the deltas, the segment's rows follow
+	work = scratch_get(SCRATCH_WORK, (p->series_length + 1) * row_bytes);
+	if (work == NULL)
+		return 0;
+	memset(work, 0, row_bytes);
+
+	if (nbytes == 0)
+	{
+		nbase = start_row;
+		for (size_t i = row; i < (nbase + 1) * row; i++)
+			if (es == 2)
+				((uint16_t *)work)[i] = (uint16_t)fill_value(type);
+			else
+				((uint32_t *)work)[i] = fill_value(type);
+	}
+	else
+	{
+		ChunkHeader h;
+		long offset = chunk_layout(p, chunk, nbytes, &h);
+		if (offset < 0)
+			return 0;
+		if (h.flags & CHUNK_SEGMENTED)
+		{
+			size_t first = read_segment_table(p, es, chunk + offset, nbytes - offset, &t, &lengths);
+			if (first == 0 || t.rows != start_row)
+				return 0;
+			nold = t.nsegments;
+			for (size_t s = 0; s < nold; s++)
+				old_size += read_u32(lengths, nold + s);
+			memcpy(work, chunk + offset + first - row_bytes, row_bytes);
+			streams = chunk + offset + first;
+		}
+		else
+		{
+			FilterParams stored = *p;
+			ChunkHeader h_stored = h;
+			decoded = scratch_get(SCRATCH_TRIAL, turbopfor_decode_bound(p->m * es));
+			if (decoded == NULL)
+				return 0;
+			if (h.flags & CHUNK_CONSTANT)
+			{
+				// Float constant chunks keep the raw value, quantize it like a new row
+				if (decode_constant(h.type, p->m, chunk + offset, nbytes - offset, decoded) == 0)
+					return 0;
+				if (h.type == ELEMENT_TYPE_FLOAT)
+					quantize(p, decoded, start_row * row);
+			}
+			else
+			{
+				// Take the stored integers as they are, without a dequantize round trip
+				stored.type = type;
+				h_stored.type = (uint8_t)storage_type(h.type);
+				if (decode_with_header(&stored, &h_stored, chunk + offset, nbytes - offset, decoded) == 0)
+					return 0;
+			}
+			nbase = start_row;
+			memcpy(work + row_bytes, decoded, nbase * row_bytes);
+		}
+	}
+	memcpy(work + (nbase + 1) * row_bytes, rows, nrows * row_bytes);
+	if (p->type == ELEMENT_TYPE_FLOAT)
+		quantize(p, work + (nbase + 1) * row_bytes, nrows * row);
+
+	// Header, table, the new last row, the stored streams, then the new stream
+	pos = HEADER_SIZE + SEGMENT_TABLE_SIZE + 2 * sizeof(uint32_t) * (nold + 1);
+	last = work + (nbase + nrows) * row_bytes;
+	memcpy(out + pos, last, row_bytes);
+	pos += row_bytes;
+	if (old_size != 0)
+		memcpy(out + pos, streams, old_size);
+	pos += old_size;
+
+	if (es == 2)
+	{
+		axis_delta_encode16((uint16_t *)work, 1, nbase + nrows + 1, row);
+		zigzag_encode16((uint16_t *)(work + row_bytes), (nbase + nrows) * row);
+	}
+	else
+	{
+		axis_delta_encode32((uint32_t *)work, 1, nbase + nrows + 1, row);
+		zigzag_encode32((uint32_t *)(work + row_bytes), (nbase + nrows) * row);
+	}
+	l = codec_encode(CODEC_P4N128V, es, work + row_bytes, (nbase + nrows) * row, out + pos);
+	if (l == 0 || l > UINT32_MAX)
+		return 0;
+
+	t.nsegments = (uint32_t)(nold + 1);
+	t.rows = (uint32_t)(start_row + nrows);
+	memcpy(out + HEADER_SIZE, &t, SEGMENT_TABLE_SIZE);
+	for (size_t s = 0; s <= nold; s++)
+	{
+		uint32_t k = s < nold ? read_u32(lengths, s) : (uint32_t)(nbase + nrows);
+		uint32_t size = s < nold ? read_u32(lengths, nold + s) : (uint32_t)l;
+		memcpy(out + HEADER_SIZE + SEGMENT_TABLE_SIZE + s * sizeof(uint32_t), &k, sizeof(k));
+		memcpy(out + HEADER_SIZE + SEGMENT_TABLE_SIZE + (nold + 1 + s) * sizeof(uint32_t), &size,
+			   sizeof(size));
+	}
+	write_header(out, p->type, PREDICTOR_AXIS, CODEC_P4N128V, p->m, p->m * element_size(p->type),
+				 CHUNK_SEGMENTED);
+	return pos + l;
+}
+
+DLL_EXPORT size_t turbopfor_append_bound(size_t nbytes, size_t raw_size)
+{
+	// The new stream, a table entry, and for a converted chunk the last row
+	return nbytes + turbopfor_encode_bound(raw_size) + raw_size;
+}
+
+DLL_EXPORT size_t turbopfor_append(size_t cd_nelmts, const unsigned int cd_values[],
+								   const void *chunk, size_t nbytes, size_t start_row,
+								   const void *rows, size_t nrows, void *out, size_t out_size)
+{
+	uint64_t start = stats_clock();
+	FilterParams p;
+	size_t l = 0;
+
+	if (parse_params(cd_nelmts, cd_values, &p) == 0 &&
+		out_size >= turbopfor_append_bound(nbytes, p.m * element_size(p.type)))
+		l = append_segment(&p, chunk, nbytes, start_row, rows, nrows, out);
+	scratch_trim();
+	if (l == 0)
+		stats_error(&stats.encode);
+	else
+		stats_chunk(&stats.encode, nrows * (p.m / p.series_length) * element_size(p.type), l, 0, 0,
+					start);
+	return l;
+}
+
+DLL_EXPORT size_t turbopfor_decode(size_t cd_nelmts, const unsigned int cd_values[],
+								   const void *in, size_t nbytes, void *out, size_t out_size)
+{
+	uint64_t start = stats_clock();
+	size_t n = decode_buffer(cd_nelmts, cd_values, in, nbytes, out, out_size);
+
+	scratch_trim();
+	if (n == 0)
+		stats_error(&stats.decode);
+	else
+		stats_chunk(&stats.decode, nbytes, n, n, nbytes, start);
+	return n;
+}
+
+static size_t decode_sub_block(const void *chunk, size_t nbytes, size_t block,
+							   void *out, size_t out_size)
+{
+	const unsigned char *src = chunk;
+	const unsigned char *offsets, *mask = NULL;
+	size_t pos = HEADER_SIZE;
+	ChunkHeader h;
+	BlockTable t;
+	size_t es, n, width, first;
+	unsigned char *dst;
+	unsigned int type;
+
+	if (read_header(src, nbytes, &h) == 0 || !(h.flags & CHUNK_BLOCKED))
+		return 0;
+	// Float chunks come back quantized, the multiplier and offset are in cd_values
+	type = storage_type(h.type);
+	if (h.flags & CHUNK_MASKED)
+	{
+		size_t size = mask_size(src + pos, nbytes - pos);
+		if (size == 0)
+			return 0;
+		mask = src + pos;
+		pos += size;
+	}
+	es = element_size(type);
+	offsets = read_block_table(src + pos, nbytes - pos, h.nelem, &t);
+	if (es == 0 || offsets == NULL || block >= t.nblocks)
+		return 0;
+	first = block * t.block_series;
+	width = min(t.block_series, t.nseries - first);
+	n = t.length0 * width * es;
+	if (out_size < n)
+		return 0;
+
+	dst = out_size >= turbopfor_decode_bound(n) ? out : scratch_get(SCRATCH_BLOCK, turbopfor_decode_bound(n));
+	if (dst == NULL || decode_block(type, &t, offsets, block, dst) == 0)
+		return 0;
+	if (mask != NULL)
+	{
+		size_t row_bits;
+		const uint32_t *bitmap = read_mask(mask, h.nelem, &row_bits);
+		uint32_t fill = fill_value(type);
+		if (bitmap == NULL)
+			return 0;
+		for (size_t r = 0; r < t.length0; r++)
+		{
+			for (size_t c = 0; c < width; c++)
+			{
+				size_t i = r * t.nseries + first + c;
+				if (TestBit(bitmap + i / row_bits * bitmap_words(row_bits), i % row_bits))
+					continue;
+				if (es == 2)
+					((uint16_t *)dst)[r * width + c] = (uint16_t)fill;
+				else
+					((uint32_t *)dst)[r * width + c] = fill;
+			}
+		}
+	}
+	if (dst != out)
+		memcpy(out, dst, n);
+	return n;
+}
+
+DLL_EXPORT size_t turbopfor_decode_block(const void *chunk, size_t nbytes, size_t block,
+										 void *out, size_t out_size)
+{
+	uint64_t start = stats_clock();
+	size_t n = decode_sub_block(chunk, nbytes, block, out, out_size);
+
+	scratch_trim();
+	// Only part of the chunk is decoded, so this stays out of the ratio histogram
+	if (n == 0)
+		stats_error(&stats.decode);
+	else
+		stats_chunk(&stats.decode, nbytes, n, n, 0, start);
+	return n;
+}
+
+DLL_EXPORT void turbopfor_stats_get(TurboPForStats *out)
+{
+	memcpy(out, &stats, sizeof(stats));
+}
+
+DLL_EXPORT void turbopfor_stats_reset(void)
+{
+	memset(&stats, 0, sizeof(stats));
+}
+
+DLL_EXPORT int turbopfor_stats_enable(int enable)
+{
+	int previous = stats_enabled();
+	stats_state = enable != 0;
+	return previous;
+}
+
+/**
+ * @brief the filter for Turbopfor
+ *
+ * @param flags : is set by HDF5 for decompress or compress
+ * @param cd_nelmts: the # of values in  cd_values
+ * @param cd_values: the pointer of the parameter
+ * 			cd_values[0]: type of data:  short (0), unsigned short (1),
+ * 			              int (2), unsigned int (3), float (4)
+ * 			              bits 8-15: predictor, see OPTION_PREDICTOR
+ * 			              bits 16-23: entropy codec, see OPTION_CODEC
+ * 			              bits 24-27: OPTION_MASK
+ * 			              bits 28-31: sub-block size, see OPTION_BLOCK
+ *          cd_values[1]: ignored for integer types; for float the
+ *                        multiplier as float32 bits (0: multiply by 1)
+ *          cd_values[2]: float only: the offset as float32 bits. Floats are
+ *                        stored as round((value - offset) * multiplier),
+ *                        NaN as the fill value of mask mode
+ *
+ *          cd_values[2, -] (cd_values[3, -] for float): size of each dimension of a chunk
+ * @param nbytes : input data size
+ * @param buf_size : output data size
+ * @param buf : the pointer to data buffer
+ * @return size_t
+ */
+DLL_EXPORT size_t turbopfor_filter(unsigned int flags, size_t cd_nelmts,
+								   const unsigned int cd_values[], size_t nbytes,
+								   size_t *buf_size, void **buf)
+{
+
+	size_t ret_value = 0;
+#ifdef DEBUG
+	printf("cd_nelmts = %zu, cd_values = ", cd_nelmts);
+	for (int i = 0; i < cd_nelmts; i++)
+	{
+		printf("%d , ", cd_values[i]);
+	}
+	printf("\n");
+#endif
+
+	FilterParams p;
+	size_t n, l;
+	unsigned char *out;
+	uint64_t start = stats_clock();
+#ifdef DEBUG
+	uint64_t debug_start = monotonic_ns();
+#endif
+	last_error = NULL;
+	if (parse_params(cd_nelmts, cd_values, &p) < 0)
+	{
+		last_error = "invalid filter parameters (cd_values)";
+		goto error;
+	}
+
+	if (flags & H5Z_FLAG_REVERSE)
+	{
+		ChunkHeader h;
+		long offset = chunk_layout(&p, *buf, nbytes, &h);
+		if (offset < 0)
+		{
+			last_error = "chunk does not match the filter parameters";
+			goto error;
+		}
+		n = h.raw_size;
+
+		// The header gives the exact size, only the decoder overrun is added
+		out = (unsigned char *)malloc(turbopfor_decode_bound(n));
+		if (out == NULL)
+			goto error;
+		if (decode_with_header(&p, &h, (unsigned char *)*buf + offset, nbytes - offset, out) == 0)
+		{
+			free(out);
+			goto error;
+		}
+
+		stats_chunk(&stats.decode, nbytes, n, n, nbytes, start);
+#ifdef DEBUG
+		printf("H5TurboPfor dec : cost %f seconds  \n", (monotonic_ns() - debug_start) / 1e9);
+#endif
+		free(*buf);
+		*buf = out;
+		*buf_size = turbopfor_decode_bound(n);
+		ret_value = n;
+	}
+	else
+	{
+		unsigned char constant[CONSTANT_CHUNK_SIZE];
+		unsigned char *src = constant;
+		n = p.m * element_size(p.type);
+		if (n == 0)
+		{
+			last_error = "unsupported data type";
+			goto error;
+		}
+		if (n != nbytes)
+			goto error;
+
+		// Uniform chunks skip prediction, PFor and the scratch buffer
+		l = encode_constant(&p, *buf, constant);
+		if (l == 0)
+		{
+			src = scratch_get(SCRATCH_OUT, encode_bound(&p));
+			if (src == NULL)
+				goto error;
+			// HDF5 owns *buf, so the delta step may overwrite it
+			l = encode_with_header(&p, *buf, src);
+			if (l == 0)
+				goto error;
+		}
+
+		// Hand HDF5 a buffer of exactly the compressed size
+		out = (unsigned char *)malloc(l);
+		if (out == NULL)
+			goto error;
+		memcpy(out, src, l);
 
+		stats_chunk(&stats.encode, n, l, n, l, start);
 #ifdef DEBUG
-		t = clock() - t;
-		double time_taken = ((double)t) / CLOCKS_PER_SEC; // in seconds
-		printf("H5TurboPfor: ratio = %f (origSize =%u, compSize = %u byte), cost %f seconds  \n", (float)n / (float)l, n, l, time_taken);
+		printf("H5TurboPfor: ratio = %f (origSize =%zu, compSize = %zu byte), cost %f seconds  \n",
+			   (float)n / (float)l, n, l, (monotonic_ns() - debug_start) / 1e9);
 #endif
 
 		if (*buf != NULL)
@@ -227,9 +2134,16 @@ DLL_EXPORT size_t turbopfor_filter(unsigned int flags, size_t cd_nelmts,
 		*buf_size = l;
 		ret_value = l;
 	}
+	scratch_trim();
 	return ret_value;
 
 error:
+	scratch_trim();
+	stats_error((flags & H5Z_FLAG_REVERSE) ? &stats.decode : &stats.encode);
+	H5Epush(H5E_DEFAULT, __FILE__, "turbopfor_filter", __LINE__, H5E_ERR_CLS, H5E_PLINE,
+			H5E_CANTFILTER, "TurboPFor %s failed: %s",
+			(flags & H5Z_FLAG_REVERSE) ? "decoding" : "encoding",
+			last_error != NULL ? last_error : "corrupt chunk or out of memory");
 	return 0;
 }
 
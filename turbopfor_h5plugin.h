@@ -1,3 +1,4 @@
+#include <stdint.h>
 #include "hdf5.h"
 
 #if defined(_MSC_VER)
@@ -15,6 +16,95 @@ extern "C"
                                        const unsigned int cd_values[], size_t nbytes,
                                        size_t *buf_size, void **buf);
 
+    /*
+     * Buffer-to-buffer entry points of the filter pipeline, usable without HDF5.
+     * cd_values has the same layout as for the filter. Both return the number of
+     * bytes written to out, or 0 on error. out_size must be at least
+     * turbopfor_encode_bound(nbytes) for encoding and the raw chunk size for
+     * decoding; decoding straight into out needs turbopfor_decode_bound(raw) bytes,
+     * smaller buffers go through a temporary copy.
+     */
+    DLL_EXPORT size_t turbopfor_encode(size_t cd_nelmts, const unsigned int cd_values[],
+                                       const void *in, size_t nbytes, void *out, size_t out_size);
+    DLL_EXPORT size_t turbopfor_decode(size_t cd_nelmts, const unsigned int cd_values[],
+                                       const void *in, size_t nbytes, void *out, size_t out_size);
+    DLL_EXPORT size_t turbopfor_encode_bound(size_t nbytes);
+
+    /*
+     * Decode sub-block `block` of a chunk stored in the blocked layout (see
+     * OPTION_BLOCK) into out as a contiguous (series length x block width) array.
+     * chunk points at the whole stored chunk. Float chunks come back as their
+     * quantized int32 values. Returns the number of bytes written, 0 on error or
+     * if the chunk is not blocked.
+     */
+    DLL_EXPORT size_t turbopfor_decode_block(const void *chunk, size_t nbytes, size_t block,
+                                             void *out, size_t out_size);
+    DLL_EXPORT size_t turbopfor_decode_bound(size_t nbytes);
+
+    /*
+     * Append nrows rows along the first chunk axis to a stored chunk of nbytes
+     * (nbytes 0 for a chunk that does not exist yet) without re-encoding the
+     * stored rows. rows holds nrows x (elements per row) elements of the
+     * cd_values type. The result is a chunk in the segmented layout: the stored
+     * segments are copied, and the new rows become one more segment, delta
+     * encoded from the last stored row. A segmented chunk must hold exactly
+     * start_row rows. Any other chunk is converted once: its first start_row rows
+     * (fill values if there is no chunk) join the new segment. Rows past the last
+     * segment decode as the fill value. Returns the size written to out, which
+     * needs turbopfor_append_bound(nbytes, raw chunk size) bytes, or 0 on error.
+     */
+    DLL_EXPORT size_t turbopfor_append(size_t cd_nelmts, const unsigned int cd_values[],
+                                       const void *chunk, size_t nbytes, size_t start_row,
+                                       const void *rows, size_t nrows, void *out, size_t out_size);
+    DLL_EXPORT size_t turbopfor_append_bound(size_t nbytes, size_t raw_size);
+
+#define TURBOPFOR_RATIO_BINS 8
+
+    /*
+     * Counters of one direction. calls counts successful chunks (or sub-blocks
+     * for turbopfor_decode_block), errors the failed ones. bytes_in/bytes_out
+     * are what went into and came out of the pipeline, so stored bytes are
+     * bytes_out for encoding and bytes_in for decoding. predict_ns and codec_ns
+     * split the time spent in the delta/predictor step and in PFor or the other
+     * entropy codecs; total_ns covers whole calls, masks and copies included.
+     * Bin 0 of ratio_histogram counts whole chunks with raw/stored ratio below 1,
+     * bin k ratios in [2^(k-1), 2^k), the last bin everything above.
+     */
+    typedef struct TurboPForDirectionStats
+    {
+        uint64_t calls;
+        uint64_t errors;
+        uint64_t bytes_in;
+        uint64_t bytes_out;
+        uint64_t total_ns;
+        uint64_t predict_ns;
+        uint64_t codec_ns;
+        uint64_t ratio_histogram[TURBOPFOR_RATIO_BINS];
+    } TurboPForDirectionStats;
+
+    typedef struct TurboPForStats
+    {
+        TurboPForDirectionStats encode;
+        TurboPForDirectionStats decode;
+    } TurboPForStats;
+
+    /*
+     * Process-wide counters of the filter and the buffer entry points. They are
+     * only collected while enabled: when the environment variable TURBOPFOR_STATS
+     * is set to anything but "0" (read on first use), or after
+     * turbopfor_stats_enable(1), which returns the previous state.
+     */
+    DLL_EXPORT void turbopfor_stats_get(TurboPForStats *out);
+    DLL_EXPORT void turbopfor_stats_reset(void);
+    DLL_EXPORT int turbopfor_stats_enable(int enable);
+
+    /*
+     * Frees the calling thread's scratch buffers. Every call trims buffers above
+     * 8 MiB, and a thread's buffers are freed when it exits; long-lived threads
+     * that are done decoding can call this to give back the rest.
+     */
+    DLL_EXPORT void turbopfor_scratch_release(void);
+
     DLL_EXPORT H5PL_type_t H5PLget_plugin_type(void);
     DLL_EXPORT const void *H5PLget_plugin_info(void);
 